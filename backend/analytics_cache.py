@@ -0,0 +1,242 @@
+"""
+Result cache for the analytics endpoints.
+
+Entries are keyed by (user_id, endpoint, parameters) and remember the date
+range they cover (None = unbounded), so a write to one day only drops the
+entries whose range includes that day. Entries expire after a TTL.
+
+The default backend is an in-process LRU bounded by entry count
+(ANALYTICS_CACHE_MAX_ENTRIES; 0 turns it off). It only suits a single process:
+a write invalidates the cache of the worker that served it, and the other
+workers keep serving the old results until they expire. Setting
+ANALYTICS_CACHE_URL=redis://... switches to a Redis backend shared by every
+worker, so an invalidation in one worker is seen by all of them (configure
+Redis with an LRU maxmemory-policy to bound it).
+
+A fill can race a write: a request reads the old rows, a save commits and
+invalidates, then the request stores what it read. To keep that stale result
+out, every invalidation bumps the user's generation; callers read it before
+querying (generation()) and pass it to set(), which drops the value if the
+generation has moved on since.
+"""
+import json
+import os
+import pickle
+import time
+from collections import OrderedDict
+
+MISS = object()
+
+
+def _overlaps(start_date, end_date, first_day, last_day):
+    return (start_date is None or start_date <= last_day) and (end_date is None or first_day <= end_date)
+
+
+class MemoryBackend:
+    """In-process LRU with per-entry expiry"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, start_date, end_date, value)
+        self._generations = {}  # user_id -> invalidations so far (one int per user who has written)
+        self.evictions = 0
+        self.expirations = 0
+
+    async def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return MISS
+        if entry[0] <= time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            return MISS
+        self._entries.move_to_end(key)
+        return entry[3]
+
+    async def generation(self, user_id):
+        return self._generations.get(user_id, 0)
+
+    async def set(self, key, value, ttl, start_date, end_date, generation):
+        if self._generations.get(key[0], 0) != generation:
+            return False
+        if self.max_entries <= 0:
+            return True
+        self._entries[key] = (time.monotonic() + ttl, start_date, end_date, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return True
+
+    async def invalidate(self, user_id, first_day, last_day):
+        self._generations[user_id] = self._generations.get(user_id, 0) + 1
+        stale = [
+            key for key, (_, start_date, end_date, _) in self._entries.items()
+            if key[0] == user_id and _overlaps(start_date, end_date, first_day, last_day)
+        ]
+        for key in stale:
+            del self._entries[key]
+        return len(stale)
+
+    async def size(self):
+        return len(self._entries)
+
+    async def ping(self):
+        return True
+
+
+# KEYS: entry, index, generation; ARGV: expected generation, value, ttl, index field value
+_SET_IF_CURRENT = """
+if (redis.call('GET', KEYS[3]) or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+redis.call('HSET', KEYS[2], KEYS[1], ARGV[4])
+if redis.call('TTL', KEYS[2]) < tonumber(ARGV[3]) then
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+end
+return 1
+"""
+
+
+class RedisBackend:
+    """
+    Shared backend: one Redis key per entry plus a per-user hash recording each
+    entry's date range and expiry, which invalidate() scans to find the affected
+    keys (and prunes of expired ones). The hash itself expires with its longest-lived
+    entry. The generation check and the write happen in one Lua script, so no
+    invalidation can land between them.
+    """
+
+    # A generation only has to outlive the slowest query that read it
+    GENERATION_TTL = 86400
+
+    def __init__(self, url, prefix="analytics"):
+        import redis.asyncio as redis
+
+        self._redis = redis.from_url(url)
+        self._set_if_current = self._redis.register_script(_SET_IF_CURRENT)
+        self.prefix = prefix
+        self.evictions = 0  # evictions/expirations happen inside Redis
+        self.expirations = 0
+
+    def _key(self, key):
+        return f"{self.prefix}:{key[0]}:{key[1]}:{json.dumps(key[2], default=str)}"
+
+    def _index(self, user_id):
+        return f"{self.prefix}:{user_id}:index"
+
+    def _generation(self, user_id):
+        return f"{self.prefix}:{user_id}:generation"
+
+    async def get(self, key):
+        raw = await self._redis.get(self._key(key))
+        return MISS if raw is None else pickle.loads(raw)
+
+    async def generation(self, user_id):
+        return int(await self._redis.get(self._generation(user_id)) or 0)
+
+    async def set(self, key, value, ttl, start_date, end_date, generation):
+        redis_key = self._key(key)
+        ttl = max(1, int(ttl))
+        span = json.dumps([start_date, end_date, time.time() + ttl], default=str)
+        stored = await self._set_if_current(
+            keys=[redis_key, self._index(key[0]), self._generation(key[0])],
+            args=[str(generation), pickle.dumps(value), ttl, span]
+        )
+        return bool(stored)
+
+    async def invalidate(self, user_id, first_day, last_day):
+        # Bump the generation before reading the index: a fill that lands first is in the index
+        # and gets deleted below, one that lands after is refused by the generation check
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.incr(self._generation(user_id))
+            pipe.expire(self._generation(user_id), self.GENERATION_TTL)
+            pipe.hgetall(self._index(user_id))
+            *_, index = await pipe.execute()
+        first_day, last_day = first_day.isoformat(), last_day.isoformat()
+        now = time.time()
+        stale = []
+        for redis_key, span in index.items():
+            start_date, end_date, expires_at = json.loads(span)
+            # ISO dates compare correctly as strings; expired entries are pruned from the index too
+            if expires_at <= now or _overlaps(start_date, end_date, first_day, last_day):
+                stale.append(redis_key)
+        if stale:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                pipe.delete(*stale)
+                pipe.hdel(self._index(user_id), *stale)
+                await pipe.execute()
+        return len(stale)
+
+    async def size(self):
+        return None
+
+    async def ping(self):
+        return await self._redis.ping()
+
+
+class AnalyticsCache:
+    def __init__(self, backend, ttl=300.0):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.stale_fills = 0
+
+    async def get(self, user_id, endpoint, params):
+        value = await self.backend.get((user_id, endpoint, params))
+        if value is MISS:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def generation(self, user_id):
+        """The user's current generation; read it before querying and pass it to set()"""
+        return await self.backend.generation(user_id)
+
+    async def set(self, user_id, endpoint, params, value, generation, start_date=None, end_date=None):
+        """
+        Store a result covering the inclusive [start_date, end_date] range (None = unbounded),
+        unless the user's data was invalidated since `generation` was read.
+        """
+        if not await self.backend.set((user_id, endpoint, params), value, self.ttl, start_date, end_date, generation):
+            self.stale_fills += 1
+
+    async def invalidate(self, user_id, day, last_day=None):
+        """Drop every entry for user_id whose date range includes `day` (or overlaps [day, last_day])"""
+        removed = await self.backend.invalidate(user_id, day, last_day or day)
+        self.invalidations += removed
+        return removed
+
+    async def ping(self):
+        """Check that the backend is reachable (raises if Redis is down)"""
+        return await self.backend.ping()
+
+    async def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": await self.backend.size(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.backend.evictions,
+            "expirations": self.backend.expirations,
+            "invalidations": self.invalidations,
+            "stale_fills": self.stale_fills,
+        }
+
+
+def _create_cache():
+    url = os.getenv("ANALYTICS_CACHE_URL")
+    if url:
+        backend = RedisBackend(url)
+    else:
+        backend = MemoryBackend(max_entries=int(os.getenv("ANALYTICS_CACHE_MAX_ENTRIES", "10000")))
+    return AnalyticsCache(backend, ttl=float(os.getenv("ANALYTICS_CACHE_TTL", "300")))
+
+
+cache = _create_cache()
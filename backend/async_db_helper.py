@@ -0,0 +1,427 @@
+"""
+Async counterpart of db_helper for the API server.
+
+Same functions and SQL as db_helper, executed through aiomysql on an
+asyncio connection pool so a single worker can serve many concurrent
+requests without tying up a thread per query. Scripts and CLIs keep using
+the synchronous db_helper. Reads are routed to db_helper.REPLICA_HOSTS the
+same way (see replicas.py), each replica with its own pool.
+"""
+import aiomysql
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from logging_setup import setup_logger
+import db_helper
+import rollups
+import budgets
+import replicas
+from metrics import instrument_db, DB_ACQUIRE
+import profiling
+import os
+
+logger = setup_logger('async_db_helper', sampled=True)
+
+_pools = {}  # None -> the primary's pool, "host:port" -> a replica's
+_pool_lock = asyncio.Lock()
+replica_set = replicas.ReplicaSet(db_helper.REPLICA_HOSTS)
+
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+# Errors that mean a server could not be reached or dropped the connection (not a bad query)
+CONNECTION_ERRORS = (aiomysql.OperationalError, aiomysql.InterfaceError)
+
+# Checkout counters reported by get_pool_stats()
+_stats = {"checkouts": 0, "timeouts": 0, "wait_total": 0.0, "wait_max": 0.0}
+
+
+async def get_pool(replica=None):
+    """Return the process-wide aiomysql pool of the primary (or of `replica`), creating it on first use"""
+    if replica not in _pools:
+        async with _pool_lock:
+            if replica not in _pools:
+                host, port = db_helper.REPLICA_HOSTS[replica] if replica else (os.getenv("DB_HOST", "localhost"),
+                                                                               int(os.getenv("DB_PORT", "3306")))
+                _pools[replica] = await aiomysql.create_pool(
+                    host=host,
+                    user=os.getenv("DB_USER", "root"),
+                    password=os.getenv("DB_PASSWORD", "root"),
+                    db=os.getenv("DB_NAME", "expense_manager"),
+                    port=port,
+                    minsize=int(os.getenv("DB_ASYNC_POOL_MIN", "1")),
+                    maxsize=int(os.getenv("DB_ASYNC_POOL_SIZE", "50")),
+                    pool_recycle=int(float(os.getenv("DB_POOL_MAX_AGE", "1800"))),
+                    connect_timeout=db_helper.CONNECT_TIMEOUT,
+                    autocommit=True
+                )
+    return _pools[replica]
+
+
+async def close_pool():
+    while _pools:
+        _, pool = _pools.popitem()
+        pool.close()
+        await pool.wait_closed()
+
+
+async def _acquire(replica):
+    """
+    A connection from `replica`'s pool, or from the primary's if it is None or unreachable.
+    Returns (pool, connection, the replica it came from or None).
+    """
+    if replica is not None:
+        try:
+            pool = await get_pool(replica)
+            return pool, await asyncio.wait_for(pool.acquire(), POOL_TIMEOUT), replica
+        except Exception as e:
+            # A busy replica (timed out waiting for its pool) stays in rotation; this read just goes to the primary
+            if isinstance(e, CONNECTION_ERRORS):
+                replica_set.mark_down(replica, e)
+    pool = await get_pool()
+    try:
+        return pool, await asyncio.wait_for(pool.acquire(), POOL_TIMEOUT), None
+    except asyncio.TimeoutError:
+        _stats["timeouts"] += 1
+        raise
+
+
+def get_pool_stats():
+    """Primary pool size, connections in use, checkout wait times and timeouts, plus replica health"""
+    pool = _pools.get(None)
+    checkouts = _stats["checkouts"]
+    size = pool.size if pool is not None else 0
+    idle = pool.freesize if pool is not None else 0
+    return {
+        "max_size": pool.maxsize if pool is not None else int(os.getenv("DB_ASYNC_POOL_SIZE", "50")),
+        "size": size,
+        "in_use": size - idle,
+        "idle": idle,
+        "checkouts": checkouts,
+        "timeouts": _stats["timeouts"],
+        "wait_time_total_ms": round(_stats["wait_total"] * 1000, 3),
+        "wait_time_avg_ms": round(_stats["wait_total"] * 1000 / checkouts, 3) if checkouts else 0.0,
+        "wait_time_max_ms": round(_stats["wait_max"] * 1000, 3),
+        **(replica_set.stats() if replica_set.replicas else {}),
+    }
+
+
+# Database connection context manager
+@asynccontextmanager
+async def get_db_cursor(commit=False, cursor_class=aiomysql.DictCursor, replica=False, user_key=None):
+    """Async db_helper.get_db_cursor: commit=True on the primary, replica=True may read from a replica"""
+    start = time.monotonic()
+    target = replica_set.choose(user_key) if replica and not commit else None
+    pool, connection, target = await _acquire(target)
+    if replica:
+        replica_set.record(target)
+    acquired = time.monotonic()
+    waited = acquired - start
+    DB_ACQUIRE.observe(waited, "async")
+    profiling.record("db_connect", waited)
+    _stats["checkouts"] += 1
+    _stats["wait_total"] += waited
+    _stats["wait_max"] = max(_stats["wait_max"], waited)
+
+    try:
+        # The pool drops connections closed by the server or older than pool_recycle on acquire,
+        # and closes any that come back with an open transaction
+        if commit:
+            await connection.begin()
+        cursor = await connection.cursor(cursor_class)
+        try:
+            yield cursor
+            if commit:
+                await connection.commit()
+                replicas.note_write(user_key)
+        except BaseException as e:
+            if commit:
+                await connection.rollback()
+            if target is not None and isinstance(e, CONNECTION_ERRORS):
+                replica_set.mark_down(target, e)
+                raise replicas.ReplicaFailed(target) from e
+            raise
+        finally:
+            await cursor.close()
+            profiling.record("db_query", time.monotonic() - acquired)
+    finally:
+        pool.release(connection)
+
+
+async def ping():
+    """Run a trivial query on a pooled connection, opening the pool if needed (warmup and readiness checks)"""
+    async with get_db_cursor() as cursor:
+        await cursor.execute("SELECT 1")
+        await cursor.fetchall()
+
+
+# User functions
+@instrument_db
+async def create_user(actual_name, username, password_hash):
+    """Create a new user; `password_hash` comes from passwords.hash_password_async"""
+    async with get_db_cursor(commit=True, user_key=username) as cursor:
+        await cursor.execute(db_helper.INSERT_USER, (actual_name, username, password_hash))
+
+
+@instrument_db
+@replicas.retry_on_primary
+async def get_user_by_username(username):
+    """Fetch user details by username"""
+    async with get_db_cursor(replica=True, user_key=username) as cursor:
+        await cursor.execute(db_helper.SELECT_USER_BY_USERNAME, (username,))
+        return await cursor.fetchone()
+
+
+@instrument_db
+async def update_password_hash(user_id, password_hash, old_password_hash):
+    """Replace a user's stored password, unless it changed since `old_password_hash` was read"""
+    async with get_db_cursor(commit=True, user_key=user_id) as cursor:
+        await cursor.execute(db_helper.UPDATE_PASSWORD_HASH, (password_hash, user_id, old_password_hash))
+
+
+# Expense functions
+@instrument_db
+@replicas.retry_on_primary
+async def fetch_expenses_for_date(expense_date, user_id):
+    logger.info("fetch_expenses_for_date called with %s, user_id=%s", expense_date, user_id)
+    async with get_db_cursor(replica=True, user_key=user_id) as cursor:
+        await cursor.execute(db_helper.SELECT_EXPENSES_FOR_DATE, (expense_date, user_id))
+        return await cursor.fetchall()
+
+
+@instrument_db
+@replicas.retry_on_primary
+async def fetch_expenses_in_range(user_id, start_date, end_date, category=None, min_amount=None, max_amount=None,
+                                  after=None, limit=100):
+    logger.info("fetch_expenses_in_range called with start: %s, end: %s, user_id=%s",
+                start_date, end_date, user_id)
+    query, params = db_helper.expense_range_query(user_id, start_date, end_date, category, min_amount, max_amount,
+                                                  after, limit)
+    async with get_db_cursor(replica=True, user_key=user_id) as cursor:
+        await cursor.execute(query, params)
+        return await cursor.fetchall()
+
+
+@instrument_db
+async def stream_expenses(user_id, start_date=None, end_date=None, batch_size=1000):
+    """
+    Yield all of a user's expenses (optionally within a date range) in date order, batch_size rows at a time.
+    Rows come from an unbuffered server-side cursor, so memory stays flat whatever the history size;
+    the pooled connection is held until the generator is exhausted or closed.
+    """
+    logger.info("stream_expenses called with start: %s, end: %s, user_id=%s", start_date, end_date, user_id)
+    query, params = db_helper.expense_export_query(user_id, start_date, end_date)
+    async with get_db_cursor(cursor_class=aiomysql.SSDictCursor, replica=True, user_key=user_id) as cursor:
+        await cursor.execute(query, params)
+        while True:
+            rows = await cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+
+
+async def _update_rollups(cursor, expense_date, user_id, removed=(), added=()):
+    deltas = rollups.compute_deltas(removed=removed, added=added)
+    for sql, params, many in rollups.delta_statements(user_id, expense_date, deltas):
+        if many:
+            await cursor.executemany(sql, params)
+        else:
+            await cursor.execute(sql, params)
+
+
+async def _lock_day_totals(cursor, expense_date, user_id):
+    await cursor.execute(rollups.DAY_CATEGORY_TOTALS_FOR_UPDATE, (expense_date, user_id))
+    return await cursor.fetchall()
+
+
+@instrument_db
+async def delete_expenses_for_date(expense_date, user_id):
+    logger.info("delete_expenses_for_date called with %s, user_id=%s", expense_date, user_id)
+    async with get_db_cursor(commit=True, user_key=user_id) as cursor:
+        removed = await _lock_day_totals(cursor, expense_date, user_id)
+        await cursor.execute(db_helper.DELETE_EXPENSES_FOR_DATE, (expense_date, user_id))
+        await _update_rollups(cursor, expense_date, user_id, removed=removed)
+
+
+@instrument_db
+async def insert_expense(expense_date, amount, category, notes, user_id):
+    logger.info("insert_expense called with date: %s, amount: %s, category: %s, user_id=%s",
+                expense_date, amount, category, user_id)
+    category = category.capitalize()
+    amount = rollups.to_decimal(amount)
+    async with get_db_cursor(commit=True, user_key=user_id) as cursor:
+        await cursor.execute(db_helper.INSERT_EXPENSE, (expense_date, amount, category, notes, user_id))
+        await _update_rollups(cursor, expense_date, user_id, added=[(category, amount)])
+
+
+@instrument_db
+async def replace_expenses_for_date(expense_date, expenses, user_id):
+    """Async db_helper.replace_expenses_for_date: one transaction, batched multi-row INSERTs"""
+    logger.info("replace_expenses_for_date called with %s, user_id=%s", expense_date, user_id)
+    rows = [
+        (expense_date, rollups.to_decimal(amount), category.capitalize(), notes, user_id)
+        for amount, category, notes in expenses
+    ]
+    batch_size = db_helper.INSERT_BATCH_SIZE
+    async with get_db_cursor(commit=True, user_key=user_id) as cursor:
+        removed = await _lock_day_totals(cursor, expense_date, user_id)
+        await cursor.execute(db_helper.DELETE_EXPENSES_FOR_DATE, (expense_date, user_id))
+        for start in range(0, len(rows), batch_size):
+            await cursor.executemany(db_helper.INSERT_EXPENSE, rows[start:start + batch_size])
+        await _update_rollups(cursor, expense_date, user_id, removed=removed,
+                              added=[(row[2], row[1]) for row in rows])
+    return {"inserted": len(rows), "deleted": sum(int(row['expense_count']) for row in removed),
+            "categories": sorted({row['category'] for row in removed})}
+
+
+@instrument_db
+async def update_expenses_for_date(expense_date, inserts, updates, deletes, user_id):
+    """Async db_helper.update_expenses_for_date: writes only the inserted, updated and deleted rows"""
+    logger.info("update_expenses_for_date called with %s, user_id=%s: %s inserts, %s updates, %s deletes",
+                expense_date, user_id, len(inserts), len(updates), len(deletes))
+    inserts = [
+        (expense_date, rollups.to_decimal(amount), category.capitalize(), notes, user_id)
+        for amount, category, notes in inserts
+    ]
+    updates = [
+        (rollups.to_decimal(amount), category.capitalize(), notes, expense_id, expense_date, user_id)
+        for expense_id, amount, category, notes in updates
+    ]
+    ids = [row[3] for row in updates] + list(deletes)
+    batch_size = db_helper.INSERT_BATCH_SIZE
+    async with get_db_cursor(commit=True, user_key=user_id) as cursor:
+        locked = []
+        if ids:
+            await cursor.execute(*db_helper.lock_expenses_query(expense_date, user_id, ids))
+            locked = await cursor.fetchall()
+        removed = db_helper.changed_rows(ids, locked)
+        if deletes:
+            await cursor.execute(*db_helper.delete_expenses_query(expense_date, user_id, deletes))
+        if updates:
+            await cursor.executemany(db_helper.UPDATE_EXPENSE, updates)
+        for start in range(0, len(inserts), batch_size):
+            await cursor.executemany(db_helper.INSERT_EXPENSE, inserts[start:start + batch_size])
+        await _update_rollups(cursor, expense_date, user_id, removed=removed,
+                              added=[(row[1], row[0]) for row in updates] + [(row[2], row[1]) for row in inserts])
+    return {"inserted": len(inserts), "updated": len(updates), "deleted": len(deletes),
+            "categories": sorted({row['category'] for row in removed})}
+
+
+@instrument_db
+async def insert_expenses_batch(rows, user_id):
+    """
+    Insert (expense_date, amount, category, notes) rows spanning any dates in one transaction,
+    using multi-row INSERTs, and add them to the rollups. Used by bulk import.
+    """
+    logger.info("insert_expenses_batch called with %s rows, user_id=%s", len(rows), user_id)
+    rows = [
+        (expense_date, rollups.to_decimal(amount), category.capitalize(), notes, user_id)
+        for expense_date, amount, category, notes in rows
+    ]
+    async with get_db_cursor(commit=True, user_key=user_id) as cursor:
+        await cursor.executemany(db_helper.INSERT_EXPENSE, rows)
+        for sql, params, many in rollups.insert_statements(user_id, [(r[0], r[2], r[1]) for r in rows]):
+            await cursor.executemany(sql, params)
+    return len(rows)
+
+
+@instrument_db
+@replicas.retry_on_primary
+async def fetch_expense_summary_by_catrgory(start_date, end_date, user_id):
+    logger.info("fetch_expense_summary called with start: %s, end: %s, user_id=%s",
+                start_date, end_date, user_id)
+    if start_date > end_date:
+        return []
+    query, params = rollups.category_summary_query(user_id, start_date, end_date)
+    async with get_db_cursor(replica=True, user_key=user_id) as cursor:
+        await cursor.execute(query, params)
+        return await cursor.fetchall()
+
+
+@instrument_db
+@replicas.retry_on_primary
+async def fetch_expense_summary_by_month(user_id, year=None, start_date=None, end_date=None):
+    logger.info("fetch_expense_summary_by_month called with user_id=%s, year=%s, start: %s, end: %s",
+                user_id, year, start_date, end_date)
+    start_date, end_date = db_helper.monthly_summary_bounds(year, start_date, end_date)
+    if start_date is not None and end_date is not None and start_date > end_date:
+        return []
+
+    query, params = rollups.monthly_summary_query(user_id, start_date, end_date)
+    async with get_db_cursor(replica=True, user_key=user_id) as cursor:
+        await cursor.execute(query, params)
+        rows = await cursor.fetchall()
+    with profiling.phase("aggregate"):
+        return db_helper.format_monthly_summary(rows)
+
+
+@instrument_db
+@replicas.retry_on_primary
+async def fetch_expense_series(user_id, start_date, end_date, period, by_category=False):
+    """Async db_helper.fetch_expense_series: bucketed spending, oldest first"""
+    logger.info("fetch_expense_series called with start: %s, end: %s, period: %s, by_category: %s, user_id=%s",
+                start_date, end_date, period, by_category, user_id)
+    if start_date > end_date:
+        return []
+    async with get_db_cursor(replica=True, user_key=user_id) as cursor:
+        await cursor.execute(*rollups.series_query(user_id, start_date, end_date, period, by_category))
+        return await cursor.fetchall()
+
+
+@instrument_db
+@replicas.retry_on_primary
+async def fetch_dashboard(user_id, expense_date, start_date=None, end_date=None, monthly=True):
+    """
+    One day's expenses, plus the category summary for [start_date, end_date] when given and the
+    monthly summary when `monthly`, read back to back over a single pooled connection.
+    Returns {"expenses": [...], "by_category": [...] or None, "by_month": [...] or None}.
+    """
+    logger.info("fetch_dashboard called with date: %s, start: %s, end: %s, user_id=%s",
+                expense_date, start_date, end_date, user_id)
+    result = {"expenses": [], "by_category": None, "by_month": None}
+    async with get_db_cursor(replica=True, user_key=user_id) as cursor:
+        await cursor.execute(db_helper.SELECT_EXPENSES_FOR_DATE, (expense_date, user_id))
+        result["expenses"] = await cursor.fetchall()
+        if start_date is not None and end_date is not None:
+            result["by_category"] = []
+            if start_date <= end_date:
+                await cursor.execute(*rollups.category_summary_query(user_id, start_date, end_date))
+                result["by_category"] = await cursor.fetchall()
+        if monthly:
+            await cursor.execute(*rollups.monthly_summary_query(user_id))
+            month_rows = await cursor.fetchall()
+    if monthly:
+        with profiling.phase("aggregate"):
+            result["by_month"] = db_helper.format_monthly_summary(month_rows)
+    return result
+
+
+# Budget functions
+@instrument_db
+async def set_budget(user_id, category, monthly_limit):
+    """Create or change the user's monthly limit for `category`"""
+    logger.info("set_budget called with category: %s, limit: %s, user_id=%s", category, monthly_limit, user_id)
+    category = category.capitalize()
+    async with get_db_cursor(commit=True, user_key=user_id) as cursor:
+        await cursor.execute(budgets.UPSERT_BUDGET, (user_id, category, monthly_limit))
+
+
+@instrument_db
+async def delete_budget(user_id, category):
+    """Remove the user's budget for `category`; False if there was none"""
+    logger.info("delete_budget called with category: %s, user_id=%s", category, user_id)
+    category = category.capitalize()
+    async with get_db_cursor(commit=True, user_key=user_id) as cursor:
+        await cursor.execute(budgets.DELETE_BUDGET, (user_id, category))
+        return cursor.rowcount > 0
+
+
+@instrument_db
+@replicas.retry_on_primary
+async def fetch_budget_status(user_id, month, categories=None):
+    """Async db_helper.fetch_budget_status: budgets with the month's spending, from the running totals"""
+    logger.info("fetch_budget_status called with month: %s, categories: %s, user_id=%s", month, categories, user_id)
+    if categories is not None and not categories:
+        return []
+    async with get_db_cursor(replica=True, user_key=user_id) as cursor:
+        await cursor.execute(*budgets.status_query(user_id, month, categories))
+        rows = await cursor.fetchall()
+    return budgets.with_status(month, rows)
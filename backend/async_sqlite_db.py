@@ -0,0 +1,125 @@
+"""
+Async counterpart of sqlite_db for the API server (DB_BACKEND=sqlite).
+
+sqlite3 has no async driver; its calls take well under a millisecond, so
+each one runs on a small dedicated thread pool (each worker keeps its own
+connection) instead of tying up the event loop or the default threadpool.
+The request's context is carried over so profiling phases still land in
+the request's Server-Timing breakdown.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import sqlite_db
+
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("SQLITE_WORKERS", "4")),
+    thread_name_prefix="sqlite"
+)
+
+
+async def _run(func, *args, **kwargs):
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, func, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(_executor, call)
+
+
+async def close_pool():
+    await _run(sqlite_db.close_all)
+
+
+def get_pool_stats():
+    return sqlite_db.get_pool_stats()
+
+
+async def ping():
+    await _run(sqlite_db.ping)
+
+
+# User functions
+async def create_user(actual_name, username, password_hash):
+    return await _run(sqlite_db.create_user, actual_name, username, password_hash)
+
+
+async def get_user_by_username(username):
+    return await _run(sqlite_db.get_user_by_username, username)
+
+
+async def update_password_hash(user_id, password_hash, old_password_hash):
+    return await _run(sqlite_db.update_password_hash, user_id, password_hash, old_password_hash)
+
+
+# Expense functions
+async def fetch_expenses_for_date(expense_date, user_id):
+    return await _run(sqlite_db.fetch_expenses_for_date, expense_date, user_id)
+
+
+async def fetch_expenses_in_range(user_id, start_date, end_date, category=None, min_amount=None, max_amount=None,
+                                  after=None, limit=100):
+    return await _run(sqlite_db.fetch_expenses_in_range, user_id, start_date, end_date, category,
+                      min_amount, max_amount, after, limit)
+
+
+async def stream_expenses(user_id, start_date=None, end_date=None, batch_size=1000):
+    """Yield batches from sqlite_db.iter_expenses, fetching each one on the worker pool"""
+    batches = sqlite_db.iter_expenses(user_id, start_date, end_date, batch_size)
+    try:
+        while True:
+            batch = await _run(next, batches, None)
+            if batch is None:
+                break
+            yield batch
+    finally:
+        await _run(batches.close)
+
+
+async def delete_expenses_for_date(expense_date, user_id):
+    return await _run(sqlite_db.delete_expenses_for_date, expense_date, user_id)
+
+
+async def insert_expense(expense_date, amount, category, notes, user_id):
+    return await _run(sqlite_db.insert_expense, expense_date, amount, category, notes, user_id)
+
+
+async def replace_expenses_for_date(expense_date, expenses, user_id):
+    return await _run(sqlite_db.replace_expenses_for_date, expense_date, expenses, user_id)
+
+
+async def update_expenses_for_date(expense_date, inserts, updates, deletes, user_id):
+    return await _run(sqlite_db.update_expenses_for_date, expense_date, inserts, updates, deletes, user_id)
+
+
+async def insert_expenses_batch(rows, user_id):
+    return await _run(sqlite_db.insert_expenses_batch, rows, user_id)
+
+
+async def fetch_expense_summary_by_catrgory(start_date, end_date, user_id):
+    return await _run(sqlite_db.fetch_expense_summary_by_catrgory, start_date, end_date, user_id)
+
+
+async def fetch_expense_summary_by_month(user_id, year=None, start_date=None, end_date=None):
+    return await _run(sqlite_db.fetch_expense_summary_by_month, user_id, year, start_date, end_date)
+
+
+async def fetch_expense_series(user_id, start_date, end_date, period, by_category=False):
+    return await _run(sqlite_db.fetch_expense_series, user_id, start_date, end_date, period, by_category)
+
+
+async def fetch_dashboard(user_id, expense_date, start_date=None, end_date=None, monthly=True):
+    return await _run(sqlite_db.fetch_dashboard, user_id, expense_date, start_date, end_date, monthly)
+
+
+# Budget functions
+async def set_budget(user_id, category, monthly_limit):
+    return await _run(sqlite_db.set_budget, user_id, category, monthly_limit)
+
+
+async def delete_budget(user_id, category):
+    return await _run(sqlite_db.delete_budget, user_id, category)
+
+
+async def fetch_budget_status(user_id, month, categories=None):
+    return await _run(sqlite_db.fetch_budget_status, user_id, month, categories)
@@ -3,13 +3,25 @@ from pydantic import BaseModel, Field, model_validator
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-import db_helper
+from collections import OrderedDict
+from logging_setup import setup_logger
+from storage import async_db
+import passwords
+import profiling
+import time
+import os
 
 # JWT Configuration
 SECRET_KEY = "your-secret-key-change-this-to-random-string-in-production-12345"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 480  # 8 hours
 
+# Already-verified tokens: token -> (user_id, exp). Bounded LRU; entries are only used before exp.
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+_verified_tokens = OrderedDict()
+
+logger = setup_logger('auth')
+
 security = HTTPBearer()
 
 # Create router for auth endpoints
@@ -25,9 +37,18 @@ def create_access_token(data: dict):
     return encoded_jwt
 
 
-def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+@profiling.timed("auth")
+async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Verify JWT token and return user_id"""
     token = credentials.credentials
+
+    cached = _verified_tokens.get(token)
+    if cached is not None:
+        if cached[1] > time.time():
+            _verified_tokens.move_to_end(token)
+            return cached[0]
+        _verified_tokens.pop(token, None)
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: int = payload.get("user_id")
@@ -36,9 +57,13 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
                 status_code=401,
                 detail="Invalid authentication credentials"
             )
+        if "exp" in payload:
+            _verified_tokens[token] = (user_id, payload["exp"])
+            if len(_verified_tokens) > TOKEN_CACHE_SIZE:
+                _verified_tokens.popitem(last=False)
         return user_id
     except JWTError as e:
-        print(f"Token verification failed: {str(e)}")
+        logger.warning("Token verification failed: %s", e)
         raise HTTPException(
             status_code=401,
             detail="Invalid or expired token"
@@ -71,14 +96,15 @@ class UserLogin(BaseModel):
 # Authentication Endpoints
 
 @router.post('/signup')
-def signup(request: UserSignup):
+async def signup(request: UserSignup):
     try:
-        existing_user = db_helper.get_user_by_username(request.username)
+        existing_user = await async_db.get_user_by_username(request.username)
         if existing_user:
             raise HTTPException(status_code=400, detail="Username already exists")
 
-        db_helper.create_user(request.actual_name, request.username, request.password)
-        print(f"User created: {request.username}")
+        password_hash = await passwords.hash_password_async(request.password)
+        await async_db.create_user(request.actual_name, request.username, password_hash)
+        logger.info("User created: %s", request.username)
 
         return {"message": "User created successfully"}
     except HTTPException:
@@ -86,24 +112,33 @@ def signup(request: UserSignup):
     except ValueError as ve:
         raise HTTPException(status_code=400, detail=str(ve))
     except Exception as e:
-        print(f"Error during signup: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error during signup: %s", e)
         raise HTTPException(status_code=500, detail=f"Error creating user: {str(e)}")
 
 
 @router.post('/login')
-def login(request: UserLogin):
+async def login(request: UserLogin):
     try:
-        user = db_helper.get_user_by_username(request.username)
+        user = await async_db.get_user_by_username(request.username)
 
-        if not user:
+        # Unknown usernames still pay for a hash check so response time doesn't reveal them
+        password_ok = await passwords.verify_password_async(
+            request.password, user['password_hash'] if user else None
+        )
+        if not user or not password_ok:
             raise HTTPException(status_code=401, detail="Invalid username or password")
 
-        if not db_helper.verify_password(request.password, user['password_hash']):
-            raise HTTPException(status_code=401, detail="Invalid username or password")
+        # Transparently upgrade legacy plain text (or outdated) hashes; the password is already
+        # verified, so a failed upgrade must not fail the login (it is retried on the next one)
+        if passwords.needs_rehash(user['password_hash']):
+            try:
+                new_hash = await passwords.hash_password_async(request.password)
+                await async_db.update_password_hash(user['id'], new_hash, user['password_hash'])
+                logger.info("Upgraded password hash for: %s", request.username)
+            except Exception as e:
+                logger.warning("Could not upgrade password hash for %s: %s", request.username, e)
 
-        print(f"User logged in: {request.username}")
+        logger.info("User logged in: %s", request.username)
 
         # Create JWT access token
         access_token = create_access_token(data={"user_id": user['id']})
@@ -121,7 +156,5 @@ def login(request: UserLogin):
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error during login: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error during login: %s", e)
         raise HTTPException(status_code=500, detail=f"Error during login: {str(e)}")
\ No newline at end of file
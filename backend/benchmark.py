@@ -0,0 +1,356 @@
+"""
+Micro-benchmarks for db_helper and the API routes at several history sizes.
+
+A seeded generator creates synthetic users whose expense histories look like
+real ones (monthly rent, frequent small food purchases, weekend-heavy
+entertainment, occasional large shopping). Every db_helper function and every
+route (called in-process through FastAPI's TestClient) is then timed against
+each history size, and the results are written as JSON.
+
+    python benchmark.py run --sizes 100,1000,10000 --output bench.json
+    python benchmark.py compare baseline.json bench.json    # exit 1 on regressions
+
+Runs against the storage backend selected by DB_BACKEND (set DB_BACKEND=sqlite
+for a local stand-in that needs no MySQL server); benchmark
+users are named bench_* and are removed afterwards unless --keep is given.
+"""
+import argparse
+import contextlib
+import json
+import math
+import platform
+import random
+import statistics
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+import passwords
+import storage
+from storage import db
+
+USERNAME_PREFIX = "bench_"
+
+# category -> (expected purchases per day, median amount, amount spread (lognormal sigma))
+CATEGORY_PROFILES = {
+    "Food": (1.2, 12.0, 0.6),
+    "Shopping": (0.25, 45.0, 0.9),
+    "Entertainment": (0.2, 25.0, 0.7),
+    "Other": (0.1, 30.0, 1.0),
+}
+RENT_AMOUNT = (900.0, 2200.0)
+NOTES = {
+    "Rent": ["Monthly rent"],
+    "Food": ["Groceries", "Lunch", "Coffee", "Dinner out", "Snacks"],
+    "Shopping": ["Clothes", "Electronics", "Household", "Gift"],
+    "Entertainment": ["Movie", "Concert", "Streaming", "Games"],
+    "Other": ["Transport", "Pharmacy", "Haircut", ""],
+}
+
+
+# Synthetic data
+
+def generate_expenses(rng, count, end_date=None):
+    """
+    Return `count` (expense_date, amount, category, notes) rows ending at end_date, oldest first.
+    Purchases are Poisson-distributed per day (more at weekends), with lognormal amounts per
+    category and rent on the 1st of each month; the history reaches back as far as `count` needs.
+    """
+    day = end_date or date.today()
+    categories = list(CATEGORY_PROFILES)
+    weights = [CATEGORY_PROFILES[c][0] for c in categories]
+    per_day = sum(weights)
+    rent = round(rng.uniform(*RENT_AMOUNT), -1)
+
+    rows = []
+    while len(rows) < count:
+        if day.day == 1:
+            rows.append((day, rent, "Rent", NOTES["Rent"][0]))
+        weekend = day.weekday() >= 5
+        for _ in range(_poisson(rng, per_day * (1.4 if weekend else 0.85))):
+            category = rng.choices(categories, weights)[0]
+            _, median, sigma = CATEGORY_PROFILES[category]
+            amount = round(rng.lognormvariate(math.log(median), sigma), 2)
+            rows.append((day, max(amount, 0.5), category, rng.choice(NOTES[category])))
+        day -= timedelta(days=1)
+    return sorted(rows[:count], key=lambda row: row[0])
+
+
+def _poisson(rng, rate):
+    # Knuth's method; rates here are small
+    limit, k, p = math.exp(-rate), 0, 1.0
+    while True:
+        p *= rng.random()
+        if p <= limit:
+            return k
+        k += 1
+
+
+def create_dataset(rng, users, sizes):
+    """Create `users` users per history size; returns {size: [(user_id, username, rows), ...]}"""
+    password_hash = passwords.hash_password("Bench-password-1")
+    run_tag = f"{int(time.time())}_{rng.randrange(10 ** 6)}"
+    dataset = {}
+    for size in sizes:
+        dataset[size] = []
+        for index in range(users):
+            username = f"{USERNAME_PREFIX}{run_tag}_{size}_{index}"
+            db.create_user(f"Bench user {index}", username, password_hash)
+            user_id = db.get_user_by_username(username)["id"]
+            rows = generate_expenses(rng, size)
+            for start in range(0, len(rows), db.INSERT_BATCH_SIZE):
+                db.insert_expenses_batch(rows[start:start + db.INSERT_BATCH_SIZE], user_id)
+            dataset[size].append((user_id, username, rows))
+    return dataset
+
+
+def drop_benchmark_users():
+    """Delete every bench_* user with their expenses and rollup rows"""
+    mark = "?" if storage.DB_BACKEND == "sqlite" else "%s"
+    with db.get_db_cursor(commit=True) as cursor:
+        cursor.execute(f"SELECT id FROM users WHERE username LIKE {mark}", (USERNAME_PREFIX + "%",))
+        user_ids = [row["id"] for row in cursor.fetchall()]
+        for user_id in user_ids:
+            for table in ("expense_daily_rollup", "expense_monthly_rollup", "expenses", "users"):
+                column = "id" if table == "users" else "user_id"
+                cursor.execute(f"DELETE FROM {table} WHERE {column} = {mark}", (user_id,))
+    return len(user_ids)
+
+
+# Timing
+
+def measure(func, repeat, warmup=2):
+    """Call func() warmup + repeat times; return timing statistics in milliseconds"""
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "runs": repeat,
+        "min_ms": round(samples[0], 3),
+        "median_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        "mean_ms": round(statistics.fmean(samples), 3),
+    }
+
+
+def _busiest_day(rows):
+    counts = {}
+    for row in rows:
+        counts[row[0]] = counts.get(row[0], 0) + 1
+    return max(counts, key=counts.get)
+
+
+def db_cases(user_id, username, rows):
+    """(name, callable) pairs exercising each db_helper function on one user's history"""
+    first_day, last_day = rows[0][0], rows[-1][0]
+    busy_day = _busiest_day(rows)
+    day_rows = [(amount, category, notes) for day, amount, category, notes in rows if day == busy_day]
+    scratch_day = last_day + timedelta(days=365)
+
+    # One note edited on the busiest day; runs before replace_expenses_for_date, which renumbers the day's ids
+    edited = db.fetch_expenses_for_date(busy_day, user_id)[0]
+
+    def edit_one_note():
+        db.update_expenses_for_date(
+            busy_day, [], [(edited['id'], edited['amount'], edited['category'], "bench edit")], [], user_id
+        )
+
+    def write_then_delete():
+        db.insert_expense(scratch_day, 10.0, "Food", "bench", user_id)
+        db.delete_expenses_for_date(scratch_day, user_id)
+
+    def batch_then_delete():
+        db.insert_expenses_batch([(scratch_day, amount, category, notes)
+                                         for amount, category, notes in day_rows], user_id)
+        db.delete_expenses_for_date(scratch_day, user_id)
+
+    return [
+        ("get_user_by_username", lambda: db.get_user_by_username(username)),
+        ("fetch_expenses_for_date", lambda: db.fetch_expenses_for_date(busy_day, user_id)),
+        ("fetch_expenses_in_range", lambda: db.fetch_expenses_in_range(user_id, first_day, last_day)),
+        ("iter_expenses", lambda: sum(len(batch) for batch in db.iter_expenses(user_id))),
+        ("fetch_expense_summary_by_catrgory",
+         lambda: db.fetch_expense_summary_by_catrgory(first_day, last_day, user_id)),
+        ("fetch_expense_summary_by_month", lambda: db.fetch_expense_summary_by_month(user_id)),
+        ("fetch_expense_summary_by_month(year)",
+         lambda: db.fetch_expense_summary_by_month(user_id, year=last_day.year)),
+        ("fetch_expense_series(week, by_category)",
+         lambda: db.fetch_expense_series(user_id, first_day, last_day, "week", True)),
+        ("fetch_dashboard", lambda: db.fetch_dashboard(user_id, busy_day, first_day, last_day)),
+        ("update_expenses_for_date(one note)", edit_one_note),
+        ("replace_expenses_for_date", lambda: db.replace_expenses_for_date(busy_day, day_rows, user_id)),
+        ("insert_expense+delete_expenses_for_date", write_then_delete),
+        ("insert_expenses_batch+delete_expenses_for_date", batch_then_delete),
+    ]
+
+
+def route_cases(client, user_id, rows):
+    """(name, callable) pairs calling each API route in-process for one user"""
+    import analytics_cache
+    from auth import create_access_token
+
+    headers = {"Authorization": f"Bearer {create_access_token({'user_id': user_id})}"}
+    first_day, last_day = rows[0][0].isoformat(), rows[-1][0].isoformat()
+    busy_day = _busiest_day(rows)
+    day_payload = [
+        {"amount": float(amount), "category": category, "notes": notes, "user_id": user_id}
+        for day, amount, category, notes in rows if day == busy_day
+    ]
+    cache = analytics_cache.cache
+
+    def call(method, url, cold_cache=False, **kwargs):
+        def run():
+            ttl = cache.ttl
+            if cold_cache:
+                cache.ttl = 0  # entries expire immediately, so every call reaches the database
+            try:
+                response = client.request(method, url, headers=headers, **kwargs)
+            finally:
+                cache.ttl = ttl
+            response.raise_for_status()
+        return run
+
+    by_category = f"/analytics_by_category/{user_id}?start_date={first_day}&end_date={last_day}"
+    by_months = f"/analytics_by_months/{user_id}"
+    trends = f"/analytics_series/{user_id}?start_date={first_day}&end_date={last_day}&period=week&by_category=true"
+    dashboard = f"/dashboard/{user_id}?expense_date={busy_day.isoformat()}&start_date={first_day}&end_date={last_day}"
+    return [
+        ("GET /expenses/{user_id}/{expense_date}", call("GET", f"/expenses/{user_id}/{busy_day.isoformat()}")),
+        ("GET /expenses/{user_id}",
+         call("GET", f"/expenses/{user_id}?start_date={first_day}&end_date={last_day}")),
+        ("POST /expenses/{expense_date}", call("POST", f"/expenses/{busy_day.isoformat()}", json=day_payload)),
+        ("GET /export/{user_id}", call("GET", f"/export/{user_id}")),
+        ("GET /export/{user_id}?gzip", call("GET", f"/export/{user_id}?format=ndjson&gzip=true")),
+        ("GET /analytics_by_category/{user_id}", call("GET", by_category, cold_cache=True)),
+        ("GET /analytics_by_category/{user_id} (cached)", call("GET", by_category)),
+        ("GET /analytics_by_months/{user_id}", call("GET", by_months, cold_cache=True)),
+        ("GET /analytics_by_months/{user_id} (cached)", call("GET", by_months)),
+        ("GET /dashboard/{user_id}", call("GET", dashboard, cold_cache=True)),
+        ("GET /analytics_series/{user_id}", call("GET", trends, cold_cache=True)),
+        ("GET /analytics_series/{user_id} (cached)", call("GET", trends)),
+    ]
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    sizes = [int(size) for size in args.sizes.split(",")]
+    results = []
+
+    print(f"Creating {args.users} user(s) per size for sizes {sizes} (seed {args.seed})")
+    dataset = create_dataset(rng, args.users, sizes)
+    try:
+        with contextlib.ExitStack() as stack:
+            client = None
+            if not args.skip_routes:
+                from fastapi.testclient import TestClient
+                import server
+                client = stack.enter_context(TestClient(server.app))
+
+            for size in sizes:
+                for kind in ("db", "route"):
+                    if kind == "route" and client is None:
+                        continue
+                    # Each user is timed separately; the user with the median time is reported
+                    per_case = {}
+                    for user_id, username, rows in dataset[size]:
+                        if kind == "db":
+                            case_list = db_cases(user_id, username, rows)
+                        else:
+                            case_list = route_cases(client, user_id, rows)
+                        for name, func in case_list:
+                            per_case.setdefault(name, []).append(measure(func, args.repeat))
+                    for name, timings in per_case.items():
+                        timings.sort(key=lambda t: t["median_ms"])
+                        result = {"kind": kind, "name": name, "size": size, **timings[len(timings) // 2]}
+                        results.append(result)
+                        print(f"{kind:5} {name:50} size={size:<8} median={result['median_ms']:.3f}ms "
+                              f"p95={result['p95_ms']:.3f}ms")
+    finally:
+        if not args.keep:
+            drop_benchmark_users()
+
+    report = {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "seed": args.seed,
+            "users": args.users,
+            "sizes": sizes,
+            "repeat": args.repeat,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+    return 0
+
+
+# Comparison
+
+def compare_results(baseline, current, threshold, min_delta_ms):
+    """
+    Pair results by (kind, name, size) and return rows of (key, baseline_ms, current_ms, change, regressed).
+    A regression is a median that grew by more than `threshold` (a fraction) and by at least min_delta_ms.
+    """
+    base = {(r["kind"], r["name"], r["size"]): r for r in baseline["results"]}
+    rows = []
+    for result in current["results"]:
+        key = (result["kind"], result["name"], result["size"])
+        if key not in base:
+            continue
+        before, after = base[key]["median_ms"], result["median_ms"]
+        change = (after - before) / before if before else 0.0
+        regressed = change > threshold and after - before >= min_delta_ms
+        rows.append((key, before, after, change, regressed))
+    return rows
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    rows = compare_results(baseline, current, args.threshold, args.min_delta_ms)
+    for (kind, name, size), before, after, change, regressed in rows:
+        flag = "REGRESSION" if regressed else ""
+        print(f"{kind:5} {name:50} size={size:<8} {before:10.3f}ms -> {after:10.3f}ms {change:+8.1%} {flag}")
+    regressions = sum(1 for row in rows if row[4])
+    print(f"{regressions} regression(s) in {len(rows)} comparable result(s)")
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark db_helper and the API routes")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="generate data, run the benchmarks, write JSON")
+    run_parser.add_argument("--sizes", default="100,1000,10000", help="comma-separated expenses per user")
+    run_parser.add_argument("--users", type=int, default=3, help="users per size")
+    run_parser.add_argument("--repeat", type=int, default=20, help="timed calls per case")
+    run_parser.add_argument("--seed", type=int, default=42)
+    run_parser.add_argument("--output", default="bench.json")
+    run_parser.add_argument("--skip-routes", action="store_true", help="only benchmark db_helper")
+    run_parser.add_argument("--keep", action="store_true", help="keep the generated users and expenses")
+
+    compare_parser = commands.add_parser("compare", help="flag regressions against a saved baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.2,
+                                help="allowed median slowdown as a fraction (default 0.2 = 20%%)")
+    compare_parser.add_argument("--min-delta-ms", type=float, default=0.5,
+                                help="ignore slowdowns smaller than this many milliseconds")
+
+    args = parser.parse_args(argv)
+    return run(args) if args.command == "run" else compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
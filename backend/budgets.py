@@ -0,0 +1,67 @@
+"""
+Per-category monthly budgets.
+
+expense_budgets holds one monthly limit per (user_id, category). Spending is
+not summed here: expense_monthly_rollup already keeps a running month-to-date
+total per (user_id, month, category), updated by every write in the same
+transaction (see rollups.py). Checking a budget is therefore one primary key
+lookup per category, however many expenses the month has.
+
+If the running totals ever drift from `expenses`, `python rollups.py
+reconcile` recomputes the drifted users' rollups from the raw rows.
+"""
+from decimal import Decimal
+
+CREATE_BUDGETS = """
+    CREATE TABLE IF NOT EXISTS expense_budgets (
+        user_id INT NOT NULL,
+        category VARCHAR(50) NOT NULL,
+        monthly_limit DECIMAL(12, 2) NOT NULL,
+        PRIMARY KEY (user_id, category),
+        CONSTRAINT fk_budgets_user FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+    )
+"""
+
+UPSERT_BUDGET = """
+    INSERT INTO expense_budgets (user_id, category, monthly_limit)
+    VALUES (%s, %s, %s)
+    ON DUPLICATE KEY UPDATE monthly_limit = VALUES(monthly_limit)
+"""
+
+DELETE_BUDGET = "DELETE FROM expense_budgets WHERE user_id = %s AND category = %s"
+
+
+def status_query(user_id, month, categories=None):
+    """
+    Each budget of the user (only those in `categories`, if given) with the month's spending in
+    that category, read from the monthly rollup by primary key.
+    """
+    sql = """
+        SELECT b.category, b.monthly_limit, COALESCE(r.total, 0) AS spent
+        FROM expense_budgets AS b
+        LEFT JOIN expense_monthly_rollup AS r
+            ON r.user_id = b.user_id AND r.expense_month = %s AND r.category = b.category
+        WHERE b.user_id = %s
+    """
+    params = [month, user_id]
+    if categories is not None:
+        sql += f" AND b.category IN ({', '.join(['%s'] * len(categories))})"
+        params.extend(categories)
+    return sql + " ORDER BY b.category", tuple(params)
+
+
+def with_status(month, rows):
+    """Add remaining, percent_used and over_budget to (category, monthly_limit, spent) rows"""
+    result = []
+    for row in rows:
+        limit, spent = Decimal(row['monthly_limit']), Decimal(row['spent'])
+        result.append({
+            "month": month,
+            "category": row['category'],
+            "monthly_limit": limit,
+            "spent": spent,
+            "remaining": limit - spent,
+            "percent_used": round(float(spent / limit * 100), 1) if limit else None,
+            "over_budget": spent > limit
+        })
+    return result
@@ -1,166 +1,600 @@
-import mysql.connector
-from contextlib import contextmanager
+from contextlib import ExitStack, contextmanager
 from logging_setup import setup_logger
+from db_pool import ConnectionPool
+import rollups
+import budgets
+import replicas
+from metrics import instrument_db, DB_ACQUIRE
+import profiling
+import passwords
+from datetime import date
+import threading
+import time
+import calendar
 import os
 
-logger = setup_logger('db_helper')
-
-
-# Database connection context manager
-@contextmanager
-def get_db_cursor(commit=False):
-    connection=mysql.connector.connect(
-        host=os.getenv("DB_HOST", "localhost"),
+logger = setup_logger('db_helper', sampled=True)
+
+# Rows per multi-row INSERT; keeps each statement well under max_allowed_packet
+INSERT_BATCH_SIZE = int(os.getenv("DB_INSERT_BATCH_SIZE", "500"))
+# Seconds to wait for a new connection; keeps an unreachable replica from stalling reads
+CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "2"))
+
+# Queries (migrations.check_query_plans EXPLAINs these against the live schema)
+INSERT_USER = "INSERT INTO users (actual_name, username, password_hash) VALUES (%s, %s, %s)"
+SELECT_USER_BY_USERNAME = "SELECT * FROM users WHERE username = %s"
+UPDATE_PASSWORD_HASH = "UPDATE users SET password_hash = %s WHERE id = %s AND password_hash = %s"
+SELECT_EXPENSES_FOR_DATE = """
+    SELECT id, amount, category, notes, user_id FROM expenses WHERE expense_date = %s AND user_id = %s ORDER BY id
+"""
+DELETE_EXPENSES_FOR_DATE = "DELETE FROM expenses WHERE expense_date = %s AND user_id = %s"
+INSERT_EXPENSE = "INSERT INTO expenses (expense_date, amount, category, notes, user_id) VALUES (%s, %s, %s, %s, %s)"
+UPDATE_EXPENSE = """
+    UPDATE expenses SET amount = %s, category = %s, notes = %s WHERE id = %s AND expense_date = %s AND user_id = %s
+"""
+
+# Read replicas ("host[:port]", comma-separated; same user, password and database as DB_HOST)
+REPLICA_HOSTS = {
+    f"{host}:{port}": (host, port)
+    for host, port in replicas.parse_hosts(os.getenv("DB_REPLICAS"), int(os.getenv("DB_PORT", "3306")))
+}
+replica_set = replicas.ReplicaSet(REPLICA_HOSTS)
+
+_pools = {}  # None -> the primary's pool, "host:port" -> a replica's
+_pool_lock = threading.Lock()
+
+
+def _connect(host, port):
+    # Imported here so the module (and its shared helpers) loads without the MySQL driver
+    import mysql.connector
+
+    # autocommit keeps plain reads from holding a snapshot open on a pooled connection;
+    # writes open an explicit transaction in get_db_cursor(commit=True)
+    return mysql.connector.connect(
+        host=host,
         user=os.getenv("DB_USER", "root"),
         password=os.getenv("DB_PASSWORD", "root"),
         database=os.getenv("DB_NAME", "expense_manager"),
-        port=int(os.getenv("DB_PORT", "3306"))
+        port=port,
+        autocommit=True,
+        connection_timeout=CONNECT_TIMEOUT,
+        # Drain unread rows when an unbuffered cursor is closed early (e.g. an abandoned iter_expenses)
+        consume_results=True
     )
-    cursor = connection.cursor(dictionary=True)
-    yield cursor
-    if commit:
-        connection.commit()
-    cursor.close()
-    connection.close()
+
+
+def get_pool(replica=None):
+    """Return the process-wide connection pool of the primary (or of `replica`), creating it on first use"""
+    if replica not in _pools:
+        with _pool_lock:
+            if replica not in _pools:
+                host, port = REPLICA_HOSTS[replica] if replica else (os.getenv("DB_HOST", "localhost"),
+                                                                     int(os.getenv("DB_PORT", "3306")))
+                _pools[replica] = ConnectionPool(
+                    lambda: _connect(host, port),
+                    max_size=int(os.getenv("DB_POOL_SIZE", "10")),
+                    timeout=float(os.getenv("DB_POOL_TIMEOUT", "5")),
+                    max_age=float(os.getenv("DB_POOL_MAX_AGE", "1800")),
+                    ping_interval=float(os.getenv("DB_POOL_PING_INTERVAL", "5"))
+                )
+    return _pools[replica]
+
+
+def get_pool_stats():
+    """Primary pool size, connections in use, checkout wait times and timeouts, plus replica health"""
+    stats = get_pool().stats()
+    if REPLICA_HOSTS:
+        stats.update(replica_set.stats())
+    return stats
+
+
+def _is_connection_error(error):
+    """True if `error` means the server could not be reached or dropped the connection"""
+    import mysql.connector
+
+    return isinstance(error, (mysql.connector.errors.InterfaceError, mysql.connector.errors.OperationalError))
+
+
+def _checkout(stack, replica):
+    """
+    Enter a pooled connection of `replica`, or of the primary if it is None or unreachable.
+    Returns (connection, the replica it came from or None).
+    """
+    if replica is not None:
+        try:
+            return stack.enter_context(get_pool(replica).connection()), replica
+        except Exception as e:
+            # A busy replica (PoolTimeout) stays in rotation; this read just goes to the primary
+            if _is_connection_error(e):
+                replica_set.mark_down(replica, e)
+    return stack.enter_context(get_pool().connection()), None
+
+
+# Database connection context manager
+@contextmanager
+def get_db_cursor(commit=False, replica=False, user_key=None):
+    """
+    Cursor on a pooled connection. commit=True runs the block as one transaction on the primary
+    and, once it commits, keeps `user_key`'s reads on the primary for a while (see replicas.py).
+    replica=True lets a read go to a replica, unless `user_key` wrote recently; if the replica fails
+    mid-read it is marked down and ReplicaFailed is raised for replicas.retry_on_primary.
+    """
+    start = time.perf_counter()
+    target = replica_set.choose(user_key) if replica and not commit else None
+    with ExitStack() as stack:
+        connection, target = _checkout(stack, target)
+        if replica:
+            replica_set.record(target)
+        acquired = time.perf_counter()
+        DB_ACQUIRE.observe(acquired - start, "sync")
+        profiling.record("db_connect", acquired - start)
+        if commit:
+            connection.start_transaction()
+        cursor = connection.cursor(dictionary=True)
+        try:
+            yield cursor
+            if commit:
+                connection.commit()
+                replicas.note_write(user_key)
+        except Exception as e:
+            if connection.in_transaction:
+                connection.rollback()
+            if target is not None and _is_connection_error(e):
+                replica_set.mark_down(target, e)
+                raise replicas.ReplicaFailed(target) from e
+            raise
+        finally:
+            cursor.close()
+            profiling.record("db_query", time.perf_counter() - acquired)
+
+
+def ping():
+    """Run a trivial query on a pooled connection (warmup and readiness checks)"""
+    with get_db_cursor() as cursor:
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
 
 
 # User functions
-def create_user(actual_name, username, password):
-    """Create a new user (plain text password)"""
-    with get_db_cursor(commit=True) as cursor:
+@instrument_db
+def create_user(actual_name, username, password_hash):
+    """Create a new user; `password_hash` comes from passwords.hash_password"""
+    with get_db_cursor(commit=True, user_key=username) as cursor:
         cursor.execute(
-            "INSERT INTO users (actual_name, username, password_hash) VALUES (%s, %s, %s)",
-            (actual_name, username, password)
+            INSERT_USER,
+            (actual_name, username, password_hash)
         )
 
 
+@instrument_db
+@replicas.retry_on_primary
 def get_user_by_username(username):
     """Fetch user details by username"""
-    with get_db_cursor() as cursor:
-        cursor.execute("SELECT * FROM users WHERE username = %s", (username,))
+    with get_db_cursor(replica=True, user_key=username) as cursor:
+        cursor.execute(SELECT_USER_BY_USERNAME, (username,))
         return cursor.fetchone()
 
 
+@instrument_db
+def update_password_hash(user_id, password_hash, old_password_hash):
+    """Replace a user's stored password, unless it changed since `old_password_hash` was read"""
+    with get_db_cursor(commit=True, user_key=user_id) as cursor:
+        cursor.execute(UPDATE_PASSWORD_HASH, (password_hash, user_id, old_password_hash))
+
+
 def verify_password(plain_password, stored_password):
-    """Verify password against stored plain text password"""
-    return plain_password == stored_password
+    """Verify password against a stored scrypt hash (or legacy plain text password)"""
+    return passwords.verify_password(plain_password, stored_password)
 
 
 # Expense functions
+@instrument_db
+@replicas.retry_on_primary
 def fetch_expenses_for_date(expense_date, user_id):
-    logger.info(f"fetch_expenses_for_date called with {expense_date}, user_id={user_id}")
-    with get_db_cursor() as cursor:
+    logger.info("fetch_expenses_for_date called with %s, user_id=%s", expense_date, user_id)
+    with get_db_cursor(replica=True, user_key=user_id) as cursor:
         cursor.execute(
-            "SELECT amount, category, notes, user_id FROM expenses WHERE expense_date = %s AND user_id = %s",
+            SELECT_EXPENSES_FOR_DATE,
             (expense_date, user_id)
         )
         return cursor.fetchall()
 
 
+def expense_range_query(user_id, start_date, end_date, category=None, min_amount=None, max_amount=None,
+                        after=None, limit=100):
+    """
+    One page of a user's expenses in an inclusive date range, ordered by (expense_date, id).
+    `after` is the (expense_date, id) of the last row of the previous page (keyset pagination).
+    """
+    conditions = ["user_id = %s", "expense_date BETWEEN %s AND %s"]
+    params = [user_id, start_date, end_date]
+    if category is not None:
+        conditions.append("category = %s")
+        params.append(category.capitalize())
+    if min_amount is not None:
+        conditions.append("amount >= %s")
+        params.append(min_amount)
+    if max_amount is not None:
+        conditions.append("amount <= %s")
+        params.append(max_amount)
+    if after is not None:
+        after_date, after_id = after
+        conditions.append("(expense_date > %s OR (expense_date = %s AND id > %s))")
+        params.extend([after_date, after_date, after_id])
+    sql = f"""
+        SELECT id, expense_date, amount, category, notes
+        FROM expenses
+        WHERE {" AND ".join(conditions)}
+        ORDER BY expense_date, id
+        LIMIT %s
+    """
+    params.append(limit)
+    return sql, tuple(params)
+
+
+@instrument_db
+@replicas.retry_on_primary
+def fetch_expenses_in_range(user_id, start_date, end_date, category=None, min_amount=None, max_amount=None,
+                            after=None, limit=100):
+    """Fetch one keyset page (at most `limit` rows) of a user's expenses; see expense_range_query"""
+    logger.info("fetch_expenses_in_range called with start: %s, end: %s, user_id=%s",
+                start_date, end_date, user_id)
+    query, params = expense_range_query(user_id, start_date, end_date, category, min_amount, max_amount,
+                                        after, limit)
+    with get_db_cursor(replica=True, user_key=user_id) as cursor:
+        cursor.execute(query, params)
+        return cursor.fetchall()
+
+
+def expense_export_query(user_id, start_date=None, end_date=None):
+    """Every expense for a user in (expense_date, id) order, optionally within an inclusive date range"""
+    conditions = ["user_id = %s"]
+    params = [user_id]
+    if start_date is not None:
+        conditions.append("expense_date >= %s")
+        params.append(start_date)
+    if end_date is not None:
+        conditions.append("expense_date <= %s")
+        params.append(end_date)
+    sql = f"""
+        SELECT id, expense_date, amount, category, notes
+        FROM expenses
+        WHERE {" AND ".join(conditions)}
+        ORDER BY expense_date, id
+    """
+    return sql, tuple(params)
+
+
+@instrument_db
+def iter_expenses(user_id, start_date=None, end_date=None, batch_size=1000):
+    """Sync stream_expenses: yield batches of rows from an unbuffered cursor"""
+    logger.info("iter_expenses called with start: %s, end: %s, user_id=%s", start_date, end_date, user_id)
+    query, params = expense_export_query(user_id, start_date, end_date)
+    # mysql.connector cursors are unbuffered unless buffered=True is requested
+    with get_db_cursor(replica=True, user_key=user_id) as cursor:
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+
+
+def _update_rollups(cursor, expense_date, user_id, removed=(), added=()):
+    """Apply the net change of a write to the rollup tables, inside the caller's transaction"""
+    deltas = rollups.compute_deltas(removed=removed, added=added)
+    for sql, params, many in rollups.delta_statements(user_id, expense_date, deltas):
+        if many:
+            cursor.executemany(sql, params)
+        else:
+            cursor.execute(sql, params)
+
+
+def _lock_day_totals(cursor, expense_date, user_id):
+    cursor.execute(rollups.DAY_CATEGORY_TOTALS_FOR_UPDATE, (expense_date, user_id))
+    return cursor.fetchall()
+
+
+def lock_expenses_query(expense_date, user_id, ids):
+    """Lock the user's expenses on expense_date with the given ids; returns (sql, params)"""
+    placeholders = ", ".join(["%s"] * len(ids))
+    sql = f"""
+        SELECT id, amount, category FROM expenses
+        WHERE expense_date = %s AND user_id = %s AND id IN ({placeholders})
+        FOR UPDATE
+    """
+    return sql, [expense_date, user_id, *ids]
+
+
+def delete_expenses_query(expense_date, user_id, ids):
+    placeholders = ", ".join(["%s"] * len(ids))
+    sql = f"DELETE FROM expenses WHERE expense_date = %s AND user_id = %s AND id IN ({placeholders})"
+    return sql, [expense_date, user_id, *ids]
+
+
+def changed_rows(ids, locked):
+    """
+    Check that every id in `ids` (the updated then the deleted rows) was found and locked, and
+    return the locked rows in the `removed` shape rollups.compute_deltas takes.
+    """
+    if len(set(ids)) != len(ids):
+        raise ValueError("An expense id appears more than once in the changes")
+    missing = set(ids) - {row['id'] for row in locked}
+    if missing:
+        raise LookupError(f"No expenses with ids {sorted(missing)} on this date")
+    return [{"category": row['category'], "total": row['amount'], "expense_count": 1} for row in locked]
+
+
+@instrument_db
 def delete_expenses_for_date(expense_date, user_id):
-    logger.info(f"delete_expenses_for_date called with {expense_date}, user_id={user_id}")
-    with get_db_cursor(commit=True) as cursor:
+    logger.info("delete_expenses_for_date called with %s, user_id=%s", expense_date, user_id)
+    with get_db_cursor(commit=True, user_key=user_id) as cursor:
+        removed = _lock_day_totals(cursor, expense_date, user_id)
         cursor.execute(
-            "DELETE FROM expenses WHERE expense_date = %s AND user_id = %s",
+            DELETE_EXPENSES_FOR_DATE,
             (expense_date, user_id)
         )
+        _update_rollups(cursor, expense_date, user_id, removed=removed)
 
 
+@instrument_db
 def insert_expense(expense_date, amount, category, notes, user_id):
-    logger.info(
-        f"insert_expense called with date: {expense_date}, amount: {amount}, category: {category}, user_id={user_id}")
+    logger.info("insert_expense called with date: %s, amount: %s, category: %s, user_id=%s",
+                expense_date, amount, category, user_id)
     # Capitalize category for consistency
     category = category.capitalize()
-    with get_db_cursor(commit=True) as cursor:
+    amount = rollups.to_decimal(amount)
+    with get_db_cursor(commit=True, user_key=user_id) as cursor:
         cursor.execute(
-            "INSERT INTO expenses (expense_date, amount, category, notes, user_id) VALUES (%s, %s, %s, %s, %s)",
+            INSERT_EXPENSE,
             (expense_date, amount, category, notes, user_id)
         )
+        _update_rollups(cursor, expense_date, user_id, added=[(category, amount)])
 
 
-def fetch_expense_summary_by_catrgory(start_date, end_date, user_id):
-    logger.info(f"fetch_expense_summary called with start: {start_date}, end: {end_date}, user_id={user_id}")
-    with get_db_cursor() as cursor:
+@instrument_db
+def replace_expenses_for_date(expense_date, expenses, user_id):
+    """
+    Replace all of a user's expenses for a date in one transaction.
+    `expenses` is an iterable of (amount, category, notes) tuples; rows are written
+    with multi-row INSERTs of up to INSERT_BATCH_SIZE rows each. The result counts the
+    inserted and deleted rows and lists the categories the day had before.
+    """
+    logger.info("replace_expenses_for_date called with %s, user_id=%s", expense_date, user_id)
+    rows = [
+        (expense_date, rollups.to_decimal(amount), category.capitalize(), notes, user_id)
+        for amount, category, notes in expenses
+    ]
+    with get_db_cursor(commit=True, user_key=user_id) as cursor:
+        removed = _lock_day_totals(cursor, expense_date, user_id)
         cursor.execute(
-            '''SELECT category, SUM(amount) as total
-               FROM expenses
-               WHERE expense_date BETWEEN %s AND %s
-                 AND user_id = %s
-               GROUP BY category;''',
-            (start_date, end_date, user_id)
+            DELETE_EXPENSES_FOR_DATE,
+            (expense_date, user_id)
         )
+        for start in range(0, len(rows), INSERT_BATCH_SIZE):
+            cursor.executemany(
+                INSERT_EXPENSE,
+                rows[start:start + INSERT_BATCH_SIZE]
+            )
+        _update_rollups(cursor, expense_date, user_id, removed=removed,
+                        added=[(row[2], row[1]) for row in rows])
+    return {"inserted": len(rows), "deleted": sum(int(row['expense_count']) for row in removed),
+            "categories": sorted({row['category'] for row in removed})}
+
+
+@instrument_db
+def update_expenses_for_date(expense_date, inserts, updates, deletes, user_id):
+    """
+    Apply row-level changes to a user's expenses for a date in one transaction: `inserts` are
+    (amount, category, notes) tuples, `updates` are (id, amount, category, notes) tuples and
+    `deletes` are ids. Only the touched rows are written and the rollups get their net change.
+    The result counts the changes and lists the previous categories of the updated and deleted rows.
+    Raises LookupError if an updated or deleted id is not the user's expense on that date.
+    """
+    logger.info("update_expenses_for_date called with %s, user_id=%s: %s inserts, %s updates, %s deletes",
+                expense_date, user_id, len(inserts), len(updates), len(deletes))
+    inserts = [
+        (expense_date, rollups.to_decimal(amount), category.capitalize(), notes, user_id)
+        for amount, category, notes in inserts
+    ]
+    updates = [
+        (rollups.to_decimal(amount), category.capitalize(), notes, expense_id, expense_date, user_id)
+        for expense_id, amount, category, notes in updates
+    ]
+    ids = [row[3] for row in updates] + list(deletes)
+    with get_db_cursor(commit=True, user_key=user_id) as cursor:
+        locked = []
+        if ids:
+            cursor.execute(*lock_expenses_query(expense_date, user_id, ids))
+            locked = cursor.fetchall()
+        removed = changed_rows(ids, locked)
+        if deletes:
+            cursor.execute(*delete_expenses_query(expense_date, user_id, deletes))
+        if updates:
+            cursor.executemany(UPDATE_EXPENSE, updates)
+        for start in range(0, len(inserts), INSERT_BATCH_SIZE):
+            cursor.executemany(INSERT_EXPENSE, inserts[start:start + INSERT_BATCH_SIZE])
+        _update_rollups(cursor, expense_date, user_id, removed=removed,
+                        added=[(row[1], row[0]) for row in updates] + [(row[2], row[1]) for row in inserts])
+    return {"inserted": len(inserts), "updated": len(updates), "deleted": len(deletes),
+            "categories": sorted({row['category'] for row in removed})}
+
+
+@instrument_db
+def insert_expenses_batch(rows, user_id):
+    """
+    Insert (expense_date, amount, category, notes) rows spanning any dates in one transaction,
+    using multi-row INSERTs, and add them to the rollups.
+    """
+    logger.info("insert_expenses_batch called with %s rows, user_id=%s", len(rows), user_id)
+    rows = [
+        (expense_date, rollups.to_decimal(amount), category.capitalize(), notes, user_id)
+        for expense_date, amount, category, notes in rows
+    ]
+    with get_db_cursor(commit=True, user_key=user_id) as cursor:
+        cursor.executemany(INSERT_EXPENSE, rows)
+        for sql, params, many in rollups.insert_statements(user_id, [(r[0], r[2], r[1]) for r in rows]):
+            cursor.executemany(sql, params)
+    return len(rows)
+
+
+@instrument_db
+@replicas.retry_on_primary
+def fetch_expense_summary_by_catrgory(start_date, end_date, user_id):
+    """Per-category totals for an inclusive date range, read from the rollup tables"""
+    logger.info("fetch_expense_summary called with start: %s, end: %s, user_id=%s",
+                start_date, end_date, user_id)
+    if start_date > end_date:
+        return []
+    query, params = rollups.category_summary_query(user_id, start_date, end_date)
+    with get_db_cursor(replica=True, user_key=user_id) as cursor:
+        cursor.execute(query, params)
         return cursor.fetchall()
 
 
-def fetch_expense_summary_by_month(user_id):
+@instrument_db
+@replicas.retry_on_primary
+def fetch_expense_summary_by_month(user_id, year=None, start_date=None, end_date=None):
     """
-    Fetch total expenses grouped by month for a specific user.
-    Returns list of dicts with expense_month, month_name, expense_year, and total.
+    Fetch total expenses grouped by month for a specific user, newest month first.
+    Optionally bounded to a calendar year and/or an inclusive date range.
+    Returns list of dicts with expense_month, month_name, expense_year, and total (Decimal).
     """
-    logger.info(f"fetch_expense_summary_by_month called with user_id={user_id}")
-    with get_db_cursor() as cursor:
-        # Simple query - fetch all expenses
-        query = """
-                SELECT
-                    MONTH (expense_date) as expense_month, YEAR (expense_date) as expense_year, amount
-                FROM expenses
-                WHERE user_id = %s \
-                """
+    logger.info("fetch_expense_summary_by_month called with user_id=%s, year=%s, start: %s, end: %s",
+                user_id, year, start_date, end_date)
 
-        try:
-            cursor.execute(query, (user_id,))
-            results = cursor.fetchall()
+    start_date, end_date = monthly_summary_bounds(year, start_date, end_date)
+    if start_date is not None and end_date is not None and start_date > end_date:
+        return []
 
-            if not results:
-                return []
+    query, params = rollups.monthly_summary_query(user_id, start_date, end_date)
+    with get_db_cursor(replica=True, user_key=user_id) as cursor:
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+    with profiling.phase("aggregate"):
+        return format_monthly_summary(rows)
 
-            # Group and sum in Python
-            from collections import defaultdict
-            import calendar
 
-            monthly_totals = defaultdict(float)
+@instrument_db
+@replicas.retry_on_primary
+def fetch_expense_series(user_id, start_date, end_date, period, by_category=False):
+    """
+    Spending per `period` ("day", "week", "month" or "year") bucket in an inclusive date range,
+    oldest first: dicts with bucket (first day, date), category when `by_category`, and total.
+    Buckets without spending are absent; series.compute fills them in.
+    """
+    logger.info("fetch_expense_series called with start: %s, end: %s, period: %s, by_category: %s, user_id=%s",
+                start_date, end_date, period, by_category, user_id)
+    if start_date > end_date:
+        return []
+    query, params = rollups.series_query(user_id, start_date, end_date, period, by_category)
+    with get_db_cursor(replica=True, user_key=user_id) as cursor:
+        cursor.execute(query, params)
+        return cursor.fetchall()
+
 
-            for row in results:
-                key = (row['expense_year'], row['expense_month'])
-                monthly_totals[key] += float(row['amount'])
+@instrument_db
+@replicas.retry_on_primary
+def fetch_dashboard(user_id, expense_date, start_date=None, end_date=None, monthly=True):
+    """
+    One day's expenses, plus the category summary for [start_date, end_date] when given and the
+    monthly summary when `monthly`, read back to back over a single pooled connection.
+    Returns {"expenses": [...], "by_category": [...] or None, "by_month": [...] or None}.
+    """
+    logger.info("fetch_dashboard called with date: %s, start: %s, end: %s, user_id=%s",
+                expense_date, start_date, end_date, user_id)
+    result = {"expenses": [], "by_category": None, "by_month": None}
+    with get_db_cursor(replica=True, user_key=user_id) as cursor:
+        cursor.execute(SELECT_EXPENSES_FOR_DATE, (expense_date, user_id))
+        result["expenses"] = cursor.fetchall()
+        if start_date is not None and end_date is not None:
+            result["by_category"] = []
+            if start_date <= end_date:
+                cursor.execute(*rollups.category_summary_query(user_id, start_date, end_date))
+                result["by_category"] = cursor.fetchall()
+        if monthly:
+            cursor.execute(*rollups.monthly_summary_query(user_id))
+            month_rows = cursor.fetchall()
+    if monthly:
+        with profiling.phase("aggregate"):
+            result["by_month"] = format_monthly_summary(month_rows)
+    return result
+
+
+# Budget functions
+@instrument_db
+def set_budget(user_id, category, monthly_limit):
+    """Create or change the user's monthly limit for `category`"""
+    logger.info("set_budget called with category: %s, limit: %s, user_id=%s", category, monthly_limit, user_id)
+    category = category.capitalize()
+    with get_db_cursor(commit=True, user_key=user_id) as cursor:
+        cursor.execute(budgets.UPSERT_BUDGET, (user_id, category, monthly_limit))
 
-            # Convert to list of dicts with proper format
-            final_results = []
-            for (year, month), total in monthly_totals.items():
-                month_name = calendar.month_name[month]
-                final_results.append({
-                    'expense_month': month,
-                    'expense_year': year,
-                    'month_name': f"{month_name} {year}",
-                    'total': total
-                })
 
-            # Sort by year and month descending
-            final_results.sort(key=lambda x: (x['expense_year'], x['expense_month']), reverse=True)
+@instrument_db
+def delete_budget(user_id, category):
+    """Remove the user's budget for `category`; False if there was none"""
+    logger.info("delete_budget called with category: %s, user_id=%s", category, user_id)
+    category = category.capitalize()
+    with get_db_cursor(commit=True, user_key=user_id) as cursor:
+        cursor.execute(budgets.DELETE_BUDGET, (user_id, category))
+        return cursor.rowcount > 0
 
-            return final_results
 
-        except Exception as e:
-            logger.error(f"Error in fetch_expense_summary_by_month: {str(e)}")
-            import traceback
-            logger.error(traceback.format_exc())
-            raise
+@instrument_db
+@replicas.retry_on_primary
+def fetch_budget_status(user_id, month, categories=None):
+    """
+    The user's budgets for the month starting `month` (only those in `categories`, if given)
+    with spent / remaining / percent_used / over_budget, from the running monthly totals.
+    """
+    logger.info("fetch_budget_status called with month: %s, categories: %s, user_id=%s", month, categories, user_id)
+    if categories is not None and not categories:
+        return []
+    with get_db_cursor(replica=True, user_key=user_id) as cursor:
+        cursor.execute(*budgets.status_query(user_id, month, categories))
+        rows = cursor.fetchall()
+    return budgets.with_status(month, rows)
+
+
+def monthly_summary_bounds(year, start_date, end_date):
+    """Fold an optional calendar year into the (start_date, end_date) bounds"""
+    if year is not None:
+        year_start, year_end = date(year, 1, 1), date(year, 12, 31)
+        start_date = year_start if start_date is None else max(start_date, year_start)
+        end_date = year_end if end_date is None else min(end_date, year_end)
+    return start_date, end_date
+
+
+def format_monthly_summary(rows):
+    """Shape monthly_summary_query rows into the API's expense_month/expense_year/month_name/total dicts"""
+    return [
+        {
+            'expense_month': row['expense_month'].month,
+            'expense_year': row['expense_month'].year,
+            'month_name': f"{calendar.month_name[row['expense_month'].month]} {row['expense_month'].year}",
+            'total': row['total']
+        }
+        for row in rows
+    ]
 
 # Test section
 
 if __name__ == "__main__":
-    user_id = 1  # Replace with actual user_id from your users table
+    # Quick manual check against a real user: python db_helper.py <user_id> [YYYY-MM-DD]
+    # (benchmark.py has the full timed suite)
+    import sys
+
+    user_id = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    day = date.fromisoformat(sys.argv[2]) if len(sys.argv) > 2 else date.today()
 
     print("=== Testing fetch_expenses_for_date ===")
-    expenses = fetch_expenses_for_date("2024-09-30", user_id)
-    print(expenses)
+    print(fetch_expenses_for_date(day, user_id))
 
-    print("\n=== Testing fetch_expense_summary ===")
-    summary = fetch_expense_summary("2024-08-01", "2024-08-05", user_id)
-    for record in summary:
+    print("\n=== Testing fetch_expense_summary_by_catrgory ===")
+    for record in fetch_expense_summary_by_catrgory(rollups.month_start(day), day, user_id):
         print(record)
 
-    print("\n=== Testing fetch_monthly_summary ===")
-    monthly = fetch_monthly_summary(user_id)
-    for record in monthly:
+    print("\n=== Testing fetch_expense_summary_by_month ===")
+    for record in fetch_expense_summary_by_month(user_id, year=day.year):
         print(record)
@@ -0,0 +1,202 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes free within the checkout timeout"""
+
+
+class _PoolEntry:
+    __slots__ = ("connection", "created_at", "last_used")
+
+    def __init__(self, connection):
+        now = time.monotonic()
+        self.connection = connection
+        self.created_at = now
+        self.last_used = now
+
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe pool of DB-API connections.
+
+    - at most `max_size` connections are open at once; callers block up to
+      `timeout` seconds for one to be released, then get PoolTimeout
+    - connections older than `max_age` seconds are closed and replaced on checkout
+    - connections idle for longer than `ping_interval` seconds are pinged on
+      checkout and replaced if the server has dropped them
+    """
+
+    def __init__(self, connect, max_size=10, timeout=5.0, max_age=1800.0, ping_interval=5.0):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        self._connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_age = max_age
+        self.ping_interval = ping_interval
+
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._size = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._closed = False
+
+        # Counters reported by stats()
+        self._checkouts = 0
+        self._timeouts = 0
+        self._created = 0
+        self._recycled = 0
+        self._discarded = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    # Checkout / checkin
+
+    def _acquire(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        entry = None
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("Connection pool is closed")
+                if self._idle:
+                    # LIFO: reuse the most recently returned connection
+                    entry = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    # Reserve a slot; the connection is opened outside the lock
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(
+                        f"No database connection available after {self.timeout:.1f}s "
+                        f"(pool size {self.max_size})"
+                    )
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            self._in_use += 1
+
+        try:
+            entry = self._checked(entry)
+        except BaseException:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        waited = time.monotonic() - start
+        with self._cond:
+            self._checkouts += 1
+            self._wait_total += waited
+            if waited > self._wait_max:
+                self._wait_max = waited
+        return entry
+
+    def _checked(self, entry):
+        """Return a usable entry, replacing expired or dead connections"""
+        if entry is not None:
+            now = time.monotonic()
+            if now - entry.created_at > self.max_age:
+                self._close(entry.connection)
+                with self._cond:
+                    self._recycled += 1
+                entry = None
+            elif now - entry.last_used > self.ping_interval and not self._ping(entry.connection):
+                self._close(entry.connection)
+                with self._cond:
+                    self._discarded += 1
+                entry = None
+
+        if entry is None:
+            entry = _PoolEntry(self._connect())
+            with self._cond:
+                self._created += 1
+        return entry
+
+    def _release(self, entry, discard=False):
+        with self._cond:
+            self._in_use -= 1
+            # After close_all() nothing goes back to the idle list
+            close = discard or self._closed
+            if close:
+                self._size -= 1
+                if discard:
+                    self._discarded += 1
+            else:
+                entry.last_used = time.monotonic()
+                self._idle.append(entry)
+            self._cond.notify()
+        if close:
+            self._close(entry.connection)
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection for the duration of the block"""
+        entry = self._acquire()
+        try:
+            yield entry.connection
+        except BaseException:
+            # The caller rolls back on error; only keep the connection if it still answers
+            self._release(entry, discard=not self._ping(entry.connection))
+            raise
+        else:
+            self._release(entry)
+
+    # Maintenance
+
+    @staticmethod
+    def _ping(connection):
+        try:
+            connection.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close_all(self):
+        """Close the pool: idle connections close now, checked-out ones when released, and checkouts fail"""
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for entry in idle:
+            self._close(entry.connection)
+
+    def stats(self):
+        """Snapshot of pool occupancy and checkout timings"""
+        with self._cond:
+            checkouts = self._checkouts
+            return {
+                "max_size": self.max_size,
+                "size": self._size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "checkouts": checkouts,
+                "timeouts": self._timeouts,
+                "created": self._created,
+                "recycled": self._recycled,
+                "discarded": self._discarded,
+                "wait_time_total_ms": round(self._wait_total * 1000, 3),
+                "wait_time_avg_ms": round(self._wait_total * 1000 / checkouts, 3) if checkouts else 0.0,
+                "wait_time_max_ms": round(self._wait_max * 1000, 3),
+            }
@@ -0,0 +1,223 @@
+"""
+Streaming encoders and parsers for exporting and importing expenses.
+
+Each encoder takes an async iterator of row batches (as produced by
+async_db_helper.stream_expenses) and yields bytes chunks suitable for a
+StreamingResponse, so nothing larger than one batch is held in memory.
+The parsers do the reverse for uploads: they consume the request body
+chunk by chunk and yield one record at a time.
+"""
+import codecs
+import csv
+import io
+import json
+import re
+import zlib
+from collections import deque
+from datetime import date
+from decimal import Decimal
+
+EXPORT_COLUMNS = ["id", "expense_date", "amount", "category", "notes"]
+
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+async def csv_chunks(batches):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS, extrasaction="ignore", lineterminator="\n")
+    writer.writeheader()
+    async for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+async def ndjson_chunks(batches):
+    async for rows in batches:
+        yield "".join(
+            json.dumps({column: row[column] for column in EXPORT_COLUMNS}, default=_json_default) + "\n"
+            for row in rows
+        ).encode()
+
+
+async def gzip_chunks(chunks, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def encode(batches, fmt, compress=False):
+    """Bytes chunks for `batches` in the given format ("csv" or "ndjson"), optionally gzipped"""
+    chunks = csv_chunks(batches) if fmt == "csv" else ndjson_chunks(batches)
+    return gzip_chunks(chunks) if compress else chunks
+
+
+# Import parsers
+
+IMPORT_COLUMNS = ["expense_date", "amount", "category", "notes"]
+# Guards against a body with no newlines, or a CSV record that never closes its quote, being buffered whole
+MAX_LINE_LENGTH = 1024 * 1024
+MAX_RECORD_LINES = 100
+
+
+async def _lines(chunks):
+    """Decode a UTF-8 byte stream (BOM tolerated) into lines, without the trailing newline"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        lines = pending.split("\n")
+        pending = lines.pop()
+        if len(pending) > MAX_LINE_LENGTH:
+            raise ValueError(f"Line longer than {MAX_LINE_LENGTH} characters")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+_QUOTE_OR_COMMA = re.compile('[",]')
+# A line of fields that are unquoted or open and close their quotes on it
+_WHOLE_RECORD = re.compile(r'(?:"(?:[^"]|"")*"(?!")[^,]*|[^",][^,]*)?(?:,(?:"(?:[^"]|"")*"(?!")[^,]*|[^",][^,]*)?)*')
+
+
+def _ends_in_quotes(line, in_quotes):
+    """
+    Whether a quoted field is still open at the end of `line`, given whether one was open at its
+    start. As in csv.reader, a quote only opens a field at the start of the field (so `5" screen`
+    is plain text), and inside one a doubled quote is a literal quote.
+    """
+    if '"' not in line:
+        return in_quotes
+    if not in_quotes and _WHOLE_RECORD.fullmatch(line):
+        return False
+    field_start = -1 if in_quotes else 0
+    skip = -1
+    for match in _QUOTE_OR_COMMA.finditer(line):
+        position = match.start()
+        if position == skip:
+            continue
+        if match.group() == ",":
+            if not in_quotes:
+                field_start = position + 1
+        elif in_quotes:
+            if line.startswith('"', position + 1):
+                skip = position + 1
+            else:
+                in_quotes = False
+        elif position == field_start:
+            in_quotes = True
+    return in_quotes
+
+
+def _split_records(lines, final):
+    """
+    Pop whole CSV records off the front of `lines`, a deque of (line_number, line), yielding
+    (first_line, text). A quoted field may span lines, but a record left open for
+    MAX_RECORD_LINES lines or MAX_LINE_LENGTH characters (or by the end of the input, when
+    `final`) has an unterminated quote: its first line is yielded with text None and the lines
+    after it are read again as records of their own, so one bad row cannot swallow the rest.
+    """
+    while lines:
+        in_quotes, length = False, 0
+        for count, (_, line) in enumerate(lines, 1):
+            in_quotes = _ends_in_quotes(line, in_quotes)
+            length += len(line) + 1
+            if not in_quotes:
+                first_line = lines[0][0]
+                yield first_line, "\n".join(lines.popleft()[1] for _ in range(count))
+                break
+            if count >= MAX_RECORD_LINES or length > MAX_LINE_LENGTH:
+                yield lines.popleft()[0], None
+                break
+        else:
+            if not final:
+                return
+            yield lines.popleft()[0], None
+
+
+async def _csv_texts(chunks):
+    """Yield (first_line, text) for each CSV record, text None for one with an unterminated quote"""
+    lines, line_number = deque(), 0
+    async for line in _lines(chunks):
+        line_number += 1
+        if not lines and not _ends_in_quotes(line, False):
+            # The usual case: a whole record on one line
+            yield line_number, line
+            continue
+        lines.append((line_number, line))
+        for record in _split_records(lines, False):
+            yield record
+    for record in _split_records(lines, True):
+        yield record
+
+
+async def csv_records(chunks):
+    """
+    Yield (line_number, record, error) for each CSV row; the first row is the header.
+    Quoted fields may span lines. `record` is a dict keyed by header, or None when `error` is set.
+    """
+    header = None
+    async for first_line, text in _csv_texts(chunks):
+        if text is None:
+            yield first_line, None, "Unterminated quoted field"
+            continue
+        if not text.strip():
+            continue
+        try:
+            values = next(csv.reader([text]))
+        except csv.Error as e:
+            yield first_line, None, f"Malformed CSV: {e}"
+            continue
+        if header is None:
+            header = [name.strip().lower() for name in values]
+            missing = [column for column in IMPORT_COLUMNS[:3] if column not in header]
+            if missing:
+                yield first_line, None, f"Missing column(s): {', '.join(missing)}"
+                return
+            continue
+        if len(values) > len(header):
+            yield first_line, None, f"Expected at most {len(header)} fields, got {len(values)}"
+            continue
+        # Short rows leave trailing columns (e.g. notes) empty
+        yield first_line, dict(zip(header, values + [""] * (len(header) - len(values)))), None
+
+
+async def ndjson_records(chunks):
+    """Yield (line_number, record, error) for each non-empty NDJSON line"""
+    line_number = 0
+    async for line in _lines(chunks):
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_number, None, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(record, dict):
+            yield line_number, None, "Expected a JSON object"
+            continue
+        yield line_number, record, None
+
+
+def parse(chunks, fmt):
+    return csv_records(chunks) if fmt == "csv" else ndjson_records(chunks)
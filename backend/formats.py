@@ -0,0 +1,151 @@
+"""
+Response encoding and content negotiation for the tabular endpoints.
+
+Analytics and listing endpoints return rows. By default they go out as a
+JSON list of objects, which repeats every key on every row. Clients that
+send a matching Accept header can get the same rows in a more compact form:
+
+    application/json                       [{"category": "Food", "total": 12.5}, ...]
+    application/vnd.expense.columnar+json  {"category": ["Food", ...], "total": [12.5, ...]}
+    application/vnd.apache.arrow.stream    Arrow IPC stream (needs pyarrow on the server)
+
+JSON is rendered with orjson. Decimal amounts are written as JSON numbers,
+the same as FastAPI's jsonable_encoder wrote them before. Columnar JSON loads
+straight into pandas.DataFrame(...), and Arrow into pyarrow.ipc.open_stream(...).
+"""
+import importlib.util
+from decimal import Decimal
+
+import orjson
+from starlette.responses import JSONResponse, Response
+
+import profiling
+
+JSON = "application/json"
+COLUMNAR_JSON = "application/vnd.expense.columnar+json"
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+
+ARROW_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+
+
+# JSON encoding
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content):
+    """orjson.dumps that also handles Decimal (dates, datetimes and numpy values are native)"""
+    return orjson.dumps(content, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson, reporting its rendering time as the "serialize" phase"""
+
+    def render(self, content):
+        with profiling.phase("serialize"):
+            return dumps(content)
+
+
+# Columnar layouts
+
+def to_columns(rows):
+    """List of row dicts -> dict of column lists (key order of the first row; {} for no rows)"""
+    if not rows:
+        return {}
+    return {key: [row[key] for row in rows] for key in rows[0]}
+
+
+def to_rows(columns):
+    """Dict of column lists -> list of row dicts (the inverse of to_columns)"""
+    names = list(columns)
+    return [dict(zip(names, values)) for values in zip(*columns.values())]
+
+
+def to_arrow(rows):
+    """Arrow IPC stream bytes for `rows`; Decimal columns become float64 like in JSON"""
+    return columns_to_arrow({
+        name: [float(value) if isinstance(value, Decimal) else value for value in values]
+        for name, values in to_columns(rows).items()
+    })
+
+
+def columns_to_arrow(columns):
+    """Arrow IPC stream bytes for a dict of column lists"""
+    import pyarrow as pa
+
+    table = pa.Table.from_pydict(columns)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+# Negotiation
+
+def negotiate(request, offered=(JSON, COLUMNAR_JSON, ARROW_STREAM)):
+    """
+    Pick the media type in `offered` that the request's Accept header prefers (highest q, then
+    earliest). Arrow is only offered when pyarrow is installed. Anything else, including no
+    Accept header or */*, gets plain JSON.
+    """
+    choices = []
+    for position, part in enumerate(request.headers.get("accept", "").split(",")):
+        media_type, *params = [piece.strip() for piece in part.split(";")]
+        if media_type not in offered or (media_type == ARROW_STREAM and not ARROW_AVAILABLE):
+            continue
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    pass
+        if quality > 0:
+            choices.append((-quality, position, media_type))
+    return min(choices)[2] if choices else JSON
+
+
+def rows_response(request, rows, **fields):
+    """
+    Respond with `rows` in the negotiated format. With extra `fields` (e.g. next_cursor) the JSON
+    forms wrap the rows as {"items": rows, **fields}; Arrow carries each field in an X-<Field>
+    header instead (next_cursor -> X-Next-Cursor), empty when the value is None.
+    """
+    media_type = negotiate(request)
+    if media_type == ARROW_STREAM:
+        with profiling.phase("serialize"):
+            body = to_arrow(rows or [])
+        headers = {"X-" + name.replace("_", "-").title(): "" if value is None else str(value)
+                   for name, value in fields.items()}
+        return Response(body, media_type=ARROW_STREAM, headers={**headers, "Vary": "Accept"})
+
+    data = to_columns(rows or []) if media_type == COLUMNAR_JSON else rows or []
+    if fields:
+        data = {"items": data, **fields}
+    return FastJSONResponse(data, media_type=media_type, headers={"Vary": "Accept"})
+
+
+def columns_response(request, columns):
+    """rows_response for data that is already a dict of column lists (e.g. computed with pandas)"""
+    media_type = negotiate(request)
+    if media_type == ARROW_STREAM:
+        with profiling.phase("serialize"):
+            body = columns_to_arrow(columns)
+        return Response(body, media_type=ARROW_STREAM, headers={"Vary": "Accept"})
+    data = columns if media_type == COLUMNAR_JSON else to_rows(columns)
+    return FastJSONResponse(data, media_type=media_type, headers={"Vary": "Accept"})
+
+
+def sections_response(request, data, sections):
+    """
+    Respond with the dict `data`, whose `sections` keys hold row lists; those are converted to
+    columns when the client accepts columnar JSON. Arrow has no room for several tables, so
+    clients asking only for it get plain JSON.
+    """
+    media_type = negotiate(request, (JSON, COLUMNAR_JSON))
+    if media_type == COLUMNAR_JSON:
+        data = {key: to_columns(value) if key in sections else value for key, value in data.items()}
+    return FastJSONResponse(data, media_type=media_type, headers={"Vary": "Accept"})
@@ -1,15 +1,166 @@
+import atexit
+import contextvars
+import copy
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
 
+# Correlation id of the request being handled; set by the server middleware
+request_id_var = contextvars.ContextVar("request_id", default="-")
 
-def setup_logger(name, log_file='server.log', level=logging.DEBUG):
-    # Create a custom logger
-    logger = logging.getLogger(name)
+LOG_FILE = os.getenv("LOG_FILE", "server.log")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # "text" or "json"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_TO_CONSOLE = os.getenv("LOG_TO_CONSOLE", "1") == "1"
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
 
-    # Configure the custom logger
-    logger.setLevel(level)
-    file_handler = logging.FileHandler(log_file)
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
+_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+_plain_formatter = logging.Formatter()
+_listener = None
+_listener_lock = threading.Lock()
+_log_file = None
+
+
+def _parse_sample_rates(spec):
+    """'DEBUG=0.01,INFO=0.1' -> {10: 0.01, 20: 0.1}"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        level, rate = item.split("=")
+        rates[logging.getLevelName(level.strip().upper())] = float(rate)
+    return rates
+
+
+# Fraction of records kept per level on sampled (hot path) loggers; unlisted levels are always kept
+SAMPLE_RATES = _parse_sample_rates(os.getenv("LOG_SAMPLE_RATES", ""))
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamp each record with the current request id (read in the emitting task, before queueing)"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of records per level; WARNING and above are never dropped"""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(record.levelno, 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full"""
 
-    return logger
\ No newline at end of file
+    dropped = 0
+
+    def prepare(self, record):
+        # Resolve the message and traceback now (their arguments may change or die later),
+        # but keep the traceback in exc_text so formatters can place it themselves
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = _plain_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            NonBlockingQueueHandler.dropped += 1
+
+
+def _formatter():
+    if LOG_FORMAT == "json":
+        return JsonFormatter()
+    return logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] - %(message)s')
+
+
+def _start_listener(log_file):
+    """Start the single background thread that writes queued records to the file (and console)"""
+    global _listener, _log_file
+    with _listener_lock:
+        if _listener is not None:
+            return
+        _log_file = log_file
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT
+        )
+        handlers = [file_handler]
+        if LOG_TO_CONSOLE:
+            handlers.append(logging.StreamHandler())
+        for handler in handlers:
+            handler.setFormatter(_formatter())
+        _listener = logging.handlers.QueueListener(_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+
+
+def stop_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+            _listener = None
+
+
+def _restart_listener():
+    if _log_file is not None:
+        _start_listener(_log_file)
+
+
+# Threads do not survive fork(): stop the writer thread (flushing the queue, so no lock is held
+# mid-write) before a process forks, e.g. a preloading server spawning workers, and start a
+# fresh one on each side afterwards
+os.register_at_fork(before=stop_logging, after_in_parent=_restart_listener, after_in_child=_restart_listener)
+atexit.register(stop_logging)
+
+
+def setup_logger(name, log_file=LOG_FILE, level=LOG_LEVEL, sampled=False):
+    """
+    Return a logger whose records go through the shared in-memory queue; a background
+    thread does the formatting and disk I/O. Safe to call repeatedly for the same name.
+    `sampled=True` applies LOG_SAMPLE_RATES, for loggers on per-request hot paths.
+    """
+    _start_listener(log_file)
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    logger.propagate = False
+    if not any(isinstance(handler, NonBlockingQueueHandler) for handler in logger.handlers):
+        handler = NonBlockingQueueHandler(_queue)
+        handler.addFilter(RequestIdFilter())
+        if sampled and SAMPLE_RATES:
+            handler.addFilter(SamplingFilter(SAMPLE_RATES))
+        logger.addHandler(handler)
+    return logger
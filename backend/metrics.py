@@ -0,0 +1,246 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+
+Counters and histograms are plain dicts guarded by a lock, so recording a
+sample costs about a microsecond and needs no external service; GET /metrics
+renders the current values. Histograms use fixed buckets.
+"""
+import asyncio
+import functools
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+import profiling
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(labelnames, labels, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] += amount
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{_label_text(self.labelnames, labels)} {value:g}"
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last slot is +Inf), sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            snapshot = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        for labels, counts, total in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound:g}"'
+                yield f"{self.name}_bucket{_label_text(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_label_text(self.labelnames, labels)} {total:g}"
+            yield f"{self.name}_count{_label_text(self.labelnames, labels)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._gauge_callbacks = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def gauge_callback(self, name, documentation, callback, labelnames=()):
+        """Gauge whose {labels: value} are read from `callback` at scrape time"""
+        self._gauge_callbacks.append((name, documentation, callback, labelnames))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        for name, documentation, callback, labelnames in self._gauge_callbacks:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in callback().items():
+                lines.append(f"{name}{_label_text(labelnames, labels)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HTTP_REQUESTS = registry.register(Counter(
+    "http_requests_total", "HTTP requests by route, method and status code", ("method", "route", "status")))
+HTTP_ERRORS = registry.register(Counter(
+    "http_request_errors_total", "HTTP requests that ended in a 5xx response", ("method", "route")))
+HTTP_LATENCY = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route")))
+
+DB_CALLS = registry.register(Counter(
+    "db_calls_total", "db_helper calls by function", ("function", "mode", "outcome")))
+DB_LATENCY = registry.register(Histogram(
+    "db_call_duration_seconds", "db_helper call latency by function", ("function", "mode")))
+DB_ROWS = registry.register(Counter(
+    "db_rows_total", "Rows returned or written by db_helper functions", ("function", "mode")))
+DB_ACQUIRE = registry.register(Histogram(
+    "db_connection_acquire_seconds", "Time spent waiting for a pooled connection", ("mode",)))
+
+
+# Database instrumentation
+
+def _row_count(result):
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, dict) and "inserted" in result:
+        # The counts replace_expenses_for_date / update_expenses_for_date return
+        return sum(result.get(key, 0) for key in ("inserted", "updated", "deleted"))
+    if isinstance(result, bool) or result is None:
+        return 0
+    if isinstance(result, int):
+        return result
+    return 1
+
+
+def instrument_db(func):
+    """Record call count, latency and row count for a db_helper / async_db_helper function"""
+    name = func.__name__
+
+    def record(start, rows, outcome, mode):
+        elapsed = time.perf_counter() - start
+        DB_LATENCY.observe(elapsed, name, mode)
+        profiling.record(f"db.{name}", elapsed)
+        DB_CALLS.inc(name, mode, outcome)
+        if rows:
+            DB_ROWS.inc(name, mode, amount=rows)
+
+    if inspect.isasyncgenfunction(func):
+        @functools.wraps(func)
+        async def async_gen_wrapper(*args, **kwargs):
+            start, rows, outcome = time.perf_counter(), 0, "error"
+            batches = func(*args, **kwargs)
+            try:
+                async for batch in batches:
+                    rows += len(batch)
+                    yield batch
+                outcome = "ok"
+            finally:
+                # Close the inner generator now so it releases its connection promptly
+                await batches.aclose()
+                record(start, rows, outcome, "async")
+        return async_gen_wrapper
+
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def gen_wrapper(*args, **kwargs):
+            start, rows, outcome = time.perf_counter(), 0, "error"
+            batches = func(*args, **kwargs)
+            try:
+                for batch in batches:
+                    rows += len(batch)
+                    yield batch
+                outcome = "ok"
+            finally:
+                batches.close()
+                record(start, rows, outcome, "sync")
+        return gen_wrapper
+
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = await func(*args, **kwargs)
+            except BaseException:
+                record(start, 0, "error", "async")
+                raise
+            record(start, _row_count(result), "ok", "async")
+            return result
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except BaseException:
+            record(start, 0, "error", "sync")
+            raise
+        record(start, _row_count(result), "ok", "sync")
+        return result
+    return wrapper
+
+
+# HTTP instrumentation
+
+class MetricsMiddleware:
+    """ASGI middleware recording request count, 5xx count and latency per route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router stores the matched route in the shared scope
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            method = scope["method"]
+            HTTP_LATENCY.observe(time.perf_counter() - start, method, path)
+            HTTP_REQUESTS.inc(method, path, status)
+            if status >= 500:
+                HTTP_ERRORS.inc(method, path)
@@ -0,0 +1,264 @@
+"""
+Versioned schema migrations for the expense tracker database.
+
+Each migration runs once and is recorded in `schema_migrations`. Every step
+is written to be safe against databases that were created by hand before
+this module existed, so `upgrade` can be pointed at an existing install.
+
+    python migrations.py upgrade        # apply pending migrations
+    python migrations.py status         # list applied / pending migrations
+    python migrations.py check-plans    # EXPLAIN the db_helper queries, fail on full table scans
+
+Set RUN_MIGRATIONS=1 to apply pending migrations when the API starts.
+"""
+import argparse
+import sys
+from datetime import date
+
+import budgets
+import db_helper
+import rollups
+from logging_setup import setup_logger
+
+logger = setup_logger('migrations')
+
+# Serialises concurrent upgrades (e.g. several workers starting at once)
+LOCK_NAME = "expense_tracker_migrations"
+LOCK_TIMEOUT_SECONDS = 60
+
+CREATE_SCHEMA_MIGRATIONS = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INT PRIMARY KEY,
+        description VARCHAR(255) NOT NULL,
+        applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+
+# Helpers
+
+def _index_exists(cursor, table, index_name):
+    cursor.execute(
+        """SELECT 1 FROM information_schema.statistics
+           WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+           LIMIT 1""",
+        (table, index_name)
+    )
+    return cursor.fetchone() is not None
+
+
+def _add_index(cursor, table, index_name, definition):
+    # MySQL has no CREATE INDEX IF NOT EXISTS
+    if not _index_exists(cursor, table, index_name):
+        cursor.execute(f"ALTER TABLE {table} ADD {definition}")
+
+
+def _column_length(cursor, table, column):
+    cursor.execute(
+        """SELECT character_maximum_length AS length FROM information_schema.columns
+           WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s""",
+        (table, column)
+    )
+    row = cursor.fetchone()
+    return row['length'] if row else None
+
+
+# Migrations
+
+def _create_base_tables(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            actual_name VARCHAR(100) NOT NULL,
+            username VARCHAR(50) NOT NULL,
+            password_hash VARCHAR(255) NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS expenses (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            expense_date DATE NOT NULL,
+            amount DECIMAL(10, 2) NOT NULL,
+            category VARCHAR(50) NOT NULL,
+            notes TEXT,
+            user_id INT NOT NULL,
+            CONSTRAINT fk_expenses_user FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    """)
+
+
+def _add_username_index(cursor):
+    # Fails if duplicate usernames already exist; those must be resolved by hand first
+    _add_index(cursor, "users", "uq_users_username", "UNIQUE INDEX uq_users_username (username)")
+
+
+def _add_expense_covering_index(cursor):
+    # Serves the per-day reads/deletes and the rollup rebuild/verify scans from the index alone
+    _add_index(
+        cursor, "expenses", "idx_expenses_user_date_category_amount",
+        "INDEX idx_expenses_user_date_category_amount (user_id, expense_date, category, amount)"
+    )
+
+
+def _add_expense_keyset_index(cursor):
+    # Lets date-range listings walk (expense_date, id) in order and stop at LIMIT
+    _add_index(
+        cursor, "expenses", "idx_expenses_user_date_id",
+        "INDEX idx_expenses_user_date_id (user_id, expense_date, id)"
+    )
+
+
+def _create_rollup_tables(cursor):
+    cursor.execute(rollups.CREATE_DAILY_ROLLUP)
+    cursor.execute(rollups.CREATE_MONTHLY_ROLLUP)
+    rollups.rebuild(cursor)
+
+
+def _create_budget_table(cursor):
+    cursor.execute(budgets.CREATE_BUDGETS)
+
+
+def _widen_password_hash(cursor):
+    # Hand-made installs may have a shorter column that cannot hold a scrypt hash
+    length = _column_length(cursor, "users", "password_hash")
+    if length is not None and length < 255:
+        cursor.execute("ALTER TABLE users MODIFY password_hash VARCHAR(255) NOT NULL")
+
+
+MIGRATIONS = [
+    (1, "create users and expenses tables", _create_base_tables),
+    (2, "unique index on users.username", _add_username_index),
+    (3, "covering index on expenses (user_id, expense_date, category, amount)", _add_expense_covering_index),
+    (4, "create and backfill category rollup tables", _create_rollup_tables),
+    (5, "keyset pagination index on expenses (user_id, expense_date, id)", _add_expense_keyset_index),
+    (6, "create per-category monthly budget table", _create_budget_table),
+    (7, "widen users.password_hash to VARCHAR(255)", _widen_password_hash),
+]
+
+
+def applied_versions(cursor):
+    cursor.execute(CREATE_SCHEMA_MIGRATIONS)
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row['version'] for row in cursor.fetchall()}
+
+
+def upgrade():
+    """Apply every pending migration in version order; returns the versions applied"""
+    applied = []
+    # The lock and the migrations share one pooled connection, so upgrading works with DB_POOL_SIZE=1
+    with db_helper.get_pool().connection() as connection:
+        cursor = connection.cursor(dictionary=True)
+        try:
+            cursor.execute("SELECT GET_LOCK(%s, %s) AS acquired", (LOCK_NAME, LOCK_TIMEOUT_SECONDS))
+            if not cursor.fetchone()['acquired']:
+                raise RuntimeError("Timed out waiting for the migration lock")
+            try:
+                done = applied_versions(cursor)
+                for version, description, apply in MIGRATIONS:
+                    if version in done:
+                        continue
+                    logger.info("Applying migration %s: %s", version, description)
+                    # DDL commits implicitly in MySQL, so each step is recorded as soon as it finishes
+                    connection.start_transaction()
+                    try:
+                        apply(cursor)
+                        cursor.execute(
+                            "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                            (version, description)
+                        )
+                        connection.commit()
+                    except Exception:
+                        if connection.in_transaction:
+                            connection.rollback()
+                        raise
+                    applied.append(version)
+            finally:
+                # GET_LOCK is held by the session, so it survives the commits above
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+                cursor.fetchall()
+        finally:
+            cursor.close()
+    return applied
+
+
+def status():
+    with db_helper.get_db_cursor() as cursor:
+        done = applied_versions(cursor)
+    return [(version, description, version in done) for version, description, _ in MIGRATIONS]
+
+
+# Query plan checks
+
+def _plan_checks():
+    """(name, sql, params) for every query db_helper sends, with representative parameters"""
+    user_id, day = 1, date(2024, 1, 15)
+    checks = [
+        ("get_user_by_username", db_helper.SELECT_USER_BY_USERNAME, ("someone",)),
+        ("fetch_expenses_for_date", db_helper.SELECT_EXPENSES_FOR_DATE, (day, user_id)),
+        ("delete_expenses_for_date", db_helper.DELETE_EXPENSES_FOR_DATE, (day, user_id)),
+        ("lock_day_totals", rollups.DAY_CATEGORY_TOTALS_FOR_UPDATE.replace("FOR UPDATE", ""), (day, user_id)),
+    ]
+    sql, params = db_helper.expense_range_query(user_id, date(2024, 1, 1), date(2024, 3, 31),
+                                                after=(date(2024, 2, 1), 100), limit=101)
+    checks.append(("fetch_expenses_in_range", sql, params))
+    sql, params = db_helper.lock_expenses_query(day, user_id, [100, 101])
+    checks.append(("update_expenses_for_date", sql.replace("FOR UPDATE", ""), params))
+    sql, params = rollups.category_summary_query(user_id, date(2024, 1, 15), date(2024, 4, 10))
+    checks.append(("fetch_expense_summary_by_catrgory", sql, params))
+    sql, params = rollups.monthly_summary_query(user_id, date(2023, 6, 10), date(2024, 4, 10))
+    checks.append(("fetch_expense_summary_by_month", sql, params))
+    checks.append(("fetch_budget_status", *budgets.status_query(user_id, date(2024, 1, 1), ["Food", "Rent"])))
+    for period in ("week", "year"):
+        sql, params = rollups.series_query(user_id, date(2023, 6, 10), date(2024, 4, 10), period, by_category=True)
+        checks.append((f"fetch_expense_series({period})", sql, params))
+    return checks
+
+
+def check_query_plans():
+    """
+    EXPLAIN each db_helper query and return the ones that scan a whole base table
+    (access type ALL). Run against a database with realistic row counts; on
+    near-empty tables the optimizer may legitimately prefer a scan.
+    """
+    failures = []
+    with db_helper.get_db_cursor() as cursor:
+        for name, sql, params in _plan_checks():
+            cursor.execute("EXPLAIN " + sql, params)
+            for row in cursor.fetchall():
+                table = row.get('table') or ""
+                # <derivedN>/<unionN> are materialised subqueries, not base tables
+                if row.get('type') == "ALL" and not table.startswith("<"):
+                    failures.append({
+                        "query": name,
+                        "table": table,
+                        "possible_keys": row.get('possible_keys'),
+                        "rows": row.get('rows'),
+                    })
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Expense tracker schema migrations")
+    parser.add_argument("command", choices=["upgrade", "status", "check-plans"])
+    args = parser.parse_args(argv)
+
+    if args.command == "upgrade":
+        applied = upgrade()
+        print(f"Applied migrations: {applied}" if applied else "Schema is up to date")
+        return 0
+
+    if args.command == "status":
+        for version, description, is_applied in status():
+            print(f"{version:>4}  {'applied' if is_applied else 'pending':<8} {description}")
+        return 0
+
+    failures = check_query_plans()
+    for failure in failures:
+        print(f"FULL SCAN: {failure['query']} on {failure['table']} "
+              f"(possible_keys={failure['possible_keys']}, rows={failure['rows']})")
+    print(f"{len(failures)} query plan(s) with full table scans")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
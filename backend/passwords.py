@@ -0,0 +1,85 @@
+"""
+Password hashing.
+
+Passwords are stored as scrypt hashes (memory-hard, from the standard
+library) in the form  scrypt$<n>$<r>$<p>$<salt>$<hash>.  Rows created before
+hashing was introduced hold the plain password; verify_password still
+accepts those and needs_rehash() tells the login path to upgrade them.
+
+Hashing deliberately costs tens of milliseconds and ~16 MB, so the async
+helpers run it on a small dedicated thread pool: a burst of logins queues
+there instead of blocking the event loop or the default threadpool.
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+SCRYPT_N = int(os.getenv("SCRYPT_N", str(2 ** 14)))
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_BYTES = 16
+KEY_BYTES = 32
+PREFIX = "scrypt"
+
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("PASSWORD_HASH_WORKERS", "2")),
+    thread_name_prefix="password-hash"
+)
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(
+        password.encode(), salt=salt, n=n, r=r, p=p, dklen=KEY_BYTES,
+        maxmem=256 * n * r * p
+    )
+
+
+def _b64(data):
+    return base64.b64encode(data).decode()
+
+
+def hash_password(password):
+    salt = os.urandom(SALT_BYTES)
+    key = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f"{PREFIX}${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(key)}"
+
+
+def is_hashed(stored_password):
+    return stored_password.startswith(PREFIX + "$")
+
+
+def verify_password(plain_password, stored_password):
+    """Check a password against a stored scrypt hash, or a legacy plain text value"""
+    if not is_hashed(stored_password):
+        return hmac.compare_digest(plain_password.encode(), stored_password.encode())
+    try:
+        _, n, r, p, salt, key = stored_password.split("$")
+        expected = base64.b64decode(key)
+        actual = _scrypt(plain_password, base64.b64decode(salt), int(n), int(r), int(p))
+    except ValueError:
+        return False
+    return hmac.compare_digest(actual, expected)
+
+
+def needs_rehash(stored_password):
+    """True for legacy plain text values and hashes made with outdated parameters"""
+    return not stored_password.startswith(f"{PREFIX}${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$")
+
+
+# Verified against on unknown usernames so they take as long as wrong passwords
+_DUMMY_HASH = hash_password(_b64(os.urandom(12)))
+
+
+async def hash_password_async(password):
+    return await asyncio.get_running_loop().run_in_executor(_executor, hash_password, password)
+
+
+async def verify_password_async(plain_password, stored_password):
+    if stored_password is None:
+        stored_password = _DUMMY_HASH
+    return await asyncio.get_running_loop().run_in_executor(
+        _executor, verify_password, plain_password, stored_password
+    )
@@ -0,0 +1,182 @@
+"""
+Opt-in per-request profiling (PROFILING=1).
+
+ProfilingMiddleware gives every request a phase table that instrumented code
+adds to (auth, db_connect, db_query, aggregate, serialize and one db.<function>
+entry per data-access call) and returns it in a Server-Timing header, so the
+browser dev tools or `curl -v` show where a slow request spent its time.
+"serialize" covers response rendering (formats.py); FastAPI's jsonable_encoder pass is part of
+the unattributed remainder of "total".
+
+While requests are in flight a background thread samples the event loop
+thread's stack every PROFILE_INTERVAL_MS into a ring buffer. When a request
+carries the PROFILE_HEADER header, or takes longer than PROFILE_THRESHOLD_MS,
+the samples taken during it are written to PROFILE_DIR as collapsed stacks
+(flamegraph.pl / speedscope format). The loop is shared, so overlapping
+requests show up in each other's profiles.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+ENABLED = os.getenv("PROFILING", "0") == "1"
+PROFILE_HEADER = os.getenv("PROFILE_HEADER", "X-Debug-Profile").lower().encode()
+PROFILE_THRESHOLD_MS = float(os.getenv("PROFILE_THRESHOLD_MS", "1000"))  # 0 disables
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_BUFFER_SECONDS = float(os.getenv("PROFILE_BUFFER_SECONDS", "30"))
+
+# Phase name -> seconds for the request being handled; None outside profiled requests
+_timings = contextvars.ContextVar("profiling_timings", default=None)
+
+
+# Phase timing
+
+def record(name, seconds):
+    """Add `seconds` to phase `name` of the current request (no-op when not profiling)"""
+    timings = _timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def phase(name):
+    """Time the enclosed block as phase `name` of the current request"""
+    if _timings.get() is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def timed(name):
+    """Decorator form of phase() for coroutine functions (keeps the signature FastAPI inspects)"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with phase(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def server_timing(timings, total):
+    entries = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items()]
+    entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries)
+
+
+# Stack sampling
+
+class StackSampler:
+    """Background thread sampling one thread's stack into a time-stamped ring buffer"""
+
+    def __init__(self, interval, buffer_seconds):
+        self.interval = interval
+        self.samples = deque(maxlen=max(1, int(buffer_seconds / interval)))
+        self.active = 0  # requests in flight; the thread idles when there are none
+        self.target = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self, target):
+        with self._lock:
+            if self._thread is None:
+                self.target = target
+                self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            if not self.active:
+                continue
+            frame = sys._current_frames().get(self.target)
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            # Code objects are kept as-is; formatting waits until a profile is written
+            self.samples.append((time.perf_counter(), tuple(stack)))
+
+    def collapsed(self, start, end):
+        """Samples taken in [start, end] as 'outer;...;inner count' lines"""
+        counts = Counter(stack for taken, stack in list(self.samples) if start <= taken <= end)
+        lines = []
+        for stack, count in counts.most_common():
+            frames = (f"{os.path.basename(code.co_filename)}:{code.co_name}" for code in reversed(stack))
+            lines.append(f"{';'.join(frames)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+sampler = StackSampler(PROFILE_INTERVAL_MS / 1000, PROFILE_BUFFER_SECONDS)
+
+
+def _write_profile(request_id, method, path, elapsed, lines):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    # The request id may come from the client, so only safe characters reach the file name
+    request_id = "".join(c for c in request_id if c.isalnum() or c in "-_")[:64] or "request"
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    filename = os.path.join(PROFILE_DIR, f"{stamp}-{request_id}.collapsed")
+    with open(filename, "w") as f:
+        f.write(f"# {method} {path} {elapsed * 1000:.1f}ms\n")
+        f.write(lines)
+    return filename
+
+
+class ProfilingMiddleware:
+    """ASGI middleware adding Server-Timing and saving sampled profiles of slow or flagged requests"""
+
+    def __init__(self, app, logger=None):
+        self.app = app
+        self.logger = logger
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        sampler.start(threading.get_ident())
+        debug = any(name.lower() == PROFILE_HEADER for name, _ in scope["headers"])
+        timings = {}
+        token = _timings.set(timings)
+        request_id = "-"
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal request_id
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                for name, value in headers:
+                    if name.lower() == b"x-request-id":
+                        request_id = value.decode("latin-1")
+                value = server_timing(timings, time.perf_counter() - start)
+                headers.append((b"server-timing", value.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        sampler.active += 1
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            sampler.active -= 1
+            _timings.reset(token)
+            end = time.perf_counter()
+            elapsed = end - start
+            if debug or (PROFILE_THRESHOLD_MS and elapsed * 1000 >= PROFILE_THRESHOLD_MS):
+                lines = sampler.collapsed(start, end)
+                filename = await asyncio.to_thread(
+                    _write_profile, request_id, scope["method"], scope["path"], elapsed, lines
+                )
+                if self.logger is not None:
+                    self.logger.info("Saved profile of %s %s (%.1fms) to %s",
+                                     scope["method"], scope["path"], elapsed * 1000, filename)
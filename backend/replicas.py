@@ -0,0 +1,163 @@
+"""
+Read-replica routing shared by the storage backends.
+
+With replicas configured (DB_REPLICAS for MySQL, SQLITE_REPLICAS for the
+SQLite stand-in), reads that can tolerate replication lag - the fetch_*
+functions and get_user_by_username - go to a replica, and everything else
+(writes, and the reads inside a write's transaction) goes to the primary.
+
+- Replicas take reads in turn. One that cannot be reached (a connection
+  error, not a full pool) is skipped for DB_REPLICA_RETRY_SECONDS and its
+  reads fall back to the primary; after that the next read tries it again.
+  A read whose replica fails mid-query is run once more on the primary
+  (retry_on_primary), so a replica going away never fails a request.
+  Health checking is passive on purpose: the read that finds a replica back
+  up is the probe, and if it is still down that read just pays for one
+  short connect attempt (DB_CONNECT_TIMEOUT) before going to the primary.
+- Read-your-writes: once a write for a user commits, that user's reads stay on
+  the primary for DB_READ_AFTER_WRITE_SECONDS, which should be longer than the
+  replicas ever lag, so a save is never followed by stale data.
+  The write times live in shared memory created at import, so with serve.py
+  (which imports the app before forking workers) every worker sees every
+  other worker's writes. Users hash into STICKY_SLOTS slots; two users sharing
+  a slot only costs an extra read on the primary.
+"""
+import contextvars
+import functools
+import inspect
+import multiprocessing
+import os
+import threading
+import time
+import zlib
+
+from logging_setup import setup_logger
+
+logger = setup_logger('replicas')
+
+READ_AFTER_WRITE_SECONDS = float(os.getenv("DB_READ_AFTER_WRITE_SECONDS", "5"))
+RETRY_SECONDS = float(os.getenv("DB_REPLICA_RETRY_SECONDS", "30"))
+STICKY_SLOTS = 16384
+
+# time.monotonic() of the last committed write per slot (system-wide clock, shared by all workers)
+_last_write = multiprocessing.RawArray("d", STICKY_SLOTS)
+
+# Set while retry_on_primary re-runs a read, so every read in it goes to the primary
+_primary_only = contextvars.ContextVar("replicas_primary_only", default=False)
+
+
+def parse_hosts(value, default_port):
+    """"db2:3307, db3" -> [("db2", 3307), ("db3", default_port)]"""
+    hosts = []
+    for item in (value or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        host, _, port = item.partition(":")
+        hosts.append((host, int(port) if port else default_port))
+    return hosts
+
+
+# Read-your-writes
+
+def _slot(user_key):
+    return zlib.crc32(str(user_key).encode()) % STICKY_SLOTS
+
+
+def note_write(user_key):
+    """Record that a write for `user_key` (a user id, or a username) just committed"""
+    if user_key is not None:
+        _last_write[_slot(user_key)] = time.monotonic()
+
+
+def recently_wrote(user_key):
+    if user_key is None:
+        return False
+    return time.monotonic() - _last_write[_slot(user_key)] < READ_AFTER_WRITE_SECONDS
+
+
+# Failover
+
+class ReplicaFailed(Exception):
+    """A read failed with a connection error on `replica`, which has been marked down"""
+
+    def __init__(self, replica):
+        super().__init__(f"Read failed on replica {replica}")
+        self.replica = replica
+
+
+def retry_on_primary(func):
+    """Run a replica read (a function or coroutine function) once more on the primary if its replica failed"""
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            try:
+                return await func(*args, **kwargs)
+            except ReplicaFailed:
+                token = _primary_only.set(True)
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    _primary_only.reset(token)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except ReplicaFailed:
+            token = _primary_only.set(True)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _primary_only.reset(token)
+    return wrapper
+
+
+# Replica selection
+
+class ReplicaSet:
+    """The replicas of one backend, with their health and read counts"""
+
+    def __init__(self, replicas):
+        self.replicas = list(replicas)
+        self._lock = threading.Lock()
+        self._next = 0
+        self._down_until = {}
+        self._reads = {"primary": 0, **{str(replica): 0 for replica in self.replicas}}
+
+    def choose(self, user_key=None):
+        """The replica for a read on behalf of `user_key`, or None to read from the primary"""
+        if not self.replicas or _primary_only.get() or recently_wrote(user_key):
+            return None
+        now = time.monotonic()
+        with self._lock:
+            for _ in range(len(self.replicas)):
+                replica = self.replicas[self._next % len(self.replicas)]
+                self._next += 1
+                if self._down_until.get(replica, 0.0) <= now:
+                    return replica
+        return None
+
+    def mark_down(self, replica, error):
+        """Skip `replica` for RETRY_SECONDS after it failed"""
+        logger.warning("Replica %s unavailable, reading from the primary for %ss: %s", replica, RETRY_SECONDS, error)
+        with self._lock:
+            self._down_until[replica] = time.monotonic() + RETRY_SECONDS
+
+    def record(self, replica):
+        """Count a read served by `replica` (None: the primary)"""
+        with self._lock:
+            self._reads["primary" if replica is None else str(replica)] += 1
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "replicas": [
+                    {"replica": str(replica), "healthy": self._down_until.get(replica, 0.0) <= now,
+                     "reads": self._reads[str(replica)]}
+                    for replica in self.replicas
+                ],
+                "primary_reads": self._reads["primary"],
+            }
@@ -0,0 +1,360 @@
+"""
+Per-category spending rollups.
+
+expense_daily_rollup and expense_monthly_rollup hold one row per
+(user_id, day or month, category) with the running total and row count.
+The write path in db_helper keeps them in step with `expenses` inside the
+same transaction, and the analytics queries read buckets from here instead
+of scanning raw expense rows.
+
+Run `python rollups.py verify` to compare the rollups against `expenses`,
+`python rollups.py reconcile` to recompute the rollups of just the users
+that drifted (safe to schedule, e.g. nightly from cron), or
+`python rollups.py rebuild` to recompute them from scratch.
+"""
+import argparse
+import sys
+from collections import defaultdict
+from datetime import timedelta
+from decimal import ROUND_HALF_UP, Decimal
+
+CENT = Decimal("0.01")
+
+CREATE_DAILY_ROLLUP = """
+    CREATE TABLE IF NOT EXISTS expense_daily_rollup (
+        user_id INT NOT NULL,
+        expense_date DATE NOT NULL,
+        category VARCHAR(50) NOT NULL,
+        total DECIMAL(14, 2) NOT NULL,
+        expense_count INT NOT NULL,
+        PRIMARY KEY (user_id, expense_date, category)
+    )
+"""
+
+CREATE_MONTHLY_ROLLUP = """
+    CREATE TABLE IF NOT EXISTS expense_monthly_rollup (
+        user_id INT NOT NULL,
+        expense_month DATE NOT NULL,
+        category VARCHAR(50) NOT NULL,
+        total DECIMAL(14, 2) NOT NULL,
+        expense_count INT NOT NULL,
+        PRIMARY KEY (user_id, expense_month, category)
+    )
+"""
+
+# Current per-category totals for one day; FOR UPDATE locks the rows about to be replaced
+DAY_CATEGORY_TOTALS_FOR_UPDATE = """
+    SELECT category, SUM(amount) AS total, COUNT(*) AS expense_count
+    FROM expenses
+    WHERE expense_date = %s AND user_id = %s
+    GROUP BY category
+    FOR UPDATE
+"""
+
+# VALUES() rather than a row alias: both mysql.connector and PyMySQL only rewrite
+# executemany() into a single multi-row INSERT for this form
+UPSERT_DAILY = """
+    INSERT INTO expense_daily_rollup (user_id, expense_date, category, total, expense_count)
+    VALUES (%s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE total = total + VALUES(total),
+                            expense_count = expense_count + VALUES(expense_count)
+"""
+
+UPSERT_MONTHLY = """
+    INSERT INTO expense_monthly_rollup (user_id, expense_month, category, total, expense_count)
+    VALUES (%s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE total = total + VALUES(total),
+                            expense_count = expense_count + VALUES(expense_count)
+"""
+
+PRUNE_DAILY = "DELETE FROM expense_daily_rollup WHERE user_id = %s AND expense_date = %s AND expense_count <= 0"
+PRUNE_MONTHLY = "DELETE FROM expense_monthly_rollup WHERE user_id = %s AND expense_month = %s AND expense_count <= 0"
+
+# First day of the month containing a DATE column
+MONTH_OF_DAY = "DATE_SUB(expense_date, INTERVAL DAY(expense_date) - 1 DAY)"
+# Monday of the week containing a DATE column, and January 1st of the year containing expense_month
+WEEK_OF_DAY = "DATE_SUB(expense_date, INTERVAL WEEKDAY(expense_date) DAY)"
+YEAR_OF_MONTH = "MAKEDATE(YEAR(expense_month), 1)"
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def next_month(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def to_decimal(value):
+    """
+    Round an amount to cents half away from zero, as MySQL does when storing into DECIMAL(10, 2).
+    The write paths round once with this and send the same value to `expenses` and the rollups.
+    """
+    return Decimal(str(value)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+# Write path
+
+def compute_deltas(removed=(), added=()):
+    """
+    Net per-category change for one day.
+    `removed` holds rows shaped like DAY_CATEGORY_TOTALS_FOR_UPDATE results,
+    `added` holds (category, amount) pairs. Returns [(category, total, count)].
+    """
+    deltas = defaultdict(lambda: [Decimal(0), 0])
+    for row in removed:
+        bucket = deltas[row['category']]
+        bucket[0] -= to_decimal(row['total'])
+        bucket[1] -= int(row['expense_count'])
+    for category, amount in added:
+        bucket = deltas[category]
+        bucket[0] += to_decimal(amount)
+        bucket[1] += 1
+    return [(category, total, count) for category, (total, count) in deltas.items() if total or count]
+
+
+def delta_statements(user_id, expense_date, deltas):
+    """
+    Statements that apply `deltas` to both rollup tables, as (sql, params, many) tuples.
+    Buckets whose row count drops to zero are removed.
+    """
+    if not deltas:
+        return []
+    month = month_start(expense_date)
+    return [
+        (UPSERT_DAILY, [(user_id, expense_date, c, t, n) for c, t, n in deltas], True),
+        (UPSERT_MONTHLY, [(user_id, month, c, t, n) for c, t, n in deltas], True),
+        (PRUNE_DAILY, (user_id, expense_date), False),
+        (PRUNE_MONTHLY, (user_id, month), False),
+    ]
+
+
+def insert_statements(user_id, rows):
+    """
+    Statements that add newly inserted rows to both rollup tables, as (sql, params, many) tuples.
+    `rows` holds (expense_date, category, amount) triples spanning any number of days.
+    """
+    daily = defaultdict(lambda: [Decimal(0), 0])
+    monthly = defaultdict(lambda: [Decimal(0), 0])
+    for expense_date, category, amount in rows:
+        amount = to_decimal(amount)
+        for bucket in (daily[(expense_date, category)], monthly[(month_start(expense_date), category)]):
+            bucket[0] += amount
+            bucket[1] += 1
+    if not daily:
+        return []
+    return [
+        (UPSERT_DAILY, [(user_id, day, c, t, n) for (day, c), (t, n) in daily.items()], True),
+        (UPSERT_MONTHLY, [(user_id, month, c, t, n) for (month, c), (t, n) in monthly.items()], True),
+    ]
+
+
+# Read path
+
+def split_range(start_date, end_date):
+    """
+    Split an inclusive date range into whole months and the partial-month days at either end.
+    Either bound may be None (unbounded). Returns (day_ranges, month_bounds) where day_ranges is a
+    list of inclusive (first_day, last_day) pairs and month_bounds is a half-open
+    (first_month, stop_month) pair (None entries are unbounded), or None if no month is fully covered.
+    """
+    if start_date is None:
+        first_full = None
+    else:
+        first_full = start_date if start_date.day == 1 else next_month(start_date)
+    stop_full = None if end_date is None else month_start(end_date + timedelta(days=1))
+
+    if first_full is not None and stop_full is not None and first_full >= stop_full:
+        return [(start_date, end_date)], None
+
+    day_ranges = []
+    if start_date is not None and start_date < first_full:
+        day_ranges.append((start_date, first_full - timedelta(days=1)))
+    if end_date is not None and stop_full <= end_date:
+        day_ranges.append((stop_full, end_date))
+    return day_ranges, (first_full, stop_full)
+
+
+def _bucket_selects(user_id, start_date, end_date, daily_columns, monthly_columns):
+    day_ranges, month_bounds = split_range(start_date, end_date)
+    selects, params = [], []
+    if day_ranges:
+        clause = " OR ".join("expense_date BETWEEN %s AND %s" for _ in day_ranges)
+        selects.append(f"SELECT {daily_columns} FROM expense_daily_rollup WHERE user_id = %s AND ({clause})")
+        params.append(user_id)
+        for first_day, last_day in day_ranges:
+            params.extend([first_day, last_day])
+    if month_bounds is not None:
+        first_month, stop_month = month_bounds
+        sql = f"SELECT {monthly_columns} FROM expense_monthly_rollup WHERE user_id = %s"
+        params.append(user_id)
+        if first_month is not None:
+            sql += " AND expense_month >= %s"
+            params.append(first_month)
+        if stop_month is not None:
+            sql += " AND expense_month < %s"
+            params.append(stop_month)
+        selects.append(sql)
+    return " UNION ALL ".join(selects), tuple(params)
+
+
+def category_summary_query(user_id, start_date, end_date):
+    """Per-category totals for an inclusive date range, reading whole months from the monthly rollup"""
+    buckets, params = _bucket_selects(user_id, start_date, end_date, "category, total", "category, total")
+    sql = f"""
+        SELECT category, CAST(SUM(total) AS DECIMAL(14, 2)) AS total
+        FROM ({buckets}) AS buckets
+        GROUP BY category
+    """
+    return sql, params
+
+
+def monthly_summary_query(user_id, start_date=None, end_date=None):
+    """Per-month totals, newest first; partial months at the range edges come from the daily rollup"""
+    buckets, params = _bucket_selects(
+        user_id, start_date, end_date, f"{MONTH_OF_DAY} AS expense_month, total", "expense_month, total"
+    )
+    sql = f"""
+        SELECT expense_month, CAST(SUM(total) AS DECIMAL(14, 2)) AS total
+        FROM ({buckets}) AS buckets
+        GROUP BY expense_month
+        ORDER BY expense_month DESC
+    """
+    return sql, params
+
+
+def series_query(user_id, start_date, end_date, period, by_category=False):
+    """
+    Spending per day / week / month / year bucket (named by its first day) in an inclusive date
+    range, oldest first, per category when `by_category`. Day and week buckets are summed from the
+    daily rollup; month and year buckets read whole months from the monthly rollup.
+    """
+    category = ", category" if by_category else ""
+    if period in ("day", "week"):
+        bucket = "expense_date" if period == "day" else WEEK_OF_DAY
+        sql = f"""
+            SELECT {bucket} AS bucket{category}, CAST(SUM(total) AS DECIMAL(14, 2)) AS total
+            FROM expense_daily_rollup
+            WHERE user_id = %s AND expense_date BETWEEN %s AND %s
+            GROUP BY bucket{category}
+            ORDER BY bucket{category}
+        """
+        return sql, (user_id, start_date, end_date)
+    buckets, params = _bucket_selects(
+        user_id, start_date, end_date,
+        f"{MONTH_OF_DAY} AS expense_month{category}, total", f"expense_month{category}, total"
+    )
+    bucket = "expense_month" if period == "month" else YEAR_OF_MONTH
+    sql = f"""
+        SELECT {bucket} AS bucket{category}, CAST(SUM(total) AS DECIMAL(14, 2)) AS total
+        FROM ({buckets}) AS buckets
+        GROUP BY bucket{category}
+        ORDER BY bucket{category}
+    """
+    return sql, params
+
+
+# Rebuild / verify
+
+def _user_filter(user_id):
+    return (" WHERE user_id = %s", (user_id,)) if user_id is not None else ("", ())
+
+
+def rebuild(cursor, user_id=None):
+    """Recompute both rollup tables from `expenses` (for one user, or everyone)"""
+    where, params = _user_filter(user_id)
+    cursor.execute(f"DELETE FROM expense_daily_rollup{where}", params)
+    cursor.execute(f"DELETE FROM expense_monthly_rollup{where}", params)
+    cursor.execute(
+        f"""INSERT INTO expense_daily_rollup (user_id, expense_date, category, total, expense_count)
+            SELECT user_id, expense_date, category, SUM(amount), COUNT(*)
+            FROM expenses{where}
+            GROUP BY user_id, expense_date, category""",
+        params
+    )
+    cursor.execute(
+        f"""INSERT INTO expense_monthly_rollup (user_id, expense_month, category, total, expense_count)
+            SELECT user_id, {MONTH_OF_DAY} AS expense_month, category, SUM(total), SUM(expense_count)
+            FROM expense_daily_rollup{where}
+            GROUP BY user_id, expense_month, category""",
+        params
+    )
+
+
+def _buckets(cursor, sql, params):
+    cursor.execute(sql, params)
+    return {
+        (row['user_id'], row['bucket'], row['category'].capitalize()): (to_decimal(row['total']), int(row['expense_count']))
+        for row in cursor.fetchall()
+    }
+
+
+def _diff(kind, expected, actual):
+    drift = []
+    for key in sorted(expected.keys() | actual.keys(), key=str):
+        want, have = expected.get(key), actual.get(key)
+        if want != have:
+            user_id, bucket, category = key
+            drift.append({
+                "table": kind, "user_id": user_id, "bucket": str(bucket), "category": category,
+                "expected": want, "actual": have
+            })
+    return drift
+
+
+def verify(cursor, user_id=None):
+    """Compare both rollup tables with totals computed from `expenses`; returns a list of drifted buckets"""
+    where, params = _user_filter(user_id)
+    raw_daily = _buckets(cursor, f"""
+        SELECT user_id, expense_date AS bucket, category, SUM(amount) AS total, COUNT(*) AS expense_count
+        FROM expenses{where} GROUP BY user_id, expense_date, category""", params)
+    raw_monthly = _buckets(cursor, f"""
+        SELECT user_id, {MONTH_OF_DAY} AS bucket, category, SUM(amount) AS total, COUNT(*) AS expense_count
+        FROM expenses{where} GROUP BY user_id, bucket, category""", params)
+    daily = _buckets(cursor, f"""
+        SELECT user_id, expense_date AS bucket, category, total, expense_count
+        FROM expense_daily_rollup{where}""", params)
+    monthly = _buckets(cursor, f"""
+        SELECT user_id, expense_month AS bucket, category, total, expense_count
+        FROM expense_monthly_rollup{where}""", params)
+    return _diff("daily", raw_daily, daily) + _diff("monthly", raw_monthly, monthly)
+
+
+def main(argv=None):
+    import db_helper
+
+    parser = argparse.ArgumentParser(description="Verify, reconcile or rebuild the expense rollup tables")
+    parser.add_argument("command", choices=["verify", "reconcile", "rebuild"])
+    parser.add_argument("--user-id", type=int, default=None, help="limit to a single user")
+    args = parser.parse_args(argv)
+
+    if args.command == "rebuild":
+        with db_helper.get_db_cursor(commit=True) as cursor:
+            cursor.execute(CREATE_DAILY_ROLLUP)
+            cursor.execute(CREATE_MONTHLY_ROLLUP)
+        with db_helper.get_db_cursor(commit=True) as cursor:
+            rebuild(cursor, args.user_id)
+        print("Rollups rebuilt")
+        return 0
+
+    with db_helper.get_db_cursor() as cursor:
+        drift = verify(cursor, args.user_id)
+
+    if args.command == "reconcile":
+        users = sorted({item['user_id'] for item in drift})
+        for user_id in users:
+            # One transaction per user, so a large install is not locked all at once
+            with db_helper.get_db_cursor(commit=True) as cursor:
+                rebuild(cursor, user_id)
+        print(f"{len(drift)} drifted bucket(s), rollups rebuilt for {len(users)} user(s)")
+        return 0
+
+    for item in drift:
+        print(f"{item['table']} user_id={item['user_id']} {item['bucket']} {item['category']}: "
+              f"expected {item['expected']}, found {item['actual']}")
+    print(f"{len(drift)} drifted bucket(s)")
+    return 1 if drift else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+"""
+Spending series for GET /analytics_series/{user_id}.
+
+The database sums spending into day / week / month / year buckets
+(fetch_expense_series, from the rollup tables); this module lays those totals
+out on the full bucket index of the requested range and derives, per bucket
+(and per category when asked), with vectorized NumPy:
+
+    total        spending in the bucket (0 when there was none)
+    rolling_avg  mean of the last `window` buckets, this one included
+    cumulative   running total since the start of the range
+    change       total minus the previous bucket's total (null for the first)
+    change_pct   change as a percentage of the previous total (null when that was 0)
+
+Weeks start on Monday. The first and last buckets only count days inside the
+range, so they can be partial.
+"""
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+PERIODS = ("day", "week", "month", "year")
+
+
+def period_start(day, period):
+    """First day of the `period` bucket containing `day`"""
+    if period == "week":
+        return date.fromordinal(day.toordinal() - day.weekday())
+    if period == "month":
+        return day.replace(day=1)
+    if period == "year":
+        return day.replace(month=1, day=1)
+    return day
+
+
+def bucket_index(start_date, end_date, period):
+    """datetime64[D] array of the first days of every bucket touching [start_date, end_date]"""
+    if period in ("month", "year"):
+        unit = "M" if period == "month" else "Y"
+        return np.arange(np.datetime64(start_date, unit), np.datetime64(end_date, unit) + 1).astype("datetime64[D]")
+    step = 7 if period == "week" else 1
+    return np.arange(np.datetime64(period_start(start_date, period)), np.datetime64(end_date) + 1, step)
+
+
+def compute(rows, start_date, end_date, period, by_category=False, window=3):
+    """
+    Dict of column lists (bucket, [category,] total, rolling_avg, cumulative, change, change_pct),
+    oldest bucket first, every bucket of the range present. With `by_category` each bucket has one
+    row per category that has spending anywhere in the range, and the statistics are per category.
+    """
+    index = bucket_index(start_date, end_date, period)
+    frame = pd.DataFrame.from_records(rows, columns=["bucket", "category", "total"] if by_category
+                                      else ["bucket", "total"])
+
+    # One column per series (the categories, or just the total), one row per bucket
+    positions = np.searchsorted(index, frame["bucket"].to_numpy(dtype="datetime64[D]"))
+    if by_category:
+        categories, series_of_row = np.unique(frame["category"].to_numpy(dtype=str), return_inverse=True)
+    else:
+        categories, series_of_row = np.array(["total"]), np.zeros(len(frame), dtype=int)
+    wide = np.zeros((len(index), len(categories)))
+    np.add.at(wide, (positions, series_of_row), frame["total"].to_numpy(dtype="float64"))
+
+    cumulative = wide.cumsum(axis=0)
+    # Rolling mean from the running total: (sum up to this bucket - sum before the window) / buckets in it
+    before_window = np.zeros_like(cumulative)
+    before_window[window:] = cumulative[:-window]
+    rolling_avg = (cumulative - before_window) / np.minimum(np.arange(1, len(index) + 1), window)[:, None]
+    previous = np.full_like(wide, np.nan)
+    previous[1:] = wide[:-1]
+    change = wide - previous
+    with np.errstate(divide="ignore", invalid="ignore"):
+        change_pct = np.where(previous != 0, change / previous * 100, np.nan)
+
+    # Back to long form: bucket-major, series-minor, matching ravel()'s row-major order
+    columns = {"bucket": np.repeat(index, len(categories)).astype(object).tolist()}
+    if by_category:
+        columns["category"] = np.tile(categories, len(index)).tolist()
+    for name, values in (("total", wide), ("rolling_avg", rolling_avg), ("cumulative", cumulative),
+                         ("change", change), ("change_pct", change_pct)):
+        columns[name] = np.round(values.ravel(), 2).tolist()
+    return columns
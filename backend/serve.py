@@ -0,0 +1,133 @@
+"""
+Production entry point: gunicorn running WEB_CONCURRENCY uvicorn worker processes.
+
+    cd backend && python serve.py
+
+- The application is imported once in the master (preload) and workers are
+  forked from it, so they start fast and share its memory copy-on-write.
+  Migrations (RUN_MIGRATIONS=1) run there too, once, instead of in every worker.
+- Each worker opens its DB pool and reaches the analytics cache in its
+  lifespan startup (server.warm_up) before it accepts connections.
+- The default analytics cache lives inside each worker, so with several
+  workers a save would only invalidate the worker that served it and the
+  others would return stale analytics for up to ANALYTICS_CACHE_TTL. Unless
+  ANALYTICS_CACHE_URL points every worker at a shared Redis, the cache is
+  turned off when WEB_CONCURRENCY > 1.
+- GET /health/live answers while the process runs; GET /health/ready answers
+  503 while the database or cache is unreachable or the server is draining.
+- On SIGTERM the master marks every worker as draining, waits DRAIN_DELAY
+  seconds so load balancers stop routing to it, then stops accepting
+  connections and gives in-flight requests GRACEFUL_TIMEOUT seconds to finish.
+
+gunicorn needs a POSIX system; on Windows, or for development, run
+`python server.py` (a single process).
+"""
+import os
+import time
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+WORKERS = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+DRAIN_DELAY = float(os.getenv("DRAIN_DELAY", "0"))
+WORKER_TIMEOUT = int(os.getenv("WORKER_TIMEOUT", "60"))  # restart a worker whose event loop is stuck this long
+KEEPALIVE = int(os.getenv("KEEPALIVE", "5"))
+MAX_REQUESTS = int(os.getenv("MAX_REQUESTS", "0"))  # recycle workers after this many requests; 0 = never
+MAX_REQUESTS_JITTER = int(os.getenv("MAX_REQUESTS_JITTER", "0"))
+
+# Workers each open LOG_FILE; rotating it from several processes at once loses records, so leave
+# rotation to logrotate unless LOG_MAX_BYTES is set explicitly. Must happen before importing server.
+if WORKERS > 1:
+    os.environ.setdefault("LOG_MAX_BYTES", "0")
+# Per-worker analytics caches cannot see each other's invalidations (see above); must happen before importing server.
+MEMORY_CACHE_OFF = WORKERS > 1 and not os.getenv("ANALYTICS_CACHE_URL")
+if MEMORY_CACHE_OFF:
+    os.environ.setdefault("ANALYTICS_CACHE_MAX_ENTRIES", "0")
+
+from gunicorn.app.base import BaseApplication
+from gunicorn.arbiter import Arbiter
+from uvicorn_worker import UvicornWorker
+
+import analytics_cache
+import formats
+import migrations
+import server
+import storage
+
+
+class Worker(UvicornWorker):
+    """UvicornWorker that waits for in-flight requests on shutdown, then runs the lifespan shutdown"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # A little under the master's graceful timeout, so the pool closes before it kills the worker
+        self.config.timeout_graceful_shutdown = max(self.cfg.graceful_timeout - 2, 1)
+
+
+class DrainingArbiter(Arbiter):
+    def handle_term(self):
+        """SIGTERM: fail readiness on every worker, give load balancers DRAIN_DELAY, then stop gracefully"""
+        server.draining.value = 1
+        if DRAIN_DELAY > 0:
+            self.log.info("Draining for %ss before stopping workers", DRAIN_DELAY)
+            time.sleep(DRAIN_DELAY)
+        super().handle_term()
+
+
+class Application(BaseApplication):
+    def __init__(self, app, options):
+        self.application = app
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
+    def run(self):
+        try:
+            DrainingArbiter(self).run()
+        except RuntimeError as e:
+            server.logger.error("Server failed: %s", e)
+            raise SystemExit(1)
+
+
+def preload():
+    """One-time work in the master, inherited by every worker"""
+    if os.getenv("RUN_MIGRATIONS", "0") == "1" and storage.DB_BACKEND == "mysql":
+        applied = migrations.upgrade()
+        server.logger.info("Applied migrations: %s", applied or "none, schema is up to date")
+    os.environ["RUN_MIGRATIONS"] = "0"
+    if formats.ARROW_AVAILABLE:
+        import pyarrow  # noqa: F401 - slow first import, done once instead of on a worker's first request
+
+
+def main():
+    preload()
+    server.logger.info("Starting Expense Tracker API on %s:%s with %s workers", HOST, PORT, WORKERS)
+    if MEMORY_CACHE_OFF:
+        if analytics_cache.cache.backend.max_entries > 0:
+            server.logger.warning("ANALYTICS_CACHE_MAX_ENTRIES is set with %s workers and no ANALYTICS_CACHE_URL: "
+                                  "each worker caches on its own and can serve analytics up to %ss stale after a save",
+                                  WORKERS, analytics_cache.cache.ttl)
+        else:
+            server.logger.warning("Analytics cache disabled: %s workers and no ANALYTICS_CACHE_URL. "
+                                  "Set ANALYTICS_CACHE_URL=redis://... to share one cache between workers", WORKERS)
+    Application(server.app, {
+        "bind": f"{HOST}:{PORT}",
+        "workers": WORKERS,
+        "worker_class": Worker,
+        "preload_app": True,
+        "graceful_timeout": GRACEFUL_TIMEOUT,
+        "timeout": WORKER_TIMEOUT,
+        "keepalive": KEEPALIVE,
+        "max_requests": MAX_REQUESTS,
+        "max_requests_jitter": MAX_REQUESTS_JITTER,
+    }).run()
+
+
+if __name__ == "__main__":
+    main()
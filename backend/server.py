@@ -1,9 +1,31 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import List
-from pydantic import BaseModel
+from decimal import Decimal
+from typing import List, Literal, Optional
+from pydantic import BaseModel, ValidationError
+import asyncio
+import math
+import multiprocessing
+import time
 import db_helper
+import rollups
+from storage import async_db
+import storage
+import expense_io
+from analytics_cache import cache as analytics_cache, MISS as analytics_cache_miss
+import migrations
+from logging_setup import setup_logger, request_id_var, NonBlockingQueueHandler
+from metrics import MetricsMiddleware
+import metrics
+import profiling
+import formats
+import series
+import base64
+import uuid
+import os
 
 # Import auth router and token verification
 from auth import router as auth_router, verify_token
@@ -16,7 +38,88 @@ class Expense(BaseModel):
     user_id: int
 
 
-app = FastAPI(title="Expense Tracker API")
+class NewExpense(BaseModel):
+    amount: float
+    category: str
+    notes: str = ""
+
+
+class ExpenseUpdate(NewExpense):
+    id: int
+
+
+class ExpenseChanges(BaseModel):
+    insert: List[NewExpense] = []
+    update: List[ExpenseUpdate] = []
+    delete: List[int] = []
+
+
+class Budget(BaseModel):
+    monthly_limit: float
+
+
+async def warm_up():
+    """Open the DB pool and reach the analytics cache, so the first requests don't pay for it"""
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(async_db.ping(), analytics_cache.ping())
+    except Exception as e:
+        # Start anyway; /health/ready keeps failing until the database or cache comes back
+        logger.warning("Warmup failed: %s", e)
+        return
+    logger.info("Warmed up in %.1fms", (time.perf_counter() - start) * 1000)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # SQLite creates its schema on first connect; migrations are for MySQL
+    if os.getenv("RUN_MIGRATIONS", "0") == "1" and storage.DB_BACKEND == "mysql":
+        applied = migrations.upgrade()
+        logger.info("Applied migrations: %s", applied or "none, schema is up to date")
+    # Runs before the server accepts connections
+    await warm_up()
+    yield
+    await async_db.close_pool()
+
+
+logger = setup_logger('server', sampled=True)
+
+# Page size for GET /expenses/{user_id}
+PAGE_SIZE = int(os.getenv("EXPENSE_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("EXPENSE_MAX_PAGE_SIZE", "500"))
+
+# Limits for GET /analytics_series/{user_id}: buckets per response, and the rolling-average window
+MAX_SERIES_BUCKETS = int(os.getenv("ANALYTICS_MAX_SERIES_BUCKETS", "5000"))
+MAX_SERIES_WINDOW = 366
+
+# Seconds /health/ready waits for the database and cache before reporting the worker unready
+READY_TIMEOUT = float(os.getenv("READY_TIMEOUT", "2"))
+
+# Set when the server is shutting down, so /health/ready fails while in-flight requests finish.
+# Shared memory: serve.py creates it before forking workers (preload) and sets it from the master.
+draining = multiprocessing.RawValue("b", 0)
+
+# Rows per transaction for POST /import/{user_id}, and how many row errors to report back
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+MAX_IMPORT_ERRORS = 1000
+# Largest value of expenses.amount (DECIMAL(10, 2)) and longest expenses.category (VARCHAR(50))
+MAX_AMOUNT = Decimal("99999999.99")
+MAX_CATEGORY_LENGTH = 50
+
+
+def import_row_error(expense):
+    """Why the database would reject an imported expense, or None (so it never fails a whole batch)"""
+    if not math.isfinite(expense.amount) or rollups.to_decimal(expense.amount) <= 0:
+        return "amount: must be a number greater than 0"
+    if rollups.to_decimal(expense.amount) > MAX_AMOUNT:
+        return f"amount: must be at most {MAX_AMOUNT}"
+    if len(expense.category) > MAX_CATEGORY_LENGTH:
+        return f"category: must be at most {MAX_CATEGORY_LENGTH} characters"
+    return None
+
+
+app = FastAPI(title="Expense Tracker API", lifespan=lifespan,
+              default_response_class=formats.FastJSONResponse)
 
 # Add CORS middleware
 app.add_middleware(
@@ -27,46 +130,180 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(MetricsMiddleware)
+
+
+@app.middleware("http")
+async def request_id_middleware(request: Request, call_next):
+    """Tag every log record for this request with X-Request-ID (generated if the client sent none)"""
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    token = request_id_var.set(request_id)
+    try:
+        response = await call_next(request)
+    finally:
+        request_id_var.reset(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+
+# Outermost, so its Server-Timing total covers the other middleware and it sees X-Request-ID
+if profiling.ENABLED:
+    app.add_middleware(profiling.ProfilingMiddleware, logger=logger)
+
+
 # Include authentication routes
 app.include_router(auth_router)
 
 
 @app.get('/')
-def root():
+async def root():
     return {"message": "Expense Tracker API is running", "version": "3.0"}
 
 
+@app.get('/health/live')
+async def liveness():
+    """The process is up and its event loop answers"""
+    return {"status": "alive"}
+
+
+@app.get('/health/ready')
+async def readiness():
+    """Whether this worker should get traffic: not draining, database and analytics cache reachable"""
+    if draining.value:
+        return formats.FastJSONResponse({"status": "draining"}, status_code=503)
+    try:
+        await asyncio.wait_for(asyncio.gather(async_db.ping(), analytics_cache.ping()), READY_TIMEOUT)
+    except Exception as e:
+        logger.warning("Readiness check failed: %s", e)
+        return formats.FastJSONResponse({"status": "unavailable", "detail": str(e) or type(e).__name__},
+                                        status_code=503)
+    return {"status": "ready"}
+
+
+@app.get('/db_pool_stats')
+async def db_pool_stats():
+    return async_db.get_pool_stats()
+
+
+def _pool_gauges():
+    stats = async_db.get_pool_stats()
+    return {(key,): stats[key] for key in ("max_size", "size", "in_use", "idle", "checkouts", "timeouts")}
+
+
+metrics.registry.gauge_callback("db_pool_connections", "Async DB pool state and checkout totals",
+                                _pool_gauges, ("stat",))
+metrics.registry.gauge_callback("log_records_dropped", "Log records dropped because the queue was full",
+                                lambda: {(): NonBlockingQueueHandler.dropped})
+
+
+@app.get('/metrics')
+async def get_metrics():
+    """Prometheus text exposition of request, database and pool metrics"""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get('/analytics_cache_stats')
+async def analytics_cache_stats():
+    return await analytics_cache.stats()
+
+
 # PROTECTED EXPENSE ENDPOINTS
 
 @app.get('/expenses/{user_id}/{expense_date}')
-def get_expenses(user_id: int, expense_date: str, token_user_id: int = Depends(verify_token)):
+async def get_expenses(user_id: int, expense_date: str, request: Request, token_user_id: int = Depends(verify_token)):
     if token_user_id != user_id:
         raise HTTPException(status_code=403, detail="Not authorized to access this user's data")
 
     try:
         date_obj = datetime.strptime(expense_date, "%Y-%m-%d").date()
-        print(f"Fetching expenses for user_id={user_id}, date={date_obj}")
-        expenses = db_helper.fetch_expenses_for_date(date_obj, user_id)
+        logger.info("Fetching expenses for user_id=%s, date=%s", user_id, date_obj)
+        expenses = await async_db.fetch_expenses_for_date(date_obj, user_id)
 
         if expenses is None or len(expenses) == 0:
-            print("No expenses found, returning empty list")
-            return []
+            logger.info("No expenses found, returning empty list")
+            return formats.rows_response(request, [])
 
-        print(f"Found {len(expenses)} expenses")
-        return expenses
+        logger.info("Found %s expenses", len(expenses))
+        return formats.rows_response(request, expenses)
 
     except ValueError as ve:
-        print(f"Invalid date format: {expense_date}")
+        logger.warning("Invalid date format: %s", expense_date)
         raise HTTPException(status_code=400, detail=f"Invalid date format. Use YYYY-MM-DD")
     except Exception as e:
-        print(f"Error fetching expenses: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error fetching expenses: %s", e)
         raise HTTPException(status_code=500, detail=f"Error fetching expenses: {str(e)}")
 
 
+def _encode_cursor(row):
+    raw = f"{row['expense_date'].isoformat()}:{row['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        day, expense_id = raw.split(":")
+        return datetime.strptime(day, "%Y-%m-%d").date(), int(expense_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+
+
+@app.get('/expenses/{user_id}')
+async def list_expenses(user_id: int, start_date: str, end_date: str, request: Request, category: Optional[str] = None,
+                        min_amount: Optional[float] = None, max_amount: Optional[float] = None,
+                        cursor: Optional[str] = None, page_size: int = PAGE_SIZE,
+                        token_user_id: int = Depends(verify_token)):
+    """
+    List expenses in an inclusive date range, oldest first, one page at a time.
+    Pass the returned next_cursor back as `cursor` to get the following page.
+    """
+    if token_user_id != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized to access this user's data")
+    if not 1 <= page_size <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"page_size must be between 1 and {MAX_PAGE_SIZE}")
+
+    after = _decode_cursor(cursor) if cursor else None
+
+    try:
+        start_date_obj = datetime.strptime(start_date, "%Y-%m-%d").date()
+        end_date_obj = datetime.strptime(end_date, "%Y-%m-%d").date()
+
+        logger.info("Listing expenses for user_id=%s, from %s to %s, after=%s",
+                    user_id, start_date_obj, end_date_obj, after)
+
+        # One extra row tells us whether another page exists
+        rows = await async_db.fetch_expenses_in_range(
+            user_id, start_date_obj, end_date_obj, category=category, min_amount=min_amount,
+            max_amount=max_amount, after=after, limit=page_size + 1
+        )
+        items = rows[:page_size]
+        next_cursor = _encode_cursor(items[-1]) if len(rows) > page_size else None
+        return formats.rows_response(request, items, next_cursor=next_cursor)
+
+    except ValueError as ve:
+        logger.warning("Invalid date format: %s or %s", start_date, end_date)
+        raise HTTPException(status_code=400, detail=f"Invalid date format. Use YYYY-MM-DD")
+    except Exception as e:
+        logger.exception("Error listing expenses: %s", e)
+        raise HTTPException(status_code=500, detail=f"Error listing expenses: {str(e)}")
+
+
+async def budget_check(user_id, day, categories):
+    """
+    Status of the budgets for `categories` in the month of `day`, for a save's response: one
+    primary-key lookup per category in the running monthly totals the save just updated.
+    None if the lookup fails; the save itself has already been committed.
+    """
+    try:
+        categories = sorted({category.capitalize() for category in categories})
+        return await async_db.fetch_budget_status(user_id, rollups.month_start(day), categories)
+    except Exception as e:
+        logger.warning("Budget check failed for user_id=%s, date=%s: %s", user_id, day, e)
+        return None
+
+
 @app.post('/expenses/{expense_date}')
-def add_or_update_expense(expense_date: str, expenses: List[Expense], token_user_id: int = Depends(verify_token)):
+async def add_or_update_expense(expense_date: str, expenses: List[Expense], token_user_id: int = Depends(verify_token)):
     try:
         date_obj = datetime.strptime(expense_date, "%Y-%m-%d").date()
 
@@ -78,37 +315,194 @@ def add_or_update_expense(expense_date: str, expenses: List[Expense], token_user
         if token_user_id != user_id:
             raise HTTPException(status_code=403, detail="Not authorized to modify this user's data")
 
-        print(f"Deleting expenses for user_id={user_id}, date={date_obj}")
-        db_helper.delete_expenses_for_date(date_obj, user_id)
-
         for expense in expenses:
             if expense.user_id != token_user_id:
                 raise HTTPException(status_code=403, detail="Not authorized to create expenses for other users")
 
-            print(f"Inserting: {expense.amount} - {expense.category}")
-            db_helper.insert_expense(
-                date_obj,
-                expense.amount,
-                expense.category,
-                expense.notes,
-                expense.user_id
-            )
+        logger.info("Replacing expenses for user_id=%s, date=%s with %s rows", user_id, date_obj, len(expenses))
+        replaced = await async_db.replace_expenses_for_date(
+            date_obj,
+            [(expense.amount, expense.category, expense.notes) for expense in expenses],
+            user_id
+        )
+        await analytics_cache.invalidate(user_id, date_obj)
+
+        logger.info("Successfully inserted %s expenses", len(expenses))
+        # The budgets of the new categories, and of the ones the replaced rows moved out of
+        categories = [expense.category for expense in expenses] + replaced["categories"]
+        return {
+            "message": "Expenses updated successfully",
+            "count": len(expenses),
+            "budgets": await budget_check(user_id, date_obj, categories)
+        }
+
+    except HTTPException:
+        raise
+    except ValueError as ve:
+        logger.warning("Invalid date format: %s", expense_date)
+        raise HTTPException(status_code=400, detail=f"Invalid date format. Use YYYY-MM-DD")
+    except Exception as e:
+        logger.exception("Error updating expenses: %s", e)
+        raise HTTPException(status_code=500, detail=f"Error updating expenses: {str(e)}")
 
-        print(f"Successfully inserted {len(expenses)} expenses")
-        return {"message": "Expenses updated successfully", "count": len(expenses)}
 
-    except ValueError as ve:
-        print(f"Invalid date format: {expense_date}")
+@app.patch('/expenses/{user_id}/{expense_date}')
+async def update_expenses(user_id: int, expense_date: str, changes: ExpenseChanges,
+                          token_user_id: int = Depends(verify_token)):
+    """
+    Apply row-level changes to one day's expenses in a single transaction: insert new rows,
+    update rows by id and delete ids. Untouched rows are left alone. Ids come from
+    GET /expenses/{user_id}/{expense_date}; an id that is not on that day gives a 409.
+    """
+    if token_user_id != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized to modify this user's data")
+
+    ids = [expense.id for expense in changes.update] + changes.delete
+    if len(set(ids)) != len(ids):
+        raise HTTPException(status_code=400, detail="Each expense id may be updated or deleted only once")
+
+    try:
+        date_obj = datetime.strptime(expense_date, "%Y-%m-%d").date()
+    except ValueError:
+        logger.warning("Invalid date format: %s", expense_date)
         raise HTTPException(status_code=400, detail=f"Invalid date format. Use YYYY-MM-DD")
+
+    try:
+        logger.info("Updating expenses for user_id=%s, date=%s: %s inserts, %s updates, %s deletes",
+                    user_id, date_obj, len(changes.insert), len(changes.update), len(changes.delete))
+        counts = await async_db.update_expenses_for_date(
+            date_obj,
+            [(expense.amount, expense.category, expense.notes) for expense in changes.insert],
+            [(expense.id, expense.amount, expense.category, expense.notes) for expense in changes.update],
+            changes.delete,
+            user_id
+        )
+        if ids or changes.insert:
+            await analytics_cache.invalidate(user_id, date_obj)
+        # The budgets of the new categories, and of the ones updated or deleted rows moved out of
+        categories = [expense.category for expense in changes.insert + changes.update] + counts.pop("categories")
+        return {"message": "Expenses updated successfully", **counts,
+                "budgets": await budget_check(user_id, date_obj, categories)}
+
+    except LookupError as e:
+        logger.warning("Stale expense update for user_id=%s, date=%s: %s", user_id, date_obj, e)
+        raise HTTPException(status_code=409, detail=f"{e}; reload the day and try again")
     except Exception as e:
-        print(f"Error updating expenses: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error updating expenses: %s", e)
         raise HTTPException(status_code=500, detail=f"Error updating expenses: {str(e)}")
 
 
+@app.get('/export/{user_id}')
+async def export_expenses(user_id: int, format: Literal["csv", "ndjson"] = "csv", gzip: bool = False,
+                          start_date: Optional[str] = None, end_date: Optional[str] = None,
+                          token_user_id: int = Depends(verify_token)):
+    """Stream the user's expense history as CSV or NDJSON, optionally gzip-compressed"""
+    if token_user_id != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized to access this user's data")
+
+    try:
+        start_date_obj = datetime.strptime(start_date, "%Y-%m-%d").date() if start_date else None
+        end_date_obj = datetime.strptime(end_date, "%Y-%m-%d").date() if end_date else None
+    except ValueError:
+        logger.warning("Invalid date format: %s or %s", start_date, end_date)
+        raise HTTPException(status_code=400, detail=f"Invalid date format. Use YYYY-MM-DD")
+
+    logger.info("Exporting expenses for user_id=%s as %s (gzip=%s)", user_id, format, gzip)
+
+    batches = async_db.stream_expenses(user_id, start_date_obj, end_date_obj)
+    filename = f"expenses_{user_id}.{format}" + (".gz" if gzip else "")
+    return StreamingResponse(
+        expense_io.encode(batches, format, compress=gzip),
+        media_type="application/gzip" if gzip else expense_io.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+@app.post('/import/{user_id}')
+async def import_expenses(user_id: int, request: Request, format: Literal["csv", "ndjson"] = "csv",
+                          token_user_id: int = Depends(verify_token)):
+    """
+    Bulk-import expenses from a CSV (expense_date,amount,category[,notes]) or NDJSON request body.
+    The body is parsed as it arrives and valid rows are written in IMPORT_BATCH_SIZE-row transactions;
+    invalid rows are skipped and reported by line number.
+    """
+    if token_user_id != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized to modify this user's data")
+
+    logger.info("Importing %s expenses for user_id=%s", format, user_id)
+
+    imported, failed = 0, 0
+    errors = []
+    batch, batch_lines = [], []
+    first_day, last_day = None, None
+
+    def report(line, error):
+        nonlocal failed
+        failed += 1
+        if len(errors) < MAX_IMPORT_ERRORS:
+            errors.append({"line": line, "error": error})
+
+    async def flush():
+        nonlocal imported, batch, batch_lines
+        try:
+            imported += await async_db.insert_expenses_batch(batch, user_id)
+        except Exception as e:
+            logger.error("Error importing batch: %s", e)
+            for line in batch_lines:
+                report(line, f"Database error: {str(e)}")
+        batch, batch_lines = [], []
+
+    try:
+        async for line, record, error in expense_io.parse(request.stream(), format):
+            if error:
+                report(line, error)
+                continue
+            try:
+                expense_date = datetime.strptime(str(record.get("expense_date", "")).strip(), "%Y-%m-%d").date()
+                expense = Expense.model_validate({
+                    "amount": record.get("amount"),
+                    "category": record.get("category"),
+                    "notes": record.get("notes") or "",
+                    "user_id": user_id
+                })
+            except ValidationError as e:
+                report(line, "; ".join(f"{err['loc'][0]}: {err['msg']}" for err in e.errors()))
+                continue
+            except ValueError:
+                report(line, "Invalid expense_date. Use YYYY-MM-DD")
+                continue
+            error = import_row_error(expense)
+            if error:
+                report(line, error)
+                continue
+
+            batch.append((expense_date, expense.amount, expense.category, expense.notes))
+            batch_lines.append(line)
+            first_day = expense_date if first_day is None else min(first_day, expense_date)
+            last_day = expense_date if last_day is None else max(last_day, expense_date)
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                await flush()
+        if batch:
+            await flush()
+    except ValueError as e:
+        # Unreadable body (bad encoding, runaway line); rows already committed stay imported
+        report(None, str(e))
+
+    if first_day is not None:
+        await analytics_cache.invalidate(user_id, first_day, last_day)
+
+    logger.info("Imported %s expenses, %s rows failed", imported, failed)
+    return {
+        "imported": imported,
+        "failed": failed,
+        "errors": errors,
+        "errors_truncated": failed > len(errors)
+    }
+
+
 @app.get('/analytics_by_category/{user_id}')
-def get_analytics_by_category(user_id: int, start_date: str, end_date: str, token_user_id: int = Depends(verify_token)):
+async def get_analytics_by_category(user_id: int, start_date: str, end_date: str, request: Request,
+                                    token_user_id: int = Depends(verify_token)):
     if token_user_id != user_id:
         raise HTTPException(status_code=403, detail="Not authorized to access this user's data")
 
@@ -116,53 +510,240 @@ def get_analytics_by_category(user_id: int, start_date: str, end_date: str, toke
         start_date_obj = datetime.strptime(start_date, "%Y-%m-%d").date()
         end_date_obj = datetime.strptime(end_date, "%Y-%m-%d").date()
 
-        print(f"Fetching analytics for user_id={user_id}, from {start_date_obj} to {end_date_obj}")
+        logger.info("Fetching analytics for user_id=%s, from %s to %s", user_id, start_date_obj, end_date_obj)
 
-        summary = db_helper.fetch_expense_summary_by_catrgory(start_date_obj, end_date_obj, user_id)
+        cache_params = (start_date_obj.isoformat(), end_date_obj.isoformat())
+        summary = await analytics_cache.get(user_id, "analytics_by_category", cache_params)
+        if summary is analytics_cache_miss:
+            generation = await analytics_cache.generation(user_id)
+            summary = await async_db.fetch_expense_summary_by_catrgory(start_date_obj, end_date_obj, user_id)
+            await analytics_cache.set(user_id, "analytics_by_category", cache_params, summary, generation,
+                                      start_date_obj, end_date_obj)
 
         if summary is None or len(summary) == 0:
-            print("No analytics data found, returning empty list")
-            return []
+            logger.info("No analytics data found, returning empty list")
+            return formats.rows_response(request, [])
 
-        print(f"Found analytics for {len(summary)} categories")
-        return summary
+        logger.info("Found analytics for %s categories", len(summary))
+        return formats.rows_response(request, summary)
 
     except ValueError as ve:
-        print(f"Invalid date format: {start_date} or {end_date}")
+        logger.warning("Invalid date format: %s or %s", start_date, end_date)
         raise HTTPException(status_code=400, detail=f"Invalid date format. Use YYYY-MM-DD")
     except Exception as e:
-        print(f"Error fetching analytics: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error fetching analytics: %s", e)
         raise HTTPException(status_code=500, detail=f"Error fetching analytics: {str(e)}")
 
 
 @app.get('/analytics_by_months/{user_id}')
-def get_analytics_by_months(user_id: int, token_user_id: int = Depends(verify_token)):
+async def get_analytics_by_months(user_id: int, request: Request, year: Optional[int] = None,
+                                  start_date: Optional[str] = None, end_date: Optional[str] = None,
+                                  token_user_id: int = Depends(verify_token)):
     if token_user_id != user_id:
         raise HTTPException(status_code=403, detail="Not authorized to access this user's data")
 
     try:
-        print(f"Fetching monthly summary for user_id={user_id}")
-
-        summary = db_helper.fetch_expense_summary_by_month(user_id)
+        start_date_obj = datetime.strptime(start_date, "%Y-%m-%d").date() if start_date else None
+        end_date_obj = datetime.strptime(end_date, "%Y-%m-%d").date() if end_date else None
+
+        logger.info("Fetching monthly summary for user_id=%s, year=%s, from %s to %s",
+                    user_id, year, start_date_obj, end_date_obj)
+
+        cache_params = (year, start_date, end_date)
+        summary = await analytics_cache.get(user_id, "analytics_by_months", cache_params)
+        if summary is analytics_cache_miss:
+            generation = await analytics_cache.generation(user_id)
+            summary = await async_db.fetch_expense_summary_by_month(
+                user_id, year=year, start_date=start_date_obj, end_date=end_date_obj
+            )
+            await analytics_cache.set(user_id, "analytics_by_months", cache_params, summary, generation,
+                                      *db_helper.monthly_summary_bounds(year, start_date_obj, end_date_obj))
 
         if summary is None or len(summary) == 0:
-            print("No monthly summary found, returning empty list")
-            return []
+            logger.info("No monthly summary found, returning empty list")
+            return formats.rows_response(request, [])
 
-        print(f"Found summary for {len(summary)} months")
-        return summary
+        logger.info("Found summary for %s months", len(summary))
+        return formats.rows_response(request, summary)
 
+    except ValueError as ve:
+        logger.warning("Invalid date format: %s or %s", start_date, end_date)
+        raise HTTPException(status_code=400, detail=f"Invalid date format. Use YYYY-MM-DD")
     except Exception as e:
-        print(f"Error fetching monthly summary: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error fetching monthly summary: %s", e)
         raise HTTPException(status_code=500, detail=f"Error fetching monthly summary: {str(e)}")
 
 
+@app.get('/analytics_series/{user_id}')
+async def get_analytics_series(user_id: int, start_date: str, end_date: str, request: Request,
+                               period: Literal["day", "week", "month", "year"] = "month",
+                               by_category: bool = False, window: int = 3,
+                               token_user_id: int = Depends(verify_token)):
+    """
+    Spending per day / week / month / year in [start_date, end_date], optionally per category,
+    with rolling average over `window` buckets, cumulative total and period-over-period change
+    (see series.py). The bucketed totals are cached; the statistics are recomputed per request.
+    """
+    if token_user_id != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized to access this user's data")
+    if not 1 <= window <= MAX_SERIES_WINDOW:
+        raise HTTPException(status_code=400, detail=f"window must be between 1 and {MAX_SERIES_WINDOW}")
+
+    try:
+        start_date_obj = datetime.strptime(start_date, "%Y-%m-%d").date()
+        end_date_obj = datetime.strptime(end_date, "%Y-%m-%d").date()
+    except ValueError:
+        logger.warning("Invalid date format: %s or %s", start_date, end_date)
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+    if start_date_obj > end_date_obj:
+        raise HTTPException(status_code=400, detail="start_date must not be after end_date")
+    buckets = len(series.bucket_index(start_date_obj, end_date_obj, period))
+    if buckets > MAX_SERIES_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"Range has {buckets} {period} buckets; "
+                                                    f"the limit is {MAX_SERIES_BUCKETS}, use a longer period")
+
+    try:
+        logger.info("Fetching %s series for user_id=%s, from %s to %s, by_category=%s",
+                    period, user_id, start_date_obj, end_date_obj, by_category)
+
+        cache_params = (start_date_obj.isoformat(), end_date_obj.isoformat(), period, by_category)
+        rows = await analytics_cache.get(user_id, "analytics_series", cache_params)
+        if rows is analytics_cache_miss:
+            generation = await analytics_cache.generation(user_id)
+            rows = await async_db.fetch_expense_series(user_id, start_date_obj, end_date_obj, period, by_category)
+            await analytics_cache.set(user_id, "analytics_series", cache_params, rows, generation,
+                                      start_date_obj, end_date_obj)
+
+        if not rows:
+            logger.info("No spending in range, returning empty series")
+            return formats.rows_response(request, [])
+
+        with profiling.phase("aggregate"):
+            columns = series.compute(rows, start_date_obj, end_date_obj, period, by_category, window)
+        logger.info("Computed %s series rows from %s bucket totals", len(columns["bucket"]), len(rows))
+        return formats.columns_response(request, columns)
+
+    except Exception as e:
+        logger.exception("Error fetching spending series: %s", e)
+        raise HTTPException(status_code=500, detail=f"Error fetching spending series: {str(e)}")
+
+
+@app.get('/budgets/{user_id}')
+async def get_budgets(user_id: int, request: Request, month: Optional[str] = None,
+                      token_user_id: int = Depends(verify_token)):
+    """Every budget of the user with the spending of `month` (YYYY-MM, default this month) against it"""
+    if token_user_id != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized to access this user's data")
+
+    try:
+        month_obj = datetime.strptime(month, "%Y-%m").date() if month else rollups.month_start(datetime.now().date())
+    except ValueError:
+        logger.warning("Invalid month format: %s", month)
+        raise HTTPException(status_code=400, detail="Invalid month format. Use YYYY-MM")
+
+    try:
+        logger.info("Fetching budgets for user_id=%s, month=%s", user_id, month_obj)
+        return formats.rows_response(request, await async_db.fetch_budget_status(user_id, month_obj))
+    except Exception as e:
+        logger.exception("Error fetching budgets: %s", e)
+        raise HTTPException(status_code=500, detail=f"Error fetching budgets: {str(e)}")
+
+
+@app.put('/budgets/{user_id}/{category}')
+async def set_budget(user_id: int, category: str, budget: Budget, token_user_id: int = Depends(verify_token)):
+    if token_user_id != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized to modify this user's data")
+    if budget.monthly_limit <= 0:
+        raise HTTPException(status_code=400, detail="monthly_limit must be greater than 0")
+    category = category.capitalize()
+
+    try:
+        logger.info("Setting %s budget for user_id=%s to %s", category, user_id, budget.monthly_limit)
+        await async_db.set_budget(user_id, category, budget.monthly_limit)
+        return {"message": "Budget saved", "category": category, "monthly_limit": budget.monthly_limit}
+    except Exception as e:
+        logger.exception("Error saving budget: %s", e)
+        raise HTTPException(status_code=500, detail=f"Error saving budget: {str(e)}")
+
+
+@app.delete('/budgets/{user_id}/{category}')
+async def delete_budget(user_id: int, category: str, token_user_id: int = Depends(verify_token)):
+    if token_user_id != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized to modify this user's data")
+    category = category.capitalize()
+
+    try:
+        deleted = await async_db.delete_budget(user_id, category)
+    except Exception as e:
+        logger.exception("Error deleting budget: %s", e)
+        raise HTTPException(status_code=500, detail=f"Error deleting budget: {str(e)}")
+    if not deleted:
+        raise HTTPException(status_code=404, detail=f"No budget set for {category}")
+    logger.info("Deleted %s budget for user_id=%s", category, user_id)
+    return {"message": "Budget deleted", "category": category}
+
+
+@app.get('/dashboard/{user_id}')
+async def get_dashboard(user_id: int, expense_date: str, start_date: str, end_date: str, request: Request,
+                        token_user_id: int = Depends(verify_token)):
+    """
+    Everything a logged-in page shows, in one call: the expenses for expense_date, the category
+    summary for [start_date, end_date] and the monthly summary. The token is checked once, the
+    cached summaries are looked up concurrently, and whatever is left is read over one connection.
+    """
+    if token_user_id != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized to access this user's data")
+
+    try:
+        date_obj = datetime.strptime(expense_date, "%Y-%m-%d").date()
+        start_date_obj = datetime.strptime(start_date, "%Y-%m-%d").date()
+        end_date_obj = datetime.strptime(end_date, "%Y-%m-%d").date()
+
+        logger.info("Fetching dashboard for user_id=%s, date=%s, from %s to %s",
+                    user_id, date_obj, start_date_obj, end_date_obj)
+
+        # Same keys as the single endpoints, so both share cached results
+        category_params = (start_date_obj.isoformat(), end_date_obj.isoformat())
+        months_params = (None, None, None)
+        by_category, by_months = await asyncio.gather(
+            analytics_cache.get(user_id, "analytics_by_category", category_params),
+            analytics_cache.get(user_id, "analytics_by_months", months_params)
+        )
+
+        need_category = by_category is analytics_cache_miss
+        need_months = by_months is analytics_cache_miss
+        generation = await analytics_cache.generation(user_id) if need_category or need_months else None
+        result = await async_db.fetch_dashboard(
+            user_id, date_obj,
+            start_date_obj if need_category else None, end_date_obj if need_category else None,
+            monthly=need_months
+        )
+        if need_category:
+            by_category = result["by_category"]
+            await analytics_cache.set(user_id, "analytics_by_category", category_params, by_category, generation,
+                                      start_date_obj, end_date_obj)
+        if need_months:
+            by_months = result["by_month"]
+            await analytics_cache.set(user_id, "analytics_by_months", months_params, by_months, generation)
+
+        return formats.sections_response(request, {
+            "expense_date": date_obj,
+            "expenses": result["expenses"],
+            "analytics_by_category": by_category,
+            "analytics_by_months": by_months
+        }, ("expenses", "analytics_by_category", "analytics_by_months"))
+
+    except ValueError as ve:
+        logger.warning("Invalid date format: %s, %s or %s", expense_date, start_date, end_date)
+        raise HTTPException(status_code=400, detail=f"Invalid date format. Use YYYY-MM-DD")
+    except Exception as e:
+        logger.exception("Error fetching dashboard: %s", e)
+        raise HTTPException(status_code=500, detail=f"Error fetching dashboard: {str(e)}")
+
+
 if __name__ == "__main__":
     import uvicorn
 
-    print("Starting Expense Tracker API on port 8000...")
+    # Single development process; production runs serve.py
+    logger.info("Starting Expense Tracker API on port 8000...")
     uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file
@@ -0,0 +1,815 @@
+"""
+Embedded SQLite storage backend (DB_BACKEND=sqlite).
+
+Implements the same functions as db_helper against a single database file
+(SQLITE_PATH), so development, CI and small single-node deployments need no
+MySQL server or driver. The schema mirrors the MySQL one, including the
+rollup tables and the covering / keyset indexes, and is created on first
+connect.
+
+- WAL journal: readers never block the writer or each other; writes take the
+  write lock up front (BEGIN IMMEDIATE) and wait up to SQLITE_BUSY_TIMEOUT_MS.
+- One connection per thread, each with a prepared-statement cache; every query
+  is a fixed parameterised string (or one of a few builder variants), so
+  repeat calls skip parsing and planning.
+- Amounts are stored as integer cents and returned as Decimal, dates as ISO
+  text returned as date, matching what mysql.connector hands back.
+- SQLITE_REPLICAS (comma-separated paths, opened read-only) stand in for MySQL
+  read replicas, with the same routing (see replicas.py). Keep them in step
+  with SQLITE_PATH by copying it, e.g. `sqlite3 main.db ".backup replica.db"`.
+
+    python sqlite_db.py check-plans    # EXPLAIN QUERY PLAN each query, fail on full table scans
+    python sqlite_db.py reconcile      # recompute the rollup tables from `expenses`
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date
+from decimal import Decimal
+
+import budgets
+import db_helper
+import replicas
+import profiling
+import rollups
+from logging_setup import setup_logger
+from metrics import instrument_db, DB_ACQUIRE
+
+logger = setup_logger('sqlite_db', sampled=True)
+
+SQLITE_PATH = os.getenv("SQLITE_PATH", "expense_manager.db")
+BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+REPLICA_PATHS = [path.strip() for path in os.getenv("SQLITE_REPLICAS", "").split(",") if path.strip()]
+STATEMENT_CACHE_SIZE = int(os.getenv("SQLITE_STATEMENT_CACHE_SIZE", "256"))
+INSERT_BATCH_SIZE = db_helper.INSERT_BATCH_SIZE
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY,
+        actual_name TEXT NOT NULL,
+        username TEXT NOT NULL,
+        password_hash TEXT NOT NULL
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS uq_users_username ON users (username);
+
+    CREATE TABLE IF NOT EXISTS expenses (
+        id INTEGER PRIMARY KEY,
+        expense_date TEXT NOT NULL,
+        amount_cents INTEGER NOT NULL,
+        category TEXT NOT NULL,
+        notes TEXT,
+        user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE
+    );
+    CREATE INDEX IF NOT EXISTS idx_expenses_user_date_category_amount
+        ON expenses (user_id, expense_date, category, amount_cents);
+    CREATE INDEX IF NOT EXISTS idx_expenses_user_date_id ON expenses (user_id, expense_date, id);
+
+    CREATE TABLE IF NOT EXISTS expense_daily_rollup (
+        user_id INTEGER NOT NULL,
+        expense_date TEXT NOT NULL,
+        category TEXT NOT NULL,
+        total_cents INTEGER NOT NULL,
+        expense_count INTEGER NOT NULL,
+        PRIMARY KEY (user_id, expense_date, category)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS expense_monthly_rollup (
+        user_id INTEGER NOT NULL,
+        expense_month TEXT NOT NULL,
+        category TEXT NOT NULL,
+        total_cents INTEGER NOT NULL,
+        expense_count INTEGER NOT NULL,
+        PRIMARY KEY (user_id, expense_month, category)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS expense_budgets (
+        user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+        category TEXT NOT NULL,
+        monthly_limit_cents INTEGER NOT NULL,
+        PRIMARY KEY (user_id, category)
+    ) WITHOUT ROWID;
+"""
+
+INSERT_USER = "INSERT INTO users (actual_name, username, password_hash) VALUES (?, ?, ?)"
+SELECT_USER_BY_USERNAME = "SELECT * FROM users WHERE username = ?"
+UPDATE_PASSWORD_HASH = "UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?"
+SELECT_EXPENSES_FOR_DATE = """
+    SELECT id, amount_cents, category, notes, user_id FROM expenses WHERE expense_date = ? AND user_id = ? ORDER BY id
+"""
+DELETE_EXPENSES_FOR_DATE = "DELETE FROM expenses WHERE expense_date = ? AND user_id = ?"
+INSERT_EXPENSE = "INSERT INTO expenses (expense_date, amount_cents, category, notes, user_id) VALUES (?, ?, ?, ?, ?)"
+UPDATE_EXPENSE = """
+    UPDATE expenses SET amount_cents = ?, category = ?, notes = ? WHERE id = ? AND expense_date = ? AND user_id = ?
+"""
+DAY_CATEGORY_TOTALS = """
+    SELECT category, SUM(amount_cents) AS total_cents, COUNT(*) AS expense_count
+    FROM expenses
+    WHERE expense_date = ? AND user_id = ?
+    GROUP BY category
+"""
+UPSERT_DAILY = """
+    INSERT INTO expense_daily_rollup (user_id, expense_date, category, total_cents, expense_count)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (user_id, expense_date, category) DO UPDATE
+    SET total_cents = total_cents + excluded.total_cents, expense_count = expense_count + excluded.expense_count
+"""
+UPSERT_MONTHLY = """
+    INSERT INTO expense_monthly_rollup (user_id, expense_month, category, total_cents, expense_count)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (user_id, expense_month, category) DO UPDATE
+    SET total_cents = total_cents + excluded.total_cents, expense_count = expense_count + excluded.expense_count
+"""
+PRUNE_DAILY = "DELETE FROM expense_daily_rollup WHERE user_id = ? AND expense_date = ? AND expense_count <= 0"
+PRUNE_MONTHLY = "DELETE FROM expense_monthly_rollup WHERE user_id = ? AND expense_month = ? AND expense_count <= 0"
+UPSERT_BUDGET = """
+    INSERT INTO expense_budgets (user_id, category, monthly_limit_cents) VALUES (?, ?, ?)
+    ON CONFLICT (user_id, category) DO UPDATE SET monthly_limit_cents = excluded.monthly_limit_cents
+"""
+DELETE_BUDGET = "DELETE FROM expense_budgets WHERE user_id = ? AND category = ?"
+
+# First day of the month containing an ISO date column
+MONTH_OF_DAY = "substr(expense_date, 1, 8) || '01'"
+# Monday of the week containing an ISO date column, and January 1st of the year containing expense_month
+WEEK_OF_DAY = "date(expense_date, '-' || ((CAST(strftime('%w', expense_date) AS INTEGER) + 6) % 7) || ' days')"
+YEAR_OF_MONTH = "substr(expense_month, 1, 4) || '-01-01'"
+
+
+# Value conversion
+
+def _day(value):
+    return value.isoformat() if isinstance(value, date) else str(value)
+
+
+def _cents(amount):
+    return int(rollups.to_decimal(amount) * 100)
+
+
+def _amount(cents):
+    return Decimal(cents).scaleb(-2)
+
+
+def _dict_row(cursor, row):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+def _expense(row):
+    """Turn a stored expenses row into the shape db_helper returns"""
+    expense = {}
+    for key, value in row.items():
+        if key == 'amount_cents':
+            expense['amount'] = _amount(value)
+        elif key == 'expense_date':
+            expense[key] = date.fromisoformat(value)
+        else:
+            expense[key] = value
+    return expense
+
+
+# Connections
+
+_local = threading.local()
+_generation = 0  # bumped by close_all() so every thread reconnects
+_connections = []
+_replica_connections = []
+_connections_lock = threading.Lock()
+_stats = {"checkouts": 0, "in_use": 0}
+_stats_lock = threading.Lock()
+replica_set = replicas.ReplicaSet(REPLICA_PATHS)
+
+
+def _connect():
+    connection = sqlite3.connect(
+        SQLITE_PATH,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        isolation_level=None,  # transactions are opened explicitly in get_db_cursor(commit=True)
+        check_same_thread=False,  # only ever used by the thread that opened it, but closed by close_all()
+        cached_statements=STATEMENT_CACHE_SIZE
+    )
+    connection.row_factory = _dict_row
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute("PRAGMA synchronous = NORMAL")  # durable at checkpoints; WAL keeps the file consistent
+    connection.execute("PRAGMA foreign_keys = ON")
+    connection.execute("PRAGMA temp_store = MEMORY")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def _connection():
+    if getattr(_local, "generation", None) != _generation:
+        _local.connection = _connect()
+        _local.generation = _generation
+        with _connections_lock:
+            _connections.append(_local.connection)
+    return _local.connection
+
+
+def _replica_connection(path):
+    """This thread's read-only connection to the replica at `path`"""
+    if getattr(_local, "replica_generation", None) != _generation:
+        _local.replicas = {}
+        _local.replica_generation = _generation
+    if path not in _local.replicas:
+        connection = sqlite3.connect(
+            f"file:{path}?mode=ro", uri=True,
+            timeout=BUSY_TIMEOUT_MS / 1000,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE
+        )
+        connection.row_factory = _dict_row
+        connection.execute("SELECT 1 FROM expenses LIMIT 1")  # fail here, not mid-read, if it is not a copy
+        _local.replicas[path] = connection
+        with _connections_lock:
+            _replica_connections.append(connection)
+    return _local.replicas[path]
+
+
+def _checkout(replica):
+    """(connection, replica it belongs to or None): `replica`'s, or the primary's if it is None or unreadable"""
+    if replica is not None:
+        try:
+            return _replica_connection(replica), replica
+        except sqlite3.Error as e:
+            replica_set.mark_down(replica, e)
+    return _connection(), None
+
+
+def close_all():
+    """Close every thread's connection (threads reconnect on their next call)"""
+    global _generation
+    with _connections_lock:
+        connections = _connections + _replica_connections
+        _connections.clear()
+        _replica_connections.clear()
+        _generation += 1
+    for connection in connections:
+        connection.close()
+
+
+def get_pool_stats():
+    """Same keys as the MySQL pools: one connection per thread that has used the database"""
+    with _connections_lock:
+        size = len(_connections)
+    return {
+        "backend": "sqlite",
+        "path": SQLITE_PATH,
+        "max_size": size,
+        "size": size,
+        "in_use": _stats["in_use"],
+        "idle": size - _stats["in_use"],
+        "checkouts": _stats["checkouts"],
+        "timeouts": 0,
+        **(replica_set.stats() if replica_set.replicas else {}),
+    }
+
+
+# Database connection context manager
+@contextmanager
+def get_db_cursor(commit=False, replica=False, user_key=None):
+    """db_helper.get_db_cursor: commit=True on the primary, replica=True may read from a replica"""
+    start = time.perf_counter()
+    target = replica_set.choose(user_key) if replica and not commit else None
+    connection, target = _checkout(target)
+    if replica:
+        replica_set.record(target)
+    acquired = time.perf_counter()
+    DB_ACQUIRE.observe(acquired - start, "sync")
+    profiling.record("db_connect", acquired - start)
+    with _stats_lock:
+        _stats["checkouts"] += 1
+        _stats["in_use"] += 1
+    cursor = connection.cursor()
+    try:
+        if commit:
+            # Take the write lock now, like SELECT ... FOR UPDATE does on MySQL
+            cursor.execute("BEGIN IMMEDIATE")
+        yield cursor
+        if commit:
+            cursor.execute("COMMIT")
+            replicas.note_write(user_key)
+    except BaseException as e:
+        if connection.in_transaction:
+            connection.rollback()
+        if target is not None and isinstance(e, sqlite3.OperationalError):
+            replica_set.mark_down(target, e)
+            raise replicas.ReplicaFailed(target) from e
+        raise
+    finally:
+        cursor.close()
+        with _stats_lock:
+            _stats["in_use"] -= 1
+        profiling.record("db_query", time.perf_counter() - acquired)
+
+
+def ping():
+    """Run a trivial query on this thread's connection, opening it if needed (warmup and readiness checks)"""
+    with get_db_cursor() as cursor:
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
+
+
+# User functions
+@instrument_db
+def create_user(actual_name, username, password_hash):
+    """Create a new user; `password_hash` comes from passwords.hash_password"""
+    with get_db_cursor(commit=True, user_key=username) as cursor:
+        cursor.execute(INSERT_USER, (actual_name, username, password_hash))
+
+
+@instrument_db
+@replicas.retry_on_primary
+def get_user_by_username(username):
+    """Fetch user details by username"""
+    with get_db_cursor(replica=True, user_key=username) as cursor:
+        cursor.execute(SELECT_USER_BY_USERNAME, (username,))
+        return cursor.fetchone()
+
+
+@instrument_db
+def update_password_hash(user_id, password_hash, old_password_hash):
+    """Replace a user's stored password, unless it changed since `old_password_hash` was read"""
+    with get_db_cursor(commit=True, user_key=user_id) as cursor:
+        cursor.execute(UPDATE_PASSWORD_HASH, (password_hash, user_id, old_password_hash))
+
+
+verify_password = db_helper.verify_password
+
+
+# Expense functions
+@instrument_db
+@replicas.retry_on_primary
+def fetch_expenses_for_date(expense_date, user_id):
+    logger.info("fetch_expenses_for_date called with %s, user_id=%s", expense_date, user_id)
+    with get_db_cursor(replica=True, user_key=user_id) as cursor:
+        cursor.execute(SELECT_EXPENSES_FOR_DATE, (_day(expense_date), user_id))
+        return [_expense(row) for row in cursor.fetchall()]
+
+
+def expense_range_query(user_id, start_date=None, end_date=None, category=None, min_amount=None,
+                        max_amount=None, after=None, limit=None):
+    """SQLite db_helper.expense_range_query; every bound is optional so it also serves the export"""
+    conditions = ["user_id = ?"]
+    params = [user_id]
+    if start_date is not None:
+        conditions.append("expense_date >= ?")
+        params.append(_day(start_date))
+    if end_date is not None:
+        conditions.append("expense_date <= ?")
+        params.append(_day(end_date))
+    if category is not None:
+        conditions.append("category = ?")
+        params.append(category.capitalize())
+    if min_amount is not None:
+        conditions.append("amount_cents >= ?")
+        params.append(_cents(min_amount))
+    if max_amount is not None:
+        conditions.append("amount_cents <= ?")
+        params.append(_cents(max_amount))
+    if after is not None:
+        after_date, after_id = after
+        conditions.append("(expense_date > ? OR (expense_date = ? AND id > ?))")
+        params.extend([_day(after_date), _day(after_date), after_id])
+    sql = f"""
+        SELECT id, expense_date, amount_cents, category, notes
+        FROM expenses
+        WHERE {" AND ".join(conditions)}
+        ORDER BY expense_date, id
+    """
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return sql, tuple(params)
+
+
+@instrument_db
+@replicas.retry_on_primary
+def fetch_expenses_in_range(user_id, start_date, end_date, category=None, min_amount=None, max_amount=None,
+                            after=None, limit=100):
+    """Fetch one keyset page (at most `limit` rows) of a user's expenses"""
+    logger.info("fetch_expenses_in_range called with start: %s, end: %s, user_id=%s",
+                start_date, end_date, user_id)
+    query, params = expense_range_query(user_id, start_date, end_date, category, min_amount, max_amount,
+                                        after, limit)
+    with get_db_cursor(replica=True, user_key=user_id) as cursor:
+        cursor.execute(query, params)
+        return [_expense(row) for row in cursor.fetchall()]
+
+
+@instrument_db
+def iter_expenses(user_id, start_date=None, end_date=None, batch_size=1000):
+    """
+    Yield batches of a user's expenses in (expense_date, id) order.
+    Each batch is its own keyset query, so no cursor or connection is held between batches.
+    """
+    logger.info("iter_expenses called with start: %s, end: %s, user_id=%s", start_date, end_date, user_id)
+    after = None
+    while True:
+        query, params = expense_range_query(user_id, start_date, end_date, after=after, limit=batch_size)
+        with get_db_cursor(replica=True, user_key=user_id) as cursor:
+            cursor.execute(query, params)
+            rows = [_expense(row) for row in cursor.fetchall()]
+        if not rows:
+            break
+        yield rows
+        after = (rows[-1]['expense_date'], rows[-1]['id'])
+
+
+def _update_rollups(cursor, expense_date, user_id, removed=(), added=()):
+    """Apply the net change of a write to the rollup tables, inside the caller's transaction"""
+    deltas = rollups.compute_deltas(removed=removed, added=added)
+    if not deltas:
+        return
+    day, month = _day(expense_date), _day(rollups.month_start(expense_date))
+    cursor.executemany(UPSERT_DAILY, [(user_id, day, c, _cents(t), n) for c, t, n in deltas])
+    cursor.executemany(UPSERT_MONTHLY, [(user_id, month, c, _cents(t), n) for c, t, n in deltas])
+    cursor.execute(PRUNE_DAILY, (user_id, day))
+    cursor.execute(PRUNE_MONTHLY, (user_id, month))
+
+
+def _day_totals(cursor, expense_date, user_id):
+    cursor.execute(DAY_CATEGORY_TOTALS, (_day(expense_date), user_id))
+    return [
+        {"category": row['category'], "total": _amount(row['total_cents']), "expense_count": row['expense_count']}
+        for row in cursor.fetchall()
+    ]
+
+
+def _as_date(value):
+    return value if isinstance(value, date) else date.fromisoformat(str(value))
+
+
+@instrument_db
+def delete_expenses_for_date(expense_date, user_id):
+    logger.info("delete_expenses_for_date called with %s, user_id=%s", expense_date, user_id)
+    expense_date = _as_date(expense_date)
+    with get_db_cursor(commit=True, user_key=user_id) as cursor:
+        removed = _day_totals(cursor, expense_date, user_id)
+        cursor.execute(DELETE_EXPENSES_FOR_DATE, (_day(expense_date), user_id))
+        _update_rollups(cursor, expense_date, user_id, removed=removed)
+
+
+@instrument_db
+def insert_expense(expense_date, amount, category, notes, user_id):
+    logger.info("insert_expense called with date: %s, amount: %s, category: %s, user_id=%s",
+                expense_date, amount, category, user_id)
+    expense_date = _as_date(expense_date)
+    category = category.capitalize()
+    with get_db_cursor(commit=True, user_key=user_id) as cursor:
+        cursor.execute(INSERT_EXPENSE, (_day(expense_date), _cents(amount), category, notes, user_id))
+        _update_rollups(cursor, expense_date, user_id, added=[(category, amount)])
+
+
+@instrument_db
+def replace_expenses_for_date(expense_date, expenses, user_id):
+    """Replace all of a user's expenses for a date in one transaction; see db_helper"""
+    logger.info("replace_expenses_for_date called with %s, user_id=%s", expense_date, user_id)
+    expense_date = _as_date(expense_date)
+    rows = [
+        (_day(expense_date), _cents(amount), category.capitalize(), notes, user_id)
+        for amount, category, notes in expenses
+    ]
+    with get_db_cursor(commit=True, user_key=user_id) as cursor:
+        removed = _day_totals(cursor, expense_date, user_id)
+        cursor.execute(DELETE_EXPENSES_FOR_DATE, (_day(expense_date), user_id))
+        cursor.executemany(INSERT_EXPENSE, rows)
+        _update_rollups(cursor, expense_date, user_id, removed=removed,
+                        added=[(row[2], _amount(row[1])) for row in rows])
+    return {"inserted": len(rows), "deleted": sum(int(row['expense_count']) for row in removed),
+            "categories": sorted({row['category'] for row in removed})}
+
+
+def _rows_by_id_query(verb, expense_date, user_id, ids):
+    """`verb` is a SELECT column list or DELETE, applied to the user's expenses on expense_date with these ids"""
+    placeholders = ", ".join(["?"] * len(ids))
+    sql = f"{verb} FROM expenses WHERE expense_date = ? AND user_id = ? AND id IN ({placeholders})"
+    return sql, [_day(expense_date), user_id, *ids]
+
+
+@instrument_db
+def update_expenses_for_date(expense_date, inserts, updates, deletes, user_id):
+    """Apply row-level inserts, updates and deletes for a date in one transaction; see db_helper"""
+    logger.info("update_expenses_for_date called with %s, user_id=%s: %s inserts, %s updates, %s deletes",
+                expense_date, user_id, len(inserts), len(updates), len(deletes))
+    expense_date = _as_date(expense_date)
+    inserts = [
+        (_day(expense_date), _cents(amount), category.capitalize(), notes, user_id)
+        for amount, category, notes in inserts
+    ]
+    updates = [
+        (_cents(amount), category.capitalize(), notes, expense_id, _day(expense_date), user_id)
+        for expense_id, amount, category, notes in updates
+    ]
+    ids = [row[3] for row in updates] + list(deletes)
+    with get_db_cursor(commit=True, user_key=user_id) as cursor:
+        # BEGIN IMMEDIATE already holds the write lock, so these rows cannot change underneath us
+        locked = []
+        if ids:
+            cursor.execute(*_rows_by_id_query("SELECT id, amount_cents, category", expense_date, user_id, ids))
+            locked = [_expense(row) for row in cursor.fetchall()]
+        removed = db_helper.changed_rows(ids, locked)
+        if deletes:
+            cursor.execute(*_rows_by_id_query("DELETE", expense_date, user_id, deletes))
+        cursor.executemany(UPDATE_EXPENSE, updates)
+        cursor.executemany(INSERT_EXPENSE, inserts)
+        added = [(row[1], _amount(row[0])) for row in updates] + [(row[2], _amount(row[1])) for row in inserts]
+        _update_rollups(cursor, expense_date, user_id, removed=removed, added=added)
+    return {"inserted": len(inserts), "updated": len(updates), "deleted": len(deletes),
+            "categories": sorted({row['category'] for row in removed})}
+
+
+@instrument_db
+def insert_expenses_batch(rows, user_id):
+    """Insert (expense_date, amount, category, notes) rows spanning any dates in one transaction"""
+    logger.info("insert_expenses_batch called with %s rows, user_id=%s", len(rows), user_id)
+    rows = [
+        (_as_date(expense_date), amount, category.capitalize(), notes)
+        for expense_date, amount, category, notes in rows
+    ]
+    with get_db_cursor(commit=True, user_key=user_id) as cursor:
+        cursor.executemany(INSERT_EXPENSE, [
+            (_day(expense_date), _cents(amount), category, notes, user_id)
+            for expense_date, amount, category, notes in rows
+        ])
+        # insert_statements aggregates into the daily then the monthly buckets; only the SQL differs here
+        statements = rollups.insert_statements(user_id, [(r[0], r[2], r[1]) for r in rows])
+        for upsert, (_, params, _) in zip((UPSERT_DAILY, UPSERT_MONTHLY), statements):
+            cursor.executemany(upsert, [(u, _day(bucket), c, _cents(t), n) for u, bucket, c, t, n in params])
+    return len(rows)
+
+
+def _bucket_selects(user_id, start_date, end_date, daily_columns, monthly_columns):
+    """SQLite rollups._bucket_selects: partial months from the daily rollup, whole months from the monthly"""
+    day_ranges, month_bounds = rollups.split_range(start_date, end_date)
+    selects, params = [], []
+    if day_ranges:
+        clause = " OR ".join("expense_date BETWEEN ? AND ?" for _ in day_ranges)
+        selects.append(f"SELECT {daily_columns} FROM expense_daily_rollup WHERE user_id = ? AND ({clause})")
+        params.append(user_id)
+        for first_day, last_day in day_ranges:
+            params.extend([_day(first_day), _day(last_day)])
+    if month_bounds is not None:
+        first_month, stop_month = month_bounds
+        sql = f"SELECT {monthly_columns} FROM expense_monthly_rollup WHERE user_id = ?"
+        params.append(user_id)
+        if first_month is not None:
+            sql += " AND expense_month >= ?"
+            params.append(_day(first_month))
+        if stop_month is not None:
+            sql += " AND expense_month < ?"
+            params.append(_day(stop_month))
+        selects.append(sql)
+    return " UNION ALL ".join(selects), tuple(params)
+
+
+def _category_summary(cursor, user_id, start_date, end_date):
+    buckets, params = _bucket_selects(user_id, start_date, end_date, "category, total_cents", "category, total_cents")
+    cursor.execute(f"SELECT category, SUM(total_cents) AS total_cents FROM ({buckets}) GROUP BY category", params)
+    return [{"category": row['category'], "total": _amount(row['total_cents'])} for row in cursor.fetchall()]
+
+
+def _monthly_summary_rows(cursor, user_id, start_date=None, end_date=None):
+    buckets, params = _bucket_selects(user_id, start_date, end_date,
+                                      f"{MONTH_OF_DAY} AS expense_month, total_cents", "expense_month, total_cents")
+    cursor.execute(f"""
+        SELECT expense_month, SUM(total_cents) AS total_cents
+        FROM ({buckets})
+        GROUP BY expense_month
+        ORDER BY expense_month DESC
+    """, params)
+    return [
+        {"expense_month": date.fromisoformat(row['expense_month']), "total": _amount(row['total_cents'])}
+        for row in cursor.fetchall()
+    ]
+
+
+@instrument_db
+@replicas.retry_on_primary
+def fetch_expense_summary_by_catrgory(start_date, end_date, user_id):
+    """Per-category totals for an inclusive date range, read from the rollup tables"""
+    logger.info("fetch_expense_summary called with start: %s, end: %s, user_id=%s",
+                start_date, end_date, user_id)
+    start_date, end_date = _as_date(start_date), _as_date(end_date)
+    if start_date > end_date:
+        return []
+    with get_db_cursor(replica=True, user_key=user_id) as cursor:
+        return _category_summary(cursor, user_id, start_date, end_date)
+
+
+@instrument_db
+@replicas.retry_on_primary
+def fetch_expense_summary_by_month(user_id, year=None, start_date=None, end_date=None):
+    """Total expenses per month, newest first; same result shape as db_helper"""
+    logger.info("fetch_expense_summary_by_month called with user_id=%s, year=%s, start: %s, end: %s",
+                user_id, year, start_date, end_date)
+    start_date, end_date = db_helper.monthly_summary_bounds(year, start_date, end_date)
+    if start_date is not None and end_date is not None and start_date > end_date:
+        return []
+    with get_db_cursor(replica=True, user_key=user_id) as cursor:
+        rows = _monthly_summary_rows(cursor, user_id, start_date, end_date)
+    with profiling.phase("aggregate"):
+        return db_helper.format_monthly_summary(rows)
+
+
+def _series_query(user_id, start_date, end_date, period, by_category):
+    """SQLite rollups.series_query"""
+    category = ", category" if by_category else ""
+    if period in ("day", "week"):
+        bucket = "expense_date" if period == "day" else WEEK_OF_DAY
+        sql = f"""
+            SELECT {bucket} AS bucket{category}, SUM(total_cents) AS total_cents
+            FROM expense_daily_rollup
+            WHERE user_id = ? AND expense_date BETWEEN ? AND ?
+            GROUP BY bucket{category}
+            ORDER BY bucket{category}
+        """
+        return sql, (user_id, _day(start_date), _day(end_date))
+    buckets, params = _bucket_selects(user_id, start_date, end_date,
+                                      f"{MONTH_OF_DAY} AS expense_month{category}, total_cents",
+                                      f"expense_month{category}, total_cents")
+    bucket = "expense_month" if period == "month" else YEAR_OF_MONTH
+    sql = f"""
+        SELECT {bucket} AS bucket{category}, SUM(total_cents) AS total_cents
+        FROM ({buckets})
+        GROUP BY bucket{category}
+        ORDER BY bucket{category}
+    """
+    return sql, params
+
+
+@instrument_db
+@replicas.retry_on_primary
+def fetch_expense_series(user_id, start_date, end_date, period, by_category=False):
+    """Bucketed spending, oldest first; same result shape as db_helper"""
+    logger.info("fetch_expense_series called with start: %s, end: %s, period: %s, by_category: %s, user_id=%s",
+                start_date, end_date, period, by_category, user_id)
+    start_date, end_date = _as_date(start_date), _as_date(end_date)
+    if start_date > end_date:
+        return []
+    with get_db_cursor(replica=True, user_key=user_id) as cursor:
+        cursor.execute(*_series_query(user_id, start_date, end_date, period, by_category))
+        rows = cursor.fetchall()
+    for row in rows:
+        row['bucket'] = date.fromisoformat(row['bucket'])
+        row['total'] = _amount(row.pop('total_cents'))
+    return rows
+
+
+@instrument_db
+@replicas.retry_on_primary
+def fetch_dashboard(user_id, expense_date, start_date=None, end_date=None, monthly=True):
+    """db_helper.fetch_dashboard: the three reads back to back on this thread's connection"""
+    logger.info("fetch_dashboard called with date: %s, start: %s, end: %s, user_id=%s",
+                expense_date, start_date, end_date, user_id)
+    result = {"expenses": [], "by_category": None, "by_month": None}
+    with get_db_cursor(replica=True, user_key=user_id) as cursor:
+        cursor.execute(SELECT_EXPENSES_FOR_DATE, (_day(expense_date), user_id))
+        result["expenses"] = [_expense(row) for row in cursor.fetchall()]
+        if start_date is not None and end_date is not None:
+            start_date, end_date = _as_date(start_date), _as_date(end_date)
+            result["by_category"] = []
+            if start_date <= end_date:
+                result["by_category"] = _category_summary(cursor, user_id, start_date, end_date)
+        if monthly:
+            month_rows = _monthly_summary_rows(cursor, user_id)
+    if monthly:
+        with profiling.phase("aggregate"):
+            result["by_month"] = db_helper.format_monthly_summary(month_rows)
+    return result
+
+
+# Budget functions
+@instrument_db
+def set_budget(user_id, category, monthly_limit):
+    logger.info("set_budget called with category: %s, limit: %s, user_id=%s", category, monthly_limit, user_id)
+    category = category.capitalize()
+    with get_db_cursor(commit=True, user_key=user_id) as cursor:
+        cursor.execute(UPSERT_BUDGET, (user_id, category, _cents(monthly_limit)))
+
+
+@instrument_db
+def delete_budget(user_id, category):
+    logger.info("delete_budget called with category: %s, user_id=%s", category, user_id)
+    category = category.capitalize()
+    with get_db_cursor(commit=True, user_key=user_id) as cursor:
+        cursor.execute(DELETE_BUDGET, (user_id, category))
+        return cursor.rowcount > 0
+
+
+def _budget_status_query(user_id, month, categories=None):
+    """SQLite budgets.status_query"""
+    sql = """
+        SELECT b.category, b.monthly_limit_cents, COALESCE(r.total_cents, 0) AS spent_cents
+        FROM expense_budgets AS b
+        LEFT JOIN expense_monthly_rollup AS r
+            ON r.user_id = b.user_id AND r.expense_month = ? AND r.category = b.category
+        WHERE b.user_id = ?
+    """
+    params = [_day(month), user_id]
+    if categories is not None:
+        sql += f" AND b.category IN ({', '.join('?' * len(categories))})"
+        params.extend(categories)
+    return sql + " ORDER BY b.category", tuple(params)
+
+
+@instrument_db
+@replicas.retry_on_primary
+def fetch_budget_status(user_id, month, categories=None):
+    """Budgets with the month's spending, from the running monthly totals; same shape as db_helper"""
+    logger.info("fetch_budget_status called with month: %s, categories: %s, user_id=%s", month, categories, user_id)
+    if categories is not None and not categories:
+        return []
+    month = _as_date(month)
+    with get_db_cursor(replica=True, user_key=user_id) as cursor:
+        cursor.execute(*_budget_status_query(user_id, month, categories))
+        rows = cursor.fetchall()
+    return budgets.with_status(month, [
+        {"category": row['category'], "monthly_limit": _amount(row['monthly_limit_cents']),
+         "spent": _amount(row['spent_cents'])}
+        for row in rows
+    ])
+
+
+# Rollup reconcile
+
+def reconcile_rollups(user_id=None):
+    """Recompute both rollup tables (the running totals) from `expenses`, for one user or everyone"""
+    where, params = (" WHERE user_id = ?", (user_id,)) if user_id is not None else ("", ())
+    with get_db_cursor(commit=True) as cursor:
+        cursor.execute(f"DELETE FROM expense_daily_rollup{where}", params)
+        cursor.execute(f"DELETE FROM expense_monthly_rollup{where}", params)
+        cursor.execute(f"""
+            INSERT INTO expense_daily_rollup (user_id, expense_date, category, total_cents, expense_count)
+            SELECT user_id, expense_date, category, SUM(amount_cents), COUNT(*)
+            FROM expenses{where}
+            GROUP BY user_id, expense_date, category""", params)
+        cursor.execute(f"""
+            INSERT INTO expense_monthly_rollup (user_id, expense_month, category, total_cents, expense_count)
+            SELECT user_id, {MONTH_OF_DAY} AS expense_month, category, SUM(total_cents), SUM(expense_count)
+            FROM expense_daily_rollup{where}
+            GROUP BY user_id, expense_month, category""", params)
+
+
+# Query plan checks
+
+def _plan_checks():
+    """(name, sql, params) for every query this backend sends, with representative parameters"""
+    user_id, day = 1, "2024-01-15"
+    checks = [
+        ("get_user_by_username", SELECT_USER_BY_USERNAME, ("someone",)),
+        ("fetch_expenses_for_date", SELECT_EXPENSES_FOR_DATE, (day, user_id)),
+        ("delete_expenses_for_date", DELETE_EXPENSES_FOR_DATE, (day, user_id)),
+        ("day_totals", DAY_CATEGORY_TOTALS, (day, user_id)),
+    ]
+    sql, params = expense_range_query(user_id, date(2024, 1, 1), date(2024, 3, 31),
+                                      after=(date(2024, 2, 1), 100), limit=101)
+    checks.append(("fetch_expenses_in_range", sql, params))
+    sql, params = _rows_by_id_query("SELECT id, amount_cents, category", day, user_id, [100, 101])
+    checks.append(("update_expenses_for_date", sql, params))
+    buckets, params = _bucket_selects(user_id, date(2024, 1, 15), date(2024, 4, 10), "total_cents", "total_cents")
+    checks.append(("fetch_expense_summary", buckets, params))
+    checks.append(("fetch_budget_status", *_budget_status_query(user_id, date(2024, 1, 1), ["Food", "Rent"])))
+    for period in ("week", "year"):
+        sql, params = _series_query(user_id, date(2023, 6, 10), date(2024, 4, 10), period, True)
+        checks.append((f"fetch_expense_series({period})", sql, params))
+    return checks
+
+
+def check_query_plans():
+    """EXPLAIN QUERY PLAN each query and return the ones that scan a whole table"""
+    failures = []
+    with get_db_cursor() as cursor:
+        for name, sql, params in _plan_checks():
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+            for row in cursor.fetchall():
+                # "SCAN <table>" without "USING ... INDEX" reads every row; scanning a subquery's
+                # (already filtered) result is fine
+                detail = row['detail']
+                if detail.startswith("SCAN ") and "INDEX" not in detail and not detail.startswith("SCAN (subquery"):
+                    failures.append({"query": name, "detail": detail})
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Embedded SQLite storage backend")
+    parser.add_argument("command", choices=["check-plans", "reconcile"])
+    parser.add_argument("--user-id", type=int, default=None, help="reconcile a single user")
+    args = parser.parse_args(argv)
+
+    if args.command == "reconcile":
+        reconcile_rollups(args.user_id)
+        print("Rollups rebuilt")
+        return 0
+
+    failures = check_query_plans()
+    for failure in failures:
+        print(f"FULL SCAN: {failure['query']}: {failure['detail']}")
+    print(f"{len(failures)} query plan(s) with full table scans")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,57 @@
+"""
+Storage backend selection.
+
+DB_BACKEND picks the engine behind the data-access functions:
+
+    mysql   (default) db_helper / async_db_helper against a MySQL server
+    sqlite  sqlite_db / async_sqlite_db against an embedded file (SQLITE_PATH);
+            no database server or driver needed
+
+A backend is a pair of modules exposing the functions in FUNCTIONS (sync,
+for scripts) and ASYNC_FUNCTIONS (async, for the API server). Callers use
+`storage.db` / `storage.async_db` rather than importing a backend directly.
+Schema migrations and the rollup CLI remain MySQL tools; the SQLite backend
+creates its schema on first connect.
+"""
+import importlib
+import os
+
+BACKENDS = {
+    "mysql": ("db_helper", "async_db_helper"),
+    "sqlite": ("sqlite_db", "async_sqlite_db"),
+}
+
+FUNCTIONS = (
+    "create_user", "get_user_by_username", "update_password_hash", "verify_password",
+    "fetch_expenses_for_date", "fetch_expenses_in_range", "iter_expenses",
+    "delete_expenses_for_date", "insert_expense", "replace_expenses_for_date", "update_expenses_for_date",
+    "insert_expenses_batch", "fetch_expense_summary_by_catrgory", "fetch_expense_summary_by_month",
+    "fetch_expense_series", "fetch_dashboard", "set_budget", "delete_budget", "fetch_budget_status",
+    "get_db_cursor", "get_pool_stats", "ping",
+)
+
+ASYNC_FUNCTIONS = (
+    "create_user", "get_user_by_username", "update_password_hash",
+    "fetch_expenses_for_date", "fetch_expenses_in_range", "stream_expenses",
+    "delete_expenses_for_date", "insert_expense", "replace_expenses_for_date", "update_expenses_for_date",
+    "insert_expenses_batch", "fetch_expense_summary_by_catrgory", "fetch_expense_summary_by_month",
+    "fetch_expense_series", "fetch_dashboard", "set_budget", "delete_budget", "fetch_budget_status",
+    "get_pool_stats", "close_pool", "ping",
+)
+
+
+def load(name):
+    """Import backend `name`; returns its (sync module, async module)"""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown DB_BACKEND {name!r}; expected one of {sorted(BACKENDS)}")
+    sync_name, async_name = BACKENDS[name]
+    sync_module, async_module = importlib.import_module(sync_name), importlib.import_module(async_name)
+    for module, functions in ((sync_module, FUNCTIONS), (async_module, ASYNC_FUNCTIONS)):
+        missing = [function for function in functions if not hasattr(module, function)]
+        if missing:
+            raise TypeError(f"Storage module {module.__name__} is missing {', '.join(missing)}")
+    return sync_module, async_module
+
+
+DB_BACKEND = os.getenv("DB_BACKEND", "mysql").lower()
+db, async_db = load(DB_BACKEND)
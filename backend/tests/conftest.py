@@ -0,0 +1,49 @@
+"""
+Shared setup for the backend tests: `cd backend && python -m pytest tests`.
+
+The tests run against the embedded SQLite backend in a temporary directory,
+so no MySQL server (or driver) is needed. The environment is set before any
+backend module is imported, since they read their configuration at import.
+"""
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+_tmp = tempfile.mkdtemp(prefix="expense-tests-")
+os.environ["DB_BACKEND"] = "sqlite"
+os.environ["SQLITE_PATH"] = os.path.join(_tmp, "expense_manager.db")
+os.environ["LOG_FILE"] = os.path.join(_tmp, "server.log")
+os.environ["LOG_TO_CONSOLE"] = "0"
+os.environ.pop("SQLITE_REPLICAS", None)
+os.environ.pop("ANALYTICS_CACHE_URL", None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+
+    import server
+
+    return TestClient(server.app)
+
+
+@pytest.fixture
+def make_user(client):
+    """Sign up and log in a new user; returns (user_id, auth headers)"""
+    def make():
+        username = f"user-{uuid.uuid4().hex[:12]}"
+        response = client.post("/signup", json={"username": username, "password": "Secret123", "actual_name": "Test"})
+        assert response.status_code == 200, response.text
+        body = client.post("/login", json={"username": username, "password": "Secret123"}).json()
+        return body["user"]["id"], {"Authorization": f"Bearer {body['access_token']}"}
+    return make
+
+
+@pytest.fixture
+def user(make_user):
+    return make_user()
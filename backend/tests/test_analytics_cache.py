@@ -0,0 +1,159 @@
+"""Analytics cache: generation checks against racing fills, range invalidation, and memory / Redis parity"""
+import asyncio
+from datetime import date
+
+import pytest
+
+from analytics_cache import MISS, AnalyticsCache, MemoryBackend, RedisBackend
+
+JAN = (date(2024, 1, 1), date(2024, 1, 31))
+FEB = (date(2024, 2, 1), date(2024, 2, 29))
+
+
+def memory_backend():
+    return MemoryBackend()
+
+
+def redis_backend(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")  # fakeredis needs it to run the set-if-current Lua script
+    import redis.asyncio
+
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis.asyncio, "from_url", lambda url: fakeredis.FakeAsyncRedis(server=server))
+    return lambda: RedisBackend("redis://fake")
+
+
+@pytest.fixture(params=["memory", "redis"])
+def make_cache(request, monkeypatch):
+    """Builds an AnalyticsCache on each backend; call it inside the test's event loop"""
+    backend = memory_backend if request.param == "memory" else redis_backend(monkeypatch)
+    return lambda: AnalyticsCache(backend(), ttl=60)
+
+
+async def fill(cache, user_id, endpoint, value, date_range=(None, None)):
+    await cache.set(user_id, endpoint, (), value, await cache.generation(user_id), *date_range)
+
+
+def test_fill_started_before_an_invalidation_is_not_stored(make_cache):
+    async def scenario():
+        cache = make_cache()
+        generation = await cache.generation(1)  # the fill reads its generation, then queries...
+        await cache.invalidate(1, date(2024, 1, 10))  # ...while a save commits and invalidates
+        await cache.set(1, "by_category", (), "stale", generation, *JAN)
+        assert await cache.get(1, "by_category", ()) is MISS
+        assert cache.stale_fills == 1
+
+        await fill(cache, 1, "by_category", "fresh", JAN)
+        assert await cache.get(1, "by_category", ()) == "fresh"
+        assert cache.stale_fills == 1
+
+    asyncio.run(scenario())
+
+
+def test_invalidation_only_affects_its_user(make_cache):
+    async def scenario():
+        cache = make_cache()
+        generation = await cache.generation(2)
+        await cache.invalidate(1, date(2024, 1, 10))
+        await cache.set(2, "by_category", (), "other user", generation, *JAN)
+        assert await cache.get(2, "by_category", ()) == "other user"
+
+    asyncio.run(scenario())
+
+
+def test_invalidating_a_date_evicts_only_ranges_containing_it(make_cache):
+    async def scenario():
+        cache = make_cache()
+        await fill(cache, 1, "jan", "jan", JAN)
+        await fill(cache, 1, "feb", "feb", FEB)
+        await fill(cache, 1, "all", "all")
+        await fill(cache, 1, "until_10th", "until_10th", (None, date(2024, 1, 10)))
+        await fill(cache, 1, "from_feb_15th", "from_feb_15th", (date(2024, 2, 15), None))
+        await fill(cache, 2, "jan", "other user", JAN)
+
+        assert await cache.invalidate(1, date(2024, 1, 20)) == 2
+        cached = {endpoint: await cache.get(1, endpoint, ()) for endpoint in
+                  ("jan", "feb", "all", "until_10th", "from_feb_15th")}
+        assert cached == {"jan": MISS, "feb": "feb", "all": MISS, "until_10th": "until_10th",
+                          "from_feb_15th": "from_feb_15th"}
+        assert await cache.get(2, "jan", ()) == "other user"
+
+        # A span of days (an import) evicts everything overlapping it
+        assert await cache.invalidate(1, date(2024, 1, 5), date(2024, 2, 20)) == 3
+        assert [await cache.get(1, endpoint, ()) for endpoint in ("feb", "until_10th", "from_feb_15th")] == [MISS] * 3
+
+    asyncio.run(scenario())
+
+
+def test_memory_and_redis_give_the_same_results(monkeypatch):
+    make_redis = redis_backend(monkeypatch)
+
+    async def run(backend):
+        cache, seen = AnalyticsCache(backend, ttl=60), []
+        for day in (1, 15, 31):
+            await fill(cache, 1, f"day{day}", day, (date(2024, 1, day), date(2024, 1, day)))
+        await fill(cache, 1, "jan", "jan", JAN)
+        seen.append(await cache.invalidate(1, date(2024, 1, 15)))
+        racing = await cache.generation(1)
+        seen.append(await cache.invalidate(1, date(2024, 1, 31), date(2024, 2, 3)))
+        await cache.set(1, "late", (), "late", racing, *FEB)
+        for endpoint in ("day1", "day15", "day31", "jan", "late"):
+            value = await cache.get(1, endpoint, ())
+            seen.append(None if value is MISS else value)
+        stats = await cache.stats()
+        seen.append({key: stats[key] for key in ("hits", "misses", "invalidations", "stale_fills")})
+        return seen
+
+    async def both():
+        return await run(MemoryBackend()), await run(make_redis())
+
+    memory, redis = asyncio.run(both())
+    assert memory == redis == [
+        2, 1, 1, None, None, None, None,
+        {"hits": 1, "misses": 4, "invalidations": 3, "stale_fills": 1},
+    ]
+
+
+def test_memory_backend_is_a_bounded_lru():
+    async def scenario():
+        cache = AnalyticsCache(MemoryBackend(max_entries=2), ttl=60)
+        await fill(cache, 1, "a", "a")
+        await fill(cache, 1, "b", "b")
+        await cache.get(1, "a", ())
+        await fill(cache, 1, "c", "c")
+        assert [await cache.get(1, key, ()) for key in ("a", "b", "c")] == ["a", MISS, "c"]
+        assert (await cache.stats())["evictions"] == 1
+
+        disabled = AnalyticsCache(MemoryBackend(max_entries=0), ttl=60)
+        await fill(disabled, 1, "a", "a")
+        assert await disabled.get(1, "a", ()) is MISS and disabled.stale_fills == 0
+
+    asyncio.run(scenario())
+
+
+def test_api_does_not_cache_a_result_read_before_a_save(client, user, monkeypatch):
+    """A save that commits while an analytics query runs must not leave the query's result cached"""
+    import server
+
+    user_id, headers = user
+    day = f"/expenses/{user_id}/2024-03-05"
+    params = {"start_date": "2024-03-01", "end_date": "2024-03-31"}
+    assert client.patch(day, headers=headers, json={"insert": [{"amount": 10, "category": "Food"}]}).status_code == 200
+
+    fetch = server.async_db.fetch_expense_summary_by_catrgory
+
+    async def fetch_racing_a_save(start_date, end_date, user_id):
+        summary = await fetch(start_date, end_date, user_id)
+        # The save lands after the rows were read but before the result is cached
+        await server.async_db.insert_expense(date(2024, 3, 6), 5, "Food", "", user_id)
+        await server.analytics_cache.invalidate(user_id, date(2024, 3, 6))
+        return summary
+
+    monkeypatch.setattr(server.async_db, "fetch_expense_summary_by_catrgory", fetch_racing_a_save)
+    first = client.get(f"/analytics_by_category/{user_id}", params=params, headers=headers).json()
+    monkeypatch.setattr(server.async_db, "fetch_expense_summary_by_catrgory", fetch)
+    second = client.get(f"/analytics_by_category/{user_id}", params=params, headers=headers).json()
+
+    assert [(row["category"], row["total"]) for row in first] == [("Food", 10.0)]
+    assert [(row["category"], row["total"]) for row in second] == [("Food", 15.0)]
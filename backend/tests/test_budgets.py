@@ -0,0 +1,38 @@
+"""Budget status returned by the save endpoints"""
+
+
+def budgets_by_category(response):
+    assert response.status_code == 200, response.text
+    return {budget["category"]: budget for budget in response.json()["budgets"]}
+
+
+def test_replace_reports_the_budgets_of_removed_categories(client, user):
+    user_id, headers = user
+    client.put(f"/budgets/{user_id}/food", json={"monthly_limit": 100}, headers=headers)
+    client.put(f"/budgets/{user_id}/rent", json={"monthly_limit": 50}, headers=headers)
+
+    def save(*expenses):
+        return client.post("/expenses/2024-03-09", headers=headers, json=[
+            {"amount": amount, "category": category, "notes": "", "user_id": user_id} for amount, category in expenses
+        ])
+
+    over = budgets_by_category(save((150, "food")))
+    assert over["Food"]["over_budget"] is True
+
+    # The day's Food row is replaced by a Rent one: Food's budget comes back under its limit
+    budgets = budgets_by_category(save((10, "Rent")))
+    assert (budgets["Food"]["spent"], budgets["Food"]["over_budget"]) == (0.0, False)
+    assert budgets["Rent"]["spent"] == 10.0
+
+
+def test_patch_reports_the_budgets_of_categories_rows_moved_out_of(client, user):
+    user_id, headers = user
+    client.put(f"/budgets/{user_id}/food", json={"monthly_limit": 100}, headers=headers)
+    day = f"/expenses/{user_id}/2024-03-10"
+    client.patch(day, json={"insert": [{"amount": 150, "category": "food"}]}, headers=headers)
+    expense_id = client.get(day, headers=headers).json()[0]["id"]
+
+    budgets = budgets_by_category(client.patch(day, headers=headers, json={
+        "update": [{"id": expense_id, "amount": 150, "category": "Travel"}]
+    }))
+    assert (budgets["Food"]["spent"], budgets["Food"]["over_budget"]) == (0.0, False)
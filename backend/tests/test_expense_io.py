@@ -0,0 +1,207 @@
+"""CSV / NDJSON import parsing (expense_io) and the /import and /export round trip"""
+import asyncio
+
+import pytest
+
+import expense_io
+import server
+
+HEADER = "expense_date,amount,category,notes\n"
+
+
+def parse(body, fmt="csv", chunk_size=None):
+    """All (line_number, record, error) tuples expense_io.parse yields for `body`, fed in chunk_size-byte chunks"""
+    data = body.encode() if isinstance(body, str) else body
+    size = chunk_size or max(len(data), 1)
+
+    async def chunks():
+        for start in range(0, len(data), size):
+            yield data[start:start + size]
+
+    async def collect():
+        return [record async for record in expense_io.parse(chunks(), fmt)]
+
+    return asyncio.run(collect())
+
+
+def row(expense_date, amount, category, notes=""):
+    return {"expense_date": expense_date, "amount": amount, "category": category, "notes": notes}
+
+
+# CSV parsing
+
+@pytest.mark.parametrize("chunk_size", [None, 1, 7])
+def test_quoted_commas_and_quotes(chunk_size):
+    body = HEADER + '2024-03-01,12.50,Food,"lunch, with ""Bob"""\n2024-03-02,3,Travel,"5"" screen"\n'
+    assert parse(body, chunk_size=chunk_size) == [
+        (2, row("2024-03-01", "12.50", "Food", 'lunch, with "Bob"'), None),
+        (3, row("2024-03-02", "3", "Travel", '5" screen'), None),
+    ]
+
+
+def test_quote_inside_unquoted_field_is_text():
+    assert parse(HEADER + '2024-03-01,3,Shopping,27" monitor, "used"\n') == [
+        (2, None, "Expected at most 4 fields, got 5"),
+    ]
+    assert parse(HEADER + '2024-03-01,3,Shopping,27" monitor\n') == [
+        (2, row("2024-03-01", "3", "Shopping", '27" monitor'), None),
+    ]
+
+
+@pytest.mark.parametrize("chunk_size", [None, 1, 5])
+def test_crlf_and_newlines_inside_quoted_fields(chunk_size):
+    body = (HEADER.replace("\n", "\r\n")
+            + '2024-03-01,5,Food,"line one\r\nline two"\r\n'
+            + '2024-03-02,6,Rent,"a\n\n""b"""\r\n'
+            + "2024-03-03,7,Food,plain\r\n")
+    assert parse(body, chunk_size=chunk_size) == [
+        (2, row("2024-03-01", "5", "Food", "line one\nline two"), None),
+        (4, row("2024-03-02", "6", "Rent", 'a\n\n"b"'), None),
+        (7, row("2024-03-03", "7", "Food", "plain"), None),
+    ]
+
+
+def test_unterminated_quote_at_eof():
+    body = HEADER + '2024-03-01,5,Food,ok\n2024-03-02,6,Food,"never closed\n2024-03-03,7,Food,after'
+    assert parse(body) == [
+        (2, row("2024-03-01", "5", "Food", "ok"), None),
+        (3, None, "Unterminated quoted field"),
+        # The lines after the open quote are read again as records of their own
+        (4, row("2024-03-03", "7", "Food", "after"), None),
+    ]
+
+
+def test_runaway_quote_is_cut_off_after_max_record_lines():
+    body = HEADER + '2024-03-01,5,Food,"open\n' + "2024-03-02,6,Food,x\n" * expense_io.MAX_RECORD_LINES
+    records = parse(body)
+    assert records[0] == (2, None, "Unterminated quoted field")
+    assert len(records) == 1 + expense_io.MAX_RECORD_LINES
+    assert all(error is None for _, _, error in records[1:])
+
+
+@pytest.mark.parametrize("chunk_size", [None, 1, 2])
+def test_bom_and_header(chunk_size):
+    body = "\ufeffExpense_Date, Amount ,CATEGORY\n\n2024-03-01,5,Food\n".encode()
+    assert parse(body, chunk_size=chunk_size) == [
+        (3, {"expense_date": "2024-03-01", "amount": "5", "category": "Food"}, None),
+    ]
+
+
+def test_short_rows_pad_notes_and_missing_columns_stop_the_import():
+    assert parse(HEADER + "2024-03-01,5,Food\n") == [(2, row("2024-03-01", "5", "Food"), None)]
+    assert parse("expense_date,amount\n2024-03-01,5\n") == [(1, None, "Missing column(s): category")]
+
+
+# NDJSON parsing
+
+def test_ndjson_records():
+    body = ('{"expense_date": "2024-03-01", "amount": 5, "category": "Food"}\r\n'
+            "\n"
+            "not json\n"
+            "[1, 2]\n"
+            '{"expense_date": "2024-03-02", "amount": "6.5", "category": "Rent", "notes": "a, \\"b\\""}')
+    records = parse(body, "ndjson", chunk_size=3)
+    assert records[0] == (1, {"expense_date": "2024-03-01", "amount": 5, "category": "Food"}, None)
+    assert records[1][0] == 3 and records[1][2].startswith("Invalid JSON")
+    assert records[2] == (4, None, "Expected a JSON object")
+    assert records[3] == (
+        5, {"expense_date": "2024-03-02", "amount": "6.5", "category": "Rent", "notes": 'a, "b"'}, None
+    )
+
+
+# Row validation
+
+def expense(amount, category="Food"):
+    return server.Expense(amount=amount, category=category, notes="", user_id=1)
+
+
+@pytest.mark.parametrize("amount, error", [
+    (12.5, None),
+    (0.005, None),  # rounds half up to 0.01
+    (99999999.99, None),
+    (0, "amount: must be a number greater than 0"),
+    (-3, "amount: must be a number greater than 0"),
+    (0.004, "amount: must be a number greater than 0"),
+    (float("nan"), "amount: must be a number greater than 0"),
+    (float("inf"), "amount: must be a number greater than 0"),
+    (99999999.995, f"amount: must be at most {server.MAX_AMOUNT}"),
+])
+def test_import_row_error_amounts(amount, error):
+    assert server.import_row_error(expense(amount)) == error
+
+
+def test_import_row_error_category_length():
+    assert server.import_row_error(expense(1, "x" * server.MAX_CATEGORY_LENGTH)) is None
+    assert server.import_row_error(expense(1, "x" * (server.MAX_CATEGORY_LENGTH + 1))) == \
+        f"category: must be at most {server.MAX_CATEGORY_LENGTH} characters"
+
+
+# Import / export through the API
+
+def test_import_reports_bad_rows_by_line(client, user):
+    user_id, headers = user
+    body = (HEADER
+            + "2024-03-01,5,Food,ok\n"
+            + "2024-13-01,5,Food,bad date\n"
+            + "2024-03-02,abc,Food,bad amount\n"
+            + "2024-03-03,0,Food,zero\n"
+            + '2024-03-04,5,Food,"multi\nline"\n'
+            + "2024-03-05,5,Food,a,b\n"
+            + f"2024-03-06,5,{'x' * 51},long category\n"
+            + "2024-03-07,100000000,Food,too big\n"
+            + '2024-03-08,5,Food,"open\n')
+    result = client.post(f"/import/{user_id}", content=body, headers=headers).json()
+    assert result["imported"] == 2
+    assert [(error["line"], error["error"].split(":")[0]) for error in result["errors"]] == [
+        (3, "Invalid expense_date. Use YYYY-MM-DD"),
+        (4, "amount"),
+        (5, "amount"),
+        (8, "Expected at most 4 fields, got 5"),
+        (9, "category"),
+        (10, "amount"),
+        (11, "Unterminated quoted field"),
+    ]
+    assert result["failed"] == 7 and not result["errors_truncated"]
+
+
+def test_ndjson_import(client, user):
+    user_id, headers = user
+    body = ('{"expense_date": "2024-04-01", "amount": 5.25, "category": "food", "notes": "x"}\n'
+            '{"expense_date": "2024-04-01", "amount": -1, "category": "food"}\n'
+            '{"expense_date": "2024-04-02", "amount": "7", "category": "rent"}\n')
+    result = client.post(f"/import/{user_id}?format=ndjson", content=body, headers=headers).json()
+    assert (result["imported"], result["failed"]) == (2, 1)
+    assert result["errors"][0]["line"] == 2
+    day = client.get(f"/expenses/{user_id}/2024-04-01", headers=headers).json()
+    assert [(item["amount"], item["category"], item["notes"]) for item in day] == [(5.25, "Food", "x")]
+
+
+def exported(client, user_id, headers, fmt):
+    response = client.get(f"/export/{user_id}?format={fmt}", headers=headers)
+    assert response.status_code == 200
+    return response.content
+
+
+def export_rows(content, fmt):
+    """Exported rows without their ids, as (date, amount, category, notes)"""
+    return [(r["expense_date"], str(r["amount"]), r["category"], r["notes"]) for _, r, _ in parse(content, fmt)]
+
+
+@pytest.mark.parametrize("fmt", ["csv", "ndjson"])
+def test_export_import_round_trip(client, make_user, fmt):
+    user_id, headers = make_user()
+    notes = ["plain", "comma, inside", 'quote "inside"', "two\nlines", "trailing \"", "café ☕", ""]
+    for day, note in enumerate(notes, 1):
+        response = client.patch(f"/expenses/{user_id}/2024-05-{day:02d}", headers=headers, json={
+            "insert": [{"amount": 10 + day / 100, "category": "Food", "notes": note},
+                       {"amount": 99999999.99, "category": "Rent", "notes": note}]
+        })
+        assert response.status_code == 200, response.text
+    original = exported(client, user_id, headers, fmt)
+
+    other_id, other_headers = make_user()
+    result = client.post(f"/import/{other_id}?format={fmt}", content=original, headers=other_headers).json()
+    assert (result["imported"], result["failed"]) == (2 * len(notes), 0)
+
+    assert export_rows(exported(client, other_id, other_headers, fmt), fmt) == export_rows(original, fmt)
+    assert ("2024-05-04", "99999999.99", "Rent", "two\nlines") in export_rows(original, fmt)
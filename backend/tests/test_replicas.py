@@ -0,0 +1,203 @@
+"""Read-replica routing: read-your-writes stickiness, mark-down and recovery, and retrying on the primary"""
+import asyncio
+import sqlite3
+import time
+import uuid
+from datetime import date
+
+import pytest
+
+import replicas
+import sqlite_db
+
+
+class Clock:
+    def __init__(self):
+        # Ahead of the real clock, so writes other tests recorded are long past
+        self.now = time.monotonic() + 3600
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(replicas, "time", clock)
+    monkeypatch.setattr(replicas, "READ_AFTER_WRITE_SECONDS", 5.0)
+    monkeypatch.setattr(replicas, "RETRY_SECONDS", 30.0)
+    return clock
+
+
+def user_key():
+    return f"user-{uuid.uuid4().hex}"
+
+
+# Routing
+
+def test_reads_take_replicas_in_turn(clock):
+    replica_set = replicas.ReplicaSet(["r1", "r2"])
+    assert [replica_set.choose(user_key()) for _ in range(4)] == ["r1", "r2", "r1", "r2"]
+    assert replicas.ReplicaSet([]).choose(user_key()) is None
+
+
+def test_reads_stick_to_the_primary_after_a_write(clock):
+    replica_set = replicas.ReplicaSet(["r1"])
+    writer, other = user_key(), user_key()
+    replicas.note_write(writer)
+
+    clock.now += 4.9
+    assert replica_set.choose(writer) is None
+    assert replica_set.choose(other) == "r1"
+    assert replica_set.choose(None) == "r1"
+
+    clock.now += 0.2
+    assert replica_set.choose(writer) == "r1"
+
+
+def test_a_later_write_extends_the_window(clock):
+    replica_set = replicas.ReplicaSet(["r1"])
+    writer = user_key()
+    replicas.note_write(writer)
+    clock.now += 4
+    replicas.note_write(writer)
+    clock.now += 4
+    assert replica_set.choose(writer) is None
+    clock.now += 1.1
+    assert replica_set.choose(writer) == "r1"
+
+
+def test_a_replica_marked_down_is_skipped_until_its_cooldown_ends(clock):
+    replica_set = replicas.ReplicaSet(["r1", "r2"])
+    replica_set.mark_down("r1", ConnectionError("refused"))
+    assert [replica_set.choose(user_key()) for _ in range(3)] == ["r2", "r2", "r2"]
+    assert [replica["healthy"] for replica in replica_set.stats()["replicas"]] == [False, True]
+
+    clock.now += 30
+    assert {replica_set.choose(user_key()) for _ in range(4)} == {"r1", "r2"}
+    assert [replica["healthy"] for replica in replica_set.stats()["replicas"]] == [True, True]
+
+
+def test_every_replica_down_falls_back_to_the_primary(clock):
+    replica_set = replicas.ReplicaSet(["r1", "r2"])
+    replica_set.mark_down("r1", ConnectionError("refused"))
+    clock.now += 10
+    replica_set.mark_down("r2", ConnectionError("refused"))
+    assert replica_set.choose(user_key()) is None
+
+    clock.now += 20  # r1's cooldown is over, r2's is not
+    assert [replica_set.choose(user_key()) for _ in range(2)] == ["r1", "r1"]
+
+
+def test_read_counts(clock):
+    replica_set = replicas.ReplicaSet(["r1"])
+    for replica in ("r1", None, "r1"):
+        replica_set.record(replica)
+    assert replica_set.stats() == {"replicas": [{"replica": "r1", "healthy": True, "reads": 2}], "primary_reads": 1}
+
+
+# Retrying on the primary
+
+def test_retry_on_primary_reruns_a_failed_read_pinned_to_the_primary(clock):
+    replica_set = replicas.ReplicaSet(["r1"])
+    routes = []
+
+    @replicas.retry_on_primary
+    def read():
+        replica = replica_set.choose(user_key())
+        routes.append(replica)
+        if replica is not None:
+            raise replicas.ReplicaFailed(replica)
+        return "rows"
+
+    assert read() == "rows"
+    assert routes == ["r1", None]
+    assert replica_set.choose(user_key()) == "r1"  # only the retry is pinned
+
+
+def test_retry_on_primary_retries_once_and_wraps_coroutines(clock):
+    calls = []
+
+    @replicas.retry_on_primary
+    async def read():
+        calls.append(replicas._primary_only.get())
+        raise replicas.ReplicaFailed("r1")
+
+    with pytest.raises(replicas.ReplicaFailed):
+        asyncio.run(read())
+    assert calls == [False, True]
+
+
+def test_parse_hosts():
+    assert replicas.parse_hosts(" db2:3307, db3 ,", 3306) == [("db2", 3307), ("db3", 3306)]
+    assert replicas.parse_hosts(None, 3306) == []
+
+
+# Routing on the SQLite backend
+
+@pytest.fixture
+def sqlite_replica(tmp_path, monkeypatch, clock):
+    """Point sqlite_db at a read-only replica file; returns a function that copies the primary into it"""
+    path = str(tmp_path / "replica.db")
+    monkeypatch.setattr(sqlite_db, "replica_set", replicas.ReplicaSet([path]))
+
+    def sync():
+        with sqlite_db.get_db_cursor() as cursor:
+            cursor.execute("PRAGMA wal_checkpoint")
+        source, target = sqlite3.connect(sqlite_db.SQLITE_PATH), sqlite3.connect(path)
+        source.backup(target)
+        source.close()
+        target.close()
+        sqlite_db.close_all()  # drop cached replica connections
+
+    yield path, sync
+    sqlite_db.close_all()
+
+
+def amounts(user_id, day):
+    return [row['amount'] for row in sqlite_db.fetch_expenses_for_date(day, user_id)]
+
+
+def test_sqlite_reads_follow_the_replica_and_stick_after_writes(user, sqlite_replica, clock):
+    user_id, _ = user
+    path, sync = sqlite_replica
+    day = date(2024, 3, 5)
+    sqlite_db.insert_expense(day, 10, "Food", "", user_id)
+    sync()
+    sqlite_db.insert_expense(day, 20, "Food", "", user_id)
+
+    assert amounts(user_id, day) == [10, 20]  # just wrote: the primary
+    clock.now += 6
+    assert amounts(user_id, day) == [10]  # the replica lags behind
+    assert sqlite_db.replica_set.stats()["replicas"][0]["reads"] == 1
+
+
+def test_sqlite_read_failing_on_its_replica_is_retried_on_the_primary(user, sqlite_replica, clock):
+    user_id, _ = user
+    path, sync = sqlite_replica
+    day = date(2024, 3, 6)
+    sqlite_db.insert_expense(day, 10, "Food", "", user_id)
+    sync()
+    clock.now += 6
+    assert amounts(user_id, day) == [10]  # opens a connection to the replica
+
+    broken = sqlite3.connect(path)
+    broken.execute("DROP TABLE expenses")
+    broken.commit()
+    broken.close()
+
+    assert amounts(user_id, day) == [10]
+    stats = sqlite_db.replica_set.stats()
+    assert stats["replicas"][0]["healthy"] is False
+    assert amounts(user_id, day) == [10]
+    assert sqlite_db.replica_set.stats()["replicas"][0]["reads"] == stats["replicas"][0]["reads"]
+
+
+def test_sqlite_unreadable_replica_falls_back_to_the_primary(user, sqlite_replica, clock):
+    user_id, _ = user
+    day = date(2024, 3, 7)
+    sqlite_db.insert_expense(day, 10, "Food", "", user_id)
+    clock.now += 6
+    assert amounts(user_id, day) == [10]  # the replica file was never created
+    assert sqlite_db.replica_set.stats()["replicas"][0]["healthy"] is False
+    assert sqlite_db.replica_set.stats()["primary_reads"] == 1
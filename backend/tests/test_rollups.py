@@ -0,0 +1,276 @@
+"""Rollup maintenance on the SQLite backend, range splitting, and the verify / reconcile CLI"""
+import random
+from contextlib import contextmanager
+from datetime import date, timedelta
+from decimal import Decimal
+
+import pytest
+
+import db_helper
+import rollups
+import sqlite_db
+
+CATEGORIES = ["food", "Rent", "TRAVEL", "Shopping"]
+
+
+def rollup_rows(user_id):
+    """(daily, monthly) rollup buckets of a user, as {(bucket, category): (total_cents, count)}"""
+    with sqlite_db.get_db_cursor() as cursor:
+        cursor.execute("SELECT expense_date AS bucket, category, total_cents, expense_count "
+                       "FROM expense_daily_rollup WHERE user_id = ?", (user_id,))
+        daily = {(r['bucket'], r['category']): (r['total_cents'], r['expense_count']) for r in cursor.fetchall()}
+        cursor.execute("SELECT expense_month AS bucket, category, total_cents, expense_count "
+                       "FROM expense_monthly_rollup WHERE user_id = ?", (user_id,))
+        monthly = {(r['bucket'], r['category']): (r['total_cents'], r['expense_count']) for r in cursor.fetchall()}
+    return daily, monthly
+
+
+def grouped_expenses(user_id):
+    """The same buckets computed with a fresh GROUP BY over `expenses`"""
+    with sqlite_db.get_db_cursor() as cursor:
+        cursor.execute("SELECT expense_date AS bucket, category, SUM(amount_cents) AS total, COUNT(*) AS n "
+                       "FROM expenses WHERE user_id = ? GROUP BY bucket, category", (user_id,))
+        daily = {(r['bucket'], r['category']): (r['total'], r['n']) for r in cursor.fetchall()}
+        cursor.execute(f"SELECT {sqlite_db.MONTH_OF_DAY} AS bucket, category, SUM(amount_cents) AS total, "
+                       "COUNT(*) AS n FROM expenses WHERE user_id = ? GROUP BY bucket, category", (user_id,))
+        monthly = {(r['bucket'], r['category']): (r['total'], r['n']) for r in cursor.fetchall()}
+    return daily, monthly
+
+
+def day_ids(expense_date, user_id):
+    return [row['id'] for row in sqlite_db.fetch_expenses_for_date(expense_date, user_id)]
+
+
+# Write path
+
+def test_rollups_match_group_by_after_mixed_writes(user):
+    user_id, _ = user
+    jan31, feb1, feb29 = date(2024, 1, 31), date(2024, 2, 1), date(2024, 2, 29)
+
+    sqlite_db.insert_expense(jan31, 12.345, "food", "", user_id)
+    sqlite_db.replace_expenses_for_date(feb1, [(0.125, "food", ""), (5, "rent", ""), (2.675, "Food", "")], user_id)
+    sqlite_db.insert_expenses_batch([(jan31, 1.005, "travel", ""), (feb29, 7, "Food", ""), (feb1, 3.5, "Rent", "")],
+                                    user_id)
+    first, second, third, _ = day_ids(feb1, user_id)
+    sqlite_db.update_expenses_for_date(feb1, [(4.445, "Shopping", "")],
+                                       [(first, 9.99, "Rent", ""), (second, 5, "Travel", "")], [third], user_id)
+    sqlite_db.replace_expenses_for_date(feb29, [], user_id)
+    sqlite_db.delete_expenses_for_date(jan31, user_id)
+    sqlite_db.insert_expense(jan31, 0.005, "food", "", user_id)
+
+    daily, monthly = rollup_rows(user_id)
+    assert (daily, monthly) == grouped_expenses(user_id)
+    assert daily == {
+        ("2024-01-31", "Food"): (1, 1),
+        ("2024-02-01", "Rent"): (999 + 350, 2),
+        ("2024-02-01", "Travel"): (500, 1),
+        ("2024-02-01", "Shopping"): (445, 1),
+    }
+    assert monthly[("2024-02-01", "Rent")] == (1349, 2)
+    assert ("2024-02-01", "Food") not in monthly  # emptied buckets are pruned
+
+
+def test_rollups_match_group_by_after_random_writes(user):
+    user_id, _ = user
+    rng = random.Random(20240229)
+    days = [date(2024, 1, 30) + timedelta(days=offset) for offset in range(35)]
+
+    def amount():
+        return round(rng.uniform(0.001, 500), rng.choice([0, 1, 2, 3]))
+
+    def new_rows(limit):
+        return [(amount(), rng.choice(CATEGORIES), "") for _ in range(rng.randint(0, limit))]
+
+    for _ in range(300):
+        day = rng.choice(days)
+        operation = rng.choice(["insert", "replace", "patch", "delete", "batch"])
+        if operation == "insert":
+            sqlite_db.insert_expense(day, amount(), rng.choice(CATEGORIES), "", user_id)
+        elif operation == "replace":
+            sqlite_db.replace_expenses_for_date(day, new_rows(4), user_id)
+        elif operation == "patch":
+            ids = day_ids(day, user_id)
+            rng.shuffle(ids)
+            split = rng.randint(0, len(ids))
+            updates = [(expense_id, amount(), rng.choice(CATEGORIES), "") for expense_id in ids[:split]]
+            deletes = ids[split:split + rng.randint(0, len(ids) - split)]
+            sqlite_db.update_expenses_for_date(day, new_rows(2), updates, deletes, user_id)
+        elif operation == "delete":
+            sqlite_db.delete_expenses_for_date(day, user_id)
+        else:
+            sqlite_db.insert_expenses_batch(
+                [(rng.choice(days), amount(), rng.choice(CATEGORIES), "") for _ in range(rng.randint(1, 6))], user_id
+            )
+
+    daily, monthly = rollup_rows(user_id)
+    assert daily and (daily, monthly) == grouped_expenses(user_id)
+    assert all(count > 0 for _, count in list(daily.values()) + list(monthly.values()))
+
+
+def test_summaries_read_from_rollups_match_raw_sums(user):
+    user_id, _ = user
+    rng = random.Random(7)
+    sqlite_db.insert_expenses_batch([
+        (date(2024, 1, 1) + timedelta(days=rng.randrange(120)), round(rng.uniform(1, 100), 2),
+         rng.choice(CATEGORIES), "")
+        for _ in range(400)
+    ], user_id)
+    start, end = date(2024, 1, 17), date(2024, 3, 9)
+    with sqlite_db.get_db_cursor() as cursor:
+        cursor.execute("SELECT category, SUM(amount_cents) AS total FROM expenses "
+                       "WHERE user_id = ? AND expense_date BETWEEN ? AND ? GROUP BY category",
+                       (user_id, start.isoformat(), end.isoformat()))
+        expected = {row['category']: Decimal(row['total']).scaleb(-2) for row in cursor.fetchall()}
+    summary = sqlite_db.fetch_expense_summary_by_catrgory(start, end, user_id)
+    assert {row['category']: Decimal(str(row['total'])) for row in summary} == expected
+
+
+def test_amounts_round_half_up_once():
+    assert rollups.to_decimal(0.125) == Decimal("0.13")
+    assert rollups.to_decimal(2.675) == Decimal("2.68")
+    assert rollups.to_decimal(-0.125) == Decimal("-0.13")
+    assert rollups.to_decimal(rollups.to_decimal(1.005)) == Decimal("1.01")
+
+
+def test_compute_deltas_nets_removed_and_added_rows():
+    removed = [{"category": "Food", "total": Decimal("10.00"), "expense_count": 2},
+               {"category": "Rent", "total": Decimal("5.00"), "expense_count": 1}]
+    added = [("Food", 4), ("Food", 6), ("Rent", 2.5), ("Rent", 2.5), ("Travel", 0.125)]
+    # Food is unchanged and left out; Rent nets to zero money but still gains a row
+    assert {category: (total, count) for category, total, count in rollups.compute_deltas(removed, added)} == {
+        "Rent": (Decimal("0.00"), 1),
+        "Travel": (Decimal("0.13"), 1),
+    }
+
+
+# Read path
+
+@pytest.mark.parametrize("start, end, day_ranges, month_bounds", [
+    # Mid-month to mid-month: partial months at both ends, whole months between
+    (date(2024, 1, 15), date(2024, 4, 10),
+     [(date(2024, 1, 15), date(2024, 1, 31)), (date(2024, 4, 1), date(2024, 4, 10))],
+     (date(2024, 2, 1), date(2024, 4, 1))),
+    # Mid-month to mid-month of the next month: no whole month, one day range
+    (date(2024, 1, 15), date(2024, 2, 10), [(date(2024, 1, 15), date(2024, 2, 10))], None),
+    (date(2024, 1, 15), date(2024, 1, 20), [(date(2024, 1, 15), date(2024, 1, 20))], None),
+    # Exactly whole months, including a leap February
+    (date(2024, 1, 1), date(2024, 3, 31), [], (date(2024, 1, 1), date(2024, 4, 1))),
+    (date(2024, 2, 1), date(2024, 2, 29), [], (date(2024, 2, 1), date(2024, 3, 1))),
+    (date(2024, 2, 1), date(2024, 2, 28), [(date(2024, 2, 1), date(2024, 2, 28))], None),
+    # Last day of one month to first day of the next
+    (date(2023, 12, 31), date(2024, 1, 1), [(date(2023, 12, 31), date(2024, 1, 1))], None),
+    (date(2024, 1, 31), date(2024, 3, 1),
+     [(date(2024, 1, 31), date(2024, 1, 31)), (date(2024, 3, 1), date(2024, 3, 1))],
+     (date(2024, 2, 1), date(2024, 3, 1))),
+    # Open-ended ranges
+    (None, date(2024, 3, 15), [(date(2024, 3, 1), date(2024, 3, 15))], (None, date(2024, 3, 1))),
+    (date(2024, 3, 15), None, [(date(2024, 3, 15), date(2024, 3, 31))], (date(2024, 4, 1), None)),
+    (date(2024, 3, 1), None, [], (date(2024, 3, 1), None)),
+    (None, None, [], (None, None)),
+])
+def test_split_range(start, end, day_ranges, month_bounds):
+    assert rollups.split_range(start, end) == (day_ranges, month_bounds)
+
+
+def covered_days(day_ranges, month_bounds):
+    days = []
+    for first_day, last_day in day_ranges:
+        days.extend(first_day + timedelta(days=n) for n in range((last_day - first_day).days + 1))
+    if month_bounds is not None:
+        month, stop = month_bounds
+        while month < stop:
+            following = rollups.next_month(month)
+            days.extend(month + timedelta(days=n) for n in range((following - month).days))
+            month = following
+    return days
+
+
+def test_split_range_covers_each_day_once():
+    rng = random.Random(1)
+    for _ in range(2000):
+        start = date(2023, 11, 1) + timedelta(days=rng.randrange(200))
+        end = start + timedelta(days=rng.randrange(120))
+        days = covered_days(*rollups.split_range(start, end))
+        assert sorted(days) == [start + timedelta(days=n) for n in range((end - start).days + 1)]
+
+
+# Verify / reconcile
+
+class FakeCursor:
+    """Answers rollups.verify's four queries from canned rows and records everything else"""
+
+    def __init__(self, expenses, daily, monthly):
+        self.results = {"raw_daily": expenses[0], "raw_monthly": expenses[1], "daily": daily, "monthly": monthly}
+        self.executed = []
+        self.last = None
+
+    def execute(self, sql, params=()):
+        self.executed.append((" ".join(sql.split()), params))
+        if "FROM expenses" in sql and "SUM(amount)" in sql:
+            self.last = "raw_daily" if "expense_date AS bucket" in sql else "raw_monthly"
+        elif sql.lstrip().startswith("SELECT"):
+            self.last = "daily" if "FROM expense_daily_rollup" in sql else "monthly"
+        else:
+            self.last = None
+
+    def fetchall(self):
+        return self.results[self.last] if self.last else []
+
+
+def bucket(user_id, day, category, total, count):
+    return {"user_id": user_id, "bucket": day, "category": category, "total": total, "expense_count": count}
+
+
+def fake_database(monkeypatch, drifted):
+    jan, feb = date(2024, 1, 1), date(2024, 2, 1)
+    expenses = ([bucket(1, jan, "Food", Decimal("10.00"), 2), bucket(2, feb, "Rent", Decimal("3.00"), 1)],
+                [bucket(1, jan, "Food", Decimal("10.00"), 2), bucket(2, feb, "Rent", Decimal("3.00"), 1)])
+    daily = [bucket(1, jan, "food", Decimal("10.00"), 2), bucket(2, feb, "Rent", Decimal("3.00"), 1)]
+    monthly = [bucket(1, jan, "Food", Decimal("10.00"), 2), bucket(2, feb, "Rent", Decimal("3.00"), 1)]
+    if drifted:
+        daily[1] = bucket(2, feb, "Rent", Decimal("3.01"), 1)
+        monthly.append(bucket(2, jan, "Travel", Decimal("1.00"), 1))
+    cursor = FakeCursor(expenses, daily, monthly)
+
+    @contextmanager
+    def get_db_cursor(commit=False, **kwargs):
+        yield cursor
+
+    monkeypatch.setattr(db_helper, "get_db_cursor", get_db_cursor)
+    return cursor
+
+
+def test_verify_reports_drifted_buckets(monkeypatch, capsys):
+    cursor = fake_database(monkeypatch, drifted=True)
+    drift = rollups.verify(cursor)
+    assert [(d["table"], d["user_id"], d["category"], d["expected"], d["actual"]) for d in drift] == [
+        ("daily", 2, "Rent", (Decimal("3.00"), 1), (Decimal("3.01"), 1)),
+        ("monthly", 2, "Travel", None, (Decimal("1.00"), 1)),
+    ]
+    assert rollups.main(["verify"]) == 1
+    assert "2 drifted bucket(s)" in capsys.readouterr().out
+
+
+def test_verify_passes_when_in_step(monkeypatch, capsys):
+    fake_database(monkeypatch, drifted=False)
+    assert rollups.main(["verify"]) == 0
+    assert "0 drifted bucket(s)" in capsys.readouterr().out
+
+
+def test_reconcile_rebuilds_only_drifted_users(monkeypatch, capsys):
+    cursor = fake_database(monkeypatch, drifted=True)
+    assert rollups.main(["reconcile"]) == 0
+    assert "2 drifted bucket(s), rollups rebuilt for 1 user(s)" in capsys.readouterr().out
+    rebuilt = [params for sql, params in cursor.executed if sql.startswith("DELETE FROM expense_daily_rollup")]
+    assert rebuilt == [(2,)]
+
+
+def test_sqlite_reconcile_repairs_drift(user):
+    user_id, _ = user
+    sqlite_db.insert_expenses_batch([(date(2024, 6, 3), 4.5, "Food", ""), (date(2024, 6, 30), 2, "Rent", "")], user_id)
+    with sqlite_db.get_db_cursor(commit=True) as cursor:
+        cursor.execute("UPDATE expense_daily_rollup SET total_cents = total_cents + 1 WHERE user_id = ?", (user_id,))
+        cursor.execute("DELETE FROM expense_monthly_rollup WHERE user_id = ?", (user_id,))
+    assert rollup_rows(user_id) != grouped_expenses(user_id)
+    sqlite_db.main(["reconcile", "--user-id", str(user_id)])
+    assert rollup_rows(user_id) == grouped_expenses(user_id)
@@ -1,29 +1,37 @@
 import streamlit as st
 from datetime import datetime, date
-import requests
-import os
-API_URL = os.getenv("API_URL", "https://expense-tracking-system-app.onrender.com")
+import api_cache
+import api_client
+import budget_panel
 
 
+def expenses_read(user_id, expense_date):
+    """(path, params, start_date, end_date) of one day's expense list, as api_client reads it"""
+    return f"/expenses/{user_id}/{expense_date.strftime('%Y-%m-%d')}", None, expense_date, expense_date
+
+
+def current_read(user_id):
+    """The read add_update_tab is about to make, from the date picker's current value"""
+    return expenses_read(user_id, st.session_state.get("expense_date", datetime.today().date()))
 
 
 def add_update_tab(user_id, token):
-    selected_date = st.date_input("Enter Date", value=datetime.today().date(), label_visibility="collapsed")
+    selected_date = st.date_input("Enter Date", value=datetime.today().date(), key="expense_date",
+                                  label_visibility="collapsed")
     selected_date_str = selected_date.strftime("%Y-%m-%d")
 
+    # Budgets the last save pushed close to or past their limit
+    budget_panel.show_alerts(st.session_state.pop("budget_alerts", None))
+
     # Create a unique key based on date to force form reset when date changes
     form_key = f"expense_form_{selected_date_str}"
 
     # GET expenses for the logged-in user
     try:
-        headers = {"Authorization": f"Bearer {token}"}
-        response = requests.get(
-            f"{API_URL}/expenses/{user_id}/{selected_date_str}",
-            headers=headers
-        )
+        response = api_client.get_cached(user_id, token, *expenses_read(user_id, selected_date))
 
         if response.status_code == 200:
-            existing_expenses = response.json()
+            existing_expenses = api_client.rows(response.json())
             st.write(f"There are {len(existing_expenses)} expenses on this date")
         else:
             st.warning(f"No expenses found for this date (Status: {response.status_code})")
@@ -43,12 +51,13 @@ def add_update_tab(user_id, token):
         with col3:
             st.text("Notes")
 
-        expenses = []
+        inserts, updates, deletes = [], [], []
         for i in range(5):
-            if i < len(existing_expenses):
-                amount = existing_expenses[i]['amount']
-                category = existing_expenses[i]["category"]
-                notes = existing_expenses[i]["notes"]
+            existing = existing_expenses[i] if i < len(existing_expenses) else None
+            if existing is not None:
+                amount = float(existing['amount'])
+                category = existing["category"]
+                notes = existing["notes"] or ""
             else:
                 amount = 0.0
                 category = "Shopping"
@@ -84,36 +93,64 @@ def add_update_tab(user_id, token):
                     label_visibility="collapsed"
                 )
 
-            expenses.append({
-                'amount': amount_input,
-                'category': category_input,
-                'notes': notes_input,
-                'user_id': user_id
-            })
+            # Only rows the user changed are sent: new rows with an amount, edited rows, and
+            # existing rows whose amount was cleared to 0 (deleted)
+            expense = {'amount': amount_input, 'category': category_input, 'notes': notes_input}
+            if existing is None:
+                if amount_input > 0:
+                    inserts.append(expense)
+            elif amount_input <= 0:
+                deletes.append(existing['id'])
+            elif (amount_input, category_input, notes_input) != (amount, categories[category_index], notes):
+                updates.append({'id': existing['id'], **expense})
 
         submit_button = st.form_submit_button("Save Expenses")
         if submit_button:
-            # Filter out empty expenses (only keep rows with amount > 0)
-            filtered_expenses = [expense for expense in expenses if expense['amount'] > 0]
-
-            if len(filtered_expenses) == 0:
-                st.warning("No expenses to save. Please enter at least one expense with amount > 0.")
+            if not (inserts or updates or deletes):
+                st.info("No changes to save.")
             else:
-                # Send expenses with authorization header
-                headers = {"Authorization": f"Bearer {token}"}
-                response = requests.post(
-                    f"{API_URL}/expenses/{selected_date_str}",
-                    json=filtered_expenses,
-                    headers=headers
+                # Not retried: a repeated insert would add the row twice
+                response = api_client.patch(
+                    f"/expenses/{user_id}/{selected_date_str}",
+                    token,
+                    json={"insert": inserts, "update": updates, "delete": deletes}
                 )
                 if response.status_code == 200:
-                    st.success(f"Successfully saved {len(filtered_expenses)} expense(s)!")
+                    # This day's list and every analytics range containing it are now stale
+                    api_cache.invalidate(user_id, selected_date)
+                    st.session_state.budget_alerts = response.json().get("budgets")
+                    st.success(f"Saved: {len(inserts)} added, {len(updates)} updated, {len(deletes)} deleted")
                     st.rerun()
+                elif response.status_code == 409:
+                    # The day changed elsewhere since it was loaded; show the current rows
+                    api_cache.invalidate(user_id, selected_date)
+                    st.error(f"These expenses changed since they were loaded: {response.json().get('detail')}")
                 else:
                     st.error(f"Failed to update expenses: {response.text}")
 
-
-
-
-
-
+    # Bulk import from a bank statement or another tool's export
+    with st.expander("Import expenses from a file"):
+        st.caption("CSV with columns expense_date (YYYY-MM-DD), amount, category, notes - or NDJSON with the same fields")
+        uploaded_file = st.file_uploader("Statement file", type=["csv", "ndjson", "jsonl"], key="import_file")
+        if uploaded_file is not None and st.button("Import", key="import_button"):
+            file_format = "csv" if uploaded_file.name.lower().endswith(".csv") else "ndjson"
+            try:
+                # Passing the file object streams it instead of building the body in memory
+                response = api_client.post(
+                    f"/import/{user_id}",
+                    token,
+                    params={"format": file_format},
+                    data=uploaded_file
+                )
+                if response.status_code == 200:
+                    result = response.json()
+                    # Imported rows can fall on any date
+                    api_cache.invalidate(user_id)
+                    st.success(f"Imported {result['imported']} expense(s)")
+                    if result['failed']:
+                        st.warning(f"{result['failed']} row(s) could not be imported")
+                        st.table(result['errors'])
+                else:
+                    st.error(f"Import failed: {response.text}")
+            except Exception as e:
+                st.error(f"Error connecting to API: {str(e)}")
@@ -1,10 +1,24 @@
 import streamlit as st
 from datetime import datetime, timedelta
 import requests
+import api_client
 import pandas as pd
 import plotly.express as px
-import os
-API_URL = os.getenv("API_URL", "https://expense-tracking-system-app.onrender.com")
+
+
+def analytics_read(user_id, start_date, end_date):
+    """(path, params, start_date, end_date) of the category summary, as api_client reads it"""
+    params = {"start_date": start_date.strftime("%Y-%m-%d"), "end_date": end_date.strftime("%Y-%m-%d")}
+    return f"/analytics_by_category/{user_id}", params, start_date, end_date
+
+
+def current_read(user_id):
+    """The read analytics_category_tab is about to make, from the date pickers' current values"""
+    today = datetime.now().date()
+    start_date = st.session_state.get("analytics_start_date", today - timedelta(days=30))
+    end_date = st.session_state.get("analytics_end_date", today)
+    return analytics_read(user_id, start_date, end_date)
+
 
 def analytics_category_tab(user_id, token):
     st.title("Expense Analytics By Category")
@@ -29,18 +43,9 @@ def analytics_category_tab(user_id, token):
         st.error("Start date must be before end date!")
         return
 
-    # Convert dates to strings
-    start_date_str = start_date.strftime("%Y-%m-%d")
-    end_date_str = end_date.strftime("%Y-%m-%d")
-
     # Fetch analytics data
     try:
-        headers = {"Authorization": f"Bearer {token}"}
-        response = requests.get(
-            f"{API_URL}/analytics_by_category/{user_id}",
-            params={"start_date": start_date_str, "end_date": end_date_str},
-            headers=headers
-        )
+        response = api_client.get_cached(user_id, token, *analytics_read(user_id, start_date, end_date))
 
         if response.status_code == 404:
             st.info("No expense data found for the selected date range.")
@@ -56,7 +61,7 @@ def analytics_category_tab(user_id, token):
             st.info("No expenses found in the selected date range. Add some expenses to see analytics!")
             return
 
-        # Create DataFrame
+        # Create DataFrame (the API sends columnar JSON: one list per column)
         df = pd.DataFrame(analytics_data)
 
         # Check if required columns exist
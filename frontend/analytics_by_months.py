@@ -1,9 +1,13 @@
 import streamlit as st
 from datetime import datetime
 import requests
+import api_client
 import pandas as pd
-import os
-API_URL = os.getenv("API_URL", "https://expense-tracking-system-app.onrender.com")
+
+
+def current_read(user_id):
+    """(path, params, start_date, end_date) of the monthly summary, as api_client reads it"""
+    return f"/analytics_by_months/{user_id}", None, None, None
 
 
 def analytics_months_tab(user_id, token):
@@ -11,11 +15,7 @@ def analytics_months_tab(user_id, token):
 
     # GET monthly summary for the logged-in user
     try:
-        headers = {"Authorization": f"Bearer {token}"}
-        response = requests.get(
-            f"{API_URL}/analytics_by_months/{user_id}",
-            headers=headers
-        )
+        response = api_client.get_cached(user_id, token, *current_read(user_id))
 
         if response.status_code == 404:
             st.info("No monthly data available. Start by adding some expenses!")
@@ -31,7 +31,7 @@ def analytics_months_tab(user_id, token):
             st.info("No expense data available yet. Add some expenses to see analytics!")
             return
 
-        # Create DataFrame
+        # Create DataFrame (the API sends columnar JSON: one list per column)
         df = pd.DataFrame(monthly_summary)
 
         # Check required columns exist
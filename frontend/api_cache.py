@@ -0,0 +1,64 @@
+import streamlit as st
+import time
+import os
+
+# Seconds a successful GET is reused across reruns before it is fetched again
+API_CACHE_TTL = float(os.getenv("API_CACHE_TTL", "60"))
+
+
+def _entries():
+    # Per browser session, so one user's data never reaches another session
+    if "api_cache" not in st.session_state:
+        st.session_state.api_cache = {}
+    return st.session_state.api_cache
+
+
+def _key(user_id, endpoint, params):
+    return (user_id, endpoint, tuple(sorted((params or {}).items())))
+
+
+def contains(user_id, endpoint, params):
+    entry = _entries().get(_key(user_id, endpoint, params))
+    return entry is not None and entry[0] > time.monotonic()
+
+
+def store(user_id, endpoint, params, response, start_date=None, end_date=None):
+    """Cache `response` if it succeeded; see cached_get for the date range"""
+    if response.status_code == 200:
+        _entries()[_key(user_id, endpoint, params)] = (time.monotonic() + API_CACHE_TTL, start_date, end_date, response)
+
+
+def cached_get(user_id, endpoint, params, fetch, start_date=None, end_date=None):
+    """
+    Return the cached response for (user_id, endpoint, params), or call fetch() and cache it if it
+    succeeded. start_date/end_date give the inclusive date range the data covers (None = unbounded),
+    so a save only invalidates the entries that include the saved day.
+    """
+    if contains(user_id, endpoint, params):
+        return _entries()[_key(user_id, endpoint, params)][3]
+    response = fetch()
+    store(user_id, endpoint, params, response, start_date, end_date)
+    return response
+
+
+def invalidate(user_id, day=None):
+    """Drop the user's entries whose date range includes `day` (every entry of the user if day is None)"""
+    entries = _entries()
+    for key in list(entries):
+        _, start_date, end_date, _ = entries[key]
+        if key[0] != user_id:
+            continue
+        if day is None or ((start_date is None or start_date <= day) and (end_date is None or day <= end_date)):
+            del entries[key]
+
+
+def drop(user_id, endpoint):
+    """Drop the user's entries for `endpoint`, whatever their params (after changing what it returns)"""
+    entries = _entries()
+    for key in list(entries):
+        if key[0] == user_id and key[1] == endpoint:
+            del entries[key]
+
+
+def clear():
+    _entries().clear()
@@ -0,0 +1,160 @@
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+import api_cache
+import threading
+import json
+import time
+import os
+
+API_URL = os.getenv("API_URL", "https://expense-tracking-system-app.onrender.com")
+
+# (connect, read) timeouts in seconds; a cold-starting backend can take a while to answer
+TIMEOUT = (float(os.getenv("API_CONNECT_TIMEOUT", "5")), float(os.getenv("API_READ_TIMEOUT", "60")))
+
+# Attempts after the first for connection errors and 5xx responses, with exponential backoff
+RETRIES = int(os.getenv("API_RETRIES", "3"))
+RETRY_BACKOFF = float(os.getenv("API_RETRY_BACKOFF", "0.5"))
+
+# Keep-alive connections kept open to API_URL
+POOL_SIZE = int(os.getenv("API_POOL_SIZE", "10"))
+
+# Tabular endpoints answer this with one list per column instead of a list of row objects
+COLUMNAR_JSON = "application/vnd.expense.columnar+json"
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Process-wide session, so every rerun and every user reuses the same open connections"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def request(method, path, token=None, retry=True, **kwargs):
+    """
+    Send a request to the API. With retry=True, connection errors and 5xx responses are retried
+    RETRIES times with exponential backoff; only pass it for requests that are safe to repeat.
+    """
+    headers = kwargs.pop("headers", {})
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    attempts = RETRIES + 1 if retry else 1
+    for attempt in range(attempts):
+        last_attempt = attempt == attempts - 1
+        try:
+            response = get_session().request(method, f"{API_URL}{path}", headers=headers, timeout=TIMEOUT, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if last_attempt:
+                raise
+        else:
+            if response.status_code < 500 or last_attempt:
+                return response
+        time.sleep(RETRY_BACKOFF * 2 ** attempt)
+
+
+def get(path, token=None, params=None):
+    """GET preferring columnar JSON; endpoints without a columnar form answer with plain JSON"""
+    headers = {"Accept": f"{COLUMNAR_JSON}, application/json;q=0.9"}
+    return request("GET", path, token, params=params, headers=headers)
+
+
+def post(path, token=None, retry=False, **kwargs):
+    return request("POST", path, token, retry=retry, **kwargs)
+
+
+def patch(path, token=None, retry=False, **kwargs):
+    return request("PATCH", path, token, retry=retry, **kwargs)
+
+
+def rows(data):
+    """Columnar JSON ({column: [values]}) -> list of row dicts; lists of rows pass through"""
+    if isinstance(data, list):
+        return data
+    return [dict(zip(data, values)) for values in zip(*data.values())]
+
+
+# Cached reads
+
+def get_cached(user_id, token, path, params=None, start_date=None, end_date=None):
+    """GET through the session's api_cache; start_date/end_date is the date range the data covers"""
+    return api_cache.cached_get(user_id, path, params, lambda: get(path, token, params), start_date, end_date)
+
+
+def _fetch_quietly(path, token, params):
+    try:
+        return get(path, token, params)
+    except requests.exceptions.RequestException:
+        return None  # the tab fetches again and reports the error itself
+
+
+def prefetch(user_id, token, reads):
+    """
+    Fetch the uncached ones of `reads` - (path, params, start_date, end_date) tuples - concurrently
+    and cache them, so the tabs that render next find their data already loaded.
+    """
+    missing = [read for read in reads if not api_cache.contains(user_id, read[0], read[1])]
+    if not missing:
+        return
+    # Worker threads only do HTTP; the cache lives in session state, which is written from this thread
+    with ThreadPoolExecutor(max_workers=len(missing)) as pool:
+        responses = list(pool.map(lambda read: _fetch_quietly(read[0], token, read[1]), missing))
+    for (path, params, start_date, end_date), response in zip(missing, responses):
+        if response is not None:
+            api_cache.store(user_id, path, params, response, start_date, end_date)
+
+
+class _Part:
+    """Stands in for a requests.Response holding one section of the /dashboard payload"""
+
+    status_code = 200
+
+    def __init__(self, data):
+        self._data = data
+
+    def json(self):
+        return self._data
+
+    @property
+    def text(self):
+        return json.dumps(self._data)
+
+
+def prefetch_dashboard(user_id, token, day_read, category_read, months_read, other_reads=()):
+    """
+    Load the three tabs' reads with a single GET /dashboard and cache each section under its own
+    read, so the tabs (and save invalidation) work exactly as with separate calls. Falls back to
+    prefetch() if the combined call fails. `other_reads`, for tabs /dashboard doesn't cover, are
+    fetched concurrently with it.
+    """
+    reads = [day_read, category_read, months_read]
+    need_dashboard = not all(api_cache.contains(user_id, path, params) for path, params, _, _ in reads)
+    missing = [read for read in other_reads if not api_cache.contains(user_id, read[0], read[1])]
+    if not need_dashboard and not missing:
+        return
+    params = {"expense_date": day_read[2].strftime("%Y-%m-%d"), **category_read[1]}
+    with ThreadPoolExecutor(max_workers=len(missing) + 1) as pool:
+        dashboard = pool.submit(_fetch_quietly, f"/dashboard/{user_id}", token, params) if need_dashboard else None
+        responses = list(pool.map(lambda read: _fetch_quietly(read[0], token, read[1]), missing))
+        response = dashboard.result() if dashboard else None
+    for (path, read_params, start_date, end_date), other in zip(missing, responses):
+        if other is not None:
+            api_cache.store(user_id, path, read_params, other, start_date, end_date)
+    if not need_dashboard:
+        return
+    if response is None or response.status_code != 200:
+        prefetch(user_id, token, reads)
+        return
+    data = response.json()
+    sections = ["expenses", "analytics_by_category", "analytics_by_months"]
+    for (path, params, start_date, end_date), section in zip(reads, sections):
+        api_cache.store(user_id, path, params, _Part(data[section]), start_date, end_date)
@@ -1,10 +1,16 @@
 import streamlit as st
-import requests
+import api_cache
+import api_client
+import add_update
+import analytics_by_category
+import analytics_by_months
+import spending_trends
+import budget_panel
 from add_update import add_update_tab
 from analytics_by_category import analytics_category_tab
 from analytics_by_months import analytics_months_tab
-import os
-API_URL = os.getenv("API_URL", "https://expense-tracking-system-app.onrender.com")
+from spending_trends import spending_trends_tab
+from budget_panel import budget_tab
 
 st.set_page_config(page_title="Expense Tracking System", layout="wide")
 st.title("Expense Tracking System")
@@ -28,7 +34,8 @@ if st.session_state.user is None:
 
         if st.button("Login", key="login_button"):
             try:
-                response = requests.post(f"{API_URL}/login", json={
+                # Logging in has no side effects, so a cold-start 5xx can be retried
+                response = api_client.post("/login", retry=True, json={
                     "username": username,
                     "password": password
                 })
@@ -56,7 +63,7 @@ if st.session_state.user is None:
 
         if st.button("Signup", key="signup_button"):
             try:
-                response = requests.post(f"{API_URL}/signup", json={
+                response = api_client.post("/signup", json={
                     "actual_name": actual_name,
                     "username": username_s,
                     "password": password_s
@@ -80,9 +87,25 @@ else:
         if st.button("Logout", key="logout_button"):
             st.session_state.user = None
             st.session_state.token = None
+            api_cache.clear()
             st.rerun()
 
-    tab1, tab2, tab3 = st.tabs(["Add/Update", "Analytics By Category", "Analytics By Months"])
+    # st.tabs renders every tab on every run; load their data with one combined call (plus the
+    # trends series and budgets alongside it) up front
+    api_client.prefetch_dashboard(
+        st.session_state.user["id"], st.session_state.token,
+        add_update.current_read(st.session_state.user["id"]),
+        analytics_by_category.current_read(st.session_state.user["id"]),
+        analytics_by_months.current_read(st.session_state.user["id"]),
+        other_reads=[
+            spending_trends.current_read(st.session_state.user["id"]),
+            budget_panel.current_read(st.session_state.user["id"])
+        ]
+    )
+
+    tab1, tab2, tab3, tab4, tab5 = st.tabs(
+        ["Add/Update", "Analytics By Category", "Analytics By Months", "Spending Trends", "Budgets"]
+    )
 
     with tab1:
         add_update_tab(user_id=st.session_state.user["id"], token=st.session_state.token)
@@ -93,5 +116,11 @@ else:
     with tab3:
         analytics_months_tab(user_id=st.session_state.user["id"], token=st.session_state.token)
 
+    with tab4:
+        spending_trends_tab(user_id=st.session_state.user["id"], token=st.session_state.token)
+
+    with tab5:
+        budget_tab(user_id=st.session_state.user["id"], token=st.session_state.token)
+
 
 
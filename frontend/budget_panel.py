@@ -0,0 +1,130 @@
+import streamlit as st
+from datetime import datetime, timedelta
+import requests
+import api_cache
+import api_client
+import pandas as pd
+
+CATEGORIES = ["Rent", "Food", "Shopping", "Entertainment", "Other"]
+
+# Saves report budgets used at least this much (percent) back on the Add/Update tab
+WARN_PERCENT = 80
+
+
+def month_bounds(day):
+    """First and last day of the month containing `day`"""
+    first_day = day.replace(day=1)
+    last_day = (first_day + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return first_day, last_day
+
+
+def budgets_read(user_id, month):
+    """(path, params, start_date, end_date) of the budget status for `month`, as api_client reads it"""
+    first_day, last_day = month_bounds(month)
+    return f"/budgets/{user_id}", {"month": first_day.strftime("%Y-%m")}, first_day, last_day
+
+
+def current_read(user_id):
+    """The read budget_tab is about to make, from the month picker's current value"""
+    return budgets_read(user_id, st.session_state.get("budget_month", datetime.now().date()))
+
+
+def show_alerts(budgets):
+    """Warn about the budgets a save pushed past WARN_PERCENT (budgets from a save response)"""
+    for budget in budgets or []:
+        if budget["over_budget"]:
+            st.error(f"{budget['category']} is over budget: ₹{budget['spent']:.2f} of ₹{budget['monthly_limit']:.2f}")
+        elif budget["percent_used"] is not None and budget["percent_used"] >= WARN_PERCENT:
+            st.warning(f"{budget['category']} has used {budget['percent_used']:.0f}% of its ₹{budget['monthly_limit']:.2f} budget")
+
+
+def budget_tab(user_id, token):
+    st.title("Monthly Budgets")
+
+    month = st.date_input("Month", value=datetime.now().date(), key="budget_month",
+                          help="Any day in the month to check")
+    first_day, _ = month_bounds(month)
+
+    try:
+        response = api_client.get_cached(user_id, token, *budgets_read(user_id, month))
+
+        if response.status_code != 200:
+            st.error(f"Failed to retrieve budgets: {response.text}")
+            return
+
+        budgets = api_client.rows(response.json())
+
+        if not budgets:
+            st.info("No budgets set yet. Add one below to track a category's monthly spending.")
+        else:
+            # Display summary metrics
+            over = [budget for budget in budgets if budget["over_budget"]]
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.metric("Budgeted", f"₹{sum(budget['monthly_limit'] for budget in budgets):.2f}")
+            with col2:
+                st.metric("Spent", f"₹{sum(budget['spent'] for budget in budgets):.2f}")
+            with col3:
+                st.metric("Over Budget", len(over))
+
+            st.divider()
+
+            # One progress bar per category
+            st.subheader(f"Budgets for {first_day.strftime('%B %Y')}")
+            for budget in budgets:
+                used = budget["percent_used"] or 0
+                label = (f"**{budget['category']}**: ₹{budget['spent']:.2f} of ₹{budget['monthly_limit']:.2f} "
+                         f"({used:.0f}%)")
+                if budget["over_budget"]:
+                    label += f" - over by ₹{-budget['remaining']:.2f}"
+                st.progress(min(used / 100, 1.0), text=label)
+
+            # Display table
+            df_display = pd.DataFrame(budgets)[["category", "monthly_limit", "spent", "remaining", "percent_used"]]
+            for column in ("monthly_limit", "spent", "remaining"):
+                df_display[column] = df_display[column].map("₹{:.2f}".format)
+            df_display["percent_used"] = df_display["percent_used"].map("{:.1f}%".format)
+            df_display.columns = ["Category", "Monthly Limit", "Spent", "Remaining", "Used"]
+            df_display.index = range(1, len(df_display) + 1)
+            st.table(df_display)
+
+        st.divider()
+
+        # Set or remove a category's limit; limits apply to every month
+        st.subheader("Set a Budget")
+        current = {budget["category"]: budget["monthly_limit"] for budget in budgets}
+        col1, col2 = st.columns(2)
+        with col1:
+            category = st.selectbox("Category", CATEGORIES, key="budget_category")
+        with col2:
+            limit = st.number_input("Monthly Limit (₹)", min_value=0.0, step=100.0,
+                                    value=float(current.get(category, 0.0)), key=f"budget_limit_{category}")
+
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("Save Budget", key="budget_save"):
+                if limit <= 0:
+                    st.error("Enter a monthly limit greater than 0")
+                else:
+                    response = api_client.request("PUT", f"/budgets/{user_id}/{category}", token,
+                                                  json={"monthly_limit": limit})
+                    if response.status_code == 200:
+                        api_cache.drop(user_id, f"/budgets/{user_id}")
+                        st.rerun()
+                    else:
+                        st.error(f"Failed to save budget: {response.text}")
+        with col2:
+            if category in current and st.button(f"Remove {category} Budget", key="budget_remove"):
+                response = api_client.request("DELETE", f"/budgets/{user_id}/{category}", token)
+                if response.status_code in (200, 404):
+                    api_cache.drop(user_id, f"/budgets/{user_id}")
+                    st.rerun()
+                else:
+                    st.error(f"Failed to remove budget: {response.text}")
+
+    except requests.exceptions.ConnectionError:
+        st.error("Cannot connect to the API. Make sure the FastAPI server is running.")
+    except Exception as e:
+        st.error(f"An error occurred: {str(e)}")
+        import traceback
+        st.code(traceback.format_exc())
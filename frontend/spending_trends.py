@@ -0,0 +1,153 @@
+import streamlit as st
+from datetime import datetime, timedelta
+import requests
+import api_client
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+PERIODS = {"Day": "day", "Week": "week", "Month": "month", "Year": "year"}
+
+
+def series_read(user_id, start_date, end_date, period, by_category, window):
+    """(path, params, start_date, end_date) of the spending series, as api_client reads it"""
+    params = {
+        "start_date": start_date.strftime("%Y-%m-%d"),
+        "end_date": end_date.strftime("%Y-%m-%d"),
+        "period": period,
+        "by_category": "true" if by_category else "false",
+        "window": window
+    }
+    return f"/analytics_series/{user_id}", params, start_date, end_date
+
+
+def current_read(user_id):
+    """The read spending_trends_tab is about to make, from its inputs' current values"""
+    today = datetime.now().date()
+    return series_read(
+        user_id,
+        st.session_state.get("trends_start_date", today - timedelta(days=365)),
+        st.session_state.get("trends_end_date", today),
+        PERIODS[st.session_state.get("trends_period", "Month")],
+        st.session_state.get("trends_by_category", False),
+        st.session_state.get("trends_window", 3)
+    )
+
+
+def spending_trends_tab(user_id, token):
+    st.title("Spending Trends")
+
+    # Range and bucketing
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        start_date = st.date_input(
+            "Start Date",
+            value=datetime.now() - timedelta(days=365),
+            key="trends_start_date"
+        )
+    with col2:
+        end_date = st.date_input(
+            "End Date",
+            value=datetime.now(),
+            key="trends_end_date"
+        )
+    with col3:
+        period_label = st.selectbox("Group By", list(PERIODS), index=2, key="trends_period")
+    with col4:
+        window = st.number_input("Rolling Window", min_value=1, max_value=366, value=3, key="trends_window")
+    by_category = st.checkbox("Break down by category", key="trends_by_category")
+
+    # Validate date range
+    if start_date > end_date:
+        st.error("Start date must be before end date!")
+        return
+
+    period = PERIODS[period_label]
+
+    try:
+        response = api_client.get_cached(
+            user_id, token, *series_read(user_id, start_date, end_date, period, by_category, window)
+        )
+
+        if response.status_code == 400:
+            st.warning(response.json().get("detail", "Invalid range"))
+            return
+
+        if response.status_code != 200:
+            st.error(f"Failed to retrieve spending trends: {response.text}")
+            return
+
+        series_data = response.json()
+
+        if not series_data:
+            st.info("No expenses found in the selected date range. Add some expenses to see trends!")
+            return
+
+        # Create DataFrame (the API sends columnar JSON: one list per column)
+        df = pd.DataFrame(series_data)
+        df['bucket'] = pd.to_datetime(df['bucket'])
+
+        # Summary metrics over the whole range
+        totals = df.groupby('bucket')['total'].sum()
+        latest_change = totals.pct_change().iloc[-1] * 100 if len(totals) > 1 else None
+
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Total Spent", f"₹{totals.sum():.2f}")
+        with col2:
+            st.metric(f"Average/{period_label}", f"₹{totals.mean():.2f}")
+        with col3:
+            st.metric(
+                f"Latest {period_label}", f"₹{totals.iloc[-1]:.2f}",
+                f"{latest_change:+.1f}%" if latest_change is not None and pd.notna(latest_change) else None,
+                delta_color="inverse"
+            )
+
+        st.divider()
+
+        # Spending per bucket with its rolling average
+        st.subheader(f"Spending per {period_label}")
+        if by_category:
+            fig = px.bar(df, x='bucket', y='total', color='category',
+                         color_discrete_sequence=px.colors.qualitative.Pastel)
+            fig.update_layout(barmode='stack', xaxis_title=None, yaxis_title="Amount (₹)")
+        else:
+            fig = go.Figure()
+            fig.add_bar(x=df['bucket'], y=df['total'], name="Total")
+            fig.add_scatter(x=df['bucket'], y=df['rolling_avg'], mode='lines+markers',
+                            name=f"{window}-{period} average")
+            fig.update_layout(xaxis_title=None, yaxis_title="Amount (₹)")
+        st.plotly_chart(fig, use_container_width=True)
+
+        # Running total
+        st.subheader("Cumulative Spending")
+        if by_category:
+            fig = px.area(df, x='bucket', y='cumulative', color='category',
+                          color_discrete_sequence=px.colors.qualitative.Pastel)
+        else:
+            fig = px.area(df, x='bucket', y='cumulative')
+        fig.update_layout(xaxis_title=None, yaxis_title="Amount (₹)")
+        st.plotly_chart(fig, use_container_width=True)
+
+        st.divider()
+
+        # Display table
+        st.subheader("Trend Table")
+        df_display = df.sort_values(by='bucket', ascending=False).copy()
+        df_display['bucket'] = df_display['bucket'].dt.strftime("%Y-%m-%d")
+        for column in ('total', 'rolling_avg', 'cumulative', 'change'):
+            df_display[column] = df_display[column].map(lambda value: "" if pd.isna(value) else f"₹{value:.2f}")
+        df_display['change_pct'] = df_display['change_pct'].map(lambda value: "" if pd.isna(value) else f"{value:+.1f}%")
+        df_display = df_display.rename(columns={
+            'bucket': period_label, 'category': 'Category', 'total': 'Total', 'rolling_avg': 'Rolling Avg',
+            'cumulative': 'Cumulative', 'change': 'Change', 'change_pct': 'Change %'
+        })
+        df_display.index = range(1, len(df_display) + 1)
+        st.dataframe(df_display, use_container_width=True)
+
+    except requests.exceptions.ConnectionError:
+        st.error("Cannot connect to the API. Make sure the FastAPI server is running.")
+    except Exception as e:
+        st.error(f"An error occurred: {str(e)}")
+        import traceback
+        st.code(traceback.format_exc())